@@ -76,9 +76,31 @@ DATABASES = {
         'OPTIONS': {
             'init_command': "SET sql_mode='STRICT_TRANS_TABLES'",
         },
+        # اتصالات دائمة: كل thread (طلب أو worker للأدوات) يعيد استخدام اتصاله حتى هذا العمر بالثواني
+        'CONN_MAX_AGE': int(os.getenv("DB_CONN_MAX_AGE", "60")),
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 
+# Django cache: الحالة المشتركة بين العمليات (نسخة الكتالوج، عدادات admission، ProviderGateway، قدرات النماذج)
+# مع REDIS_URL (مثلاً redis://127.0.0.1:6379/1) تكون مشتركة بين كل workers الـ gunicorn/ASGI.
+# بدونها LocMemCache لكل عملية: تعديل الكتالوج يُبطل فهرس البحث ونتائج الأدوات فوراً في العملية التي نفذته فقط،
+# وبقية العمليات تبقى على البيانات القديمة حتى AI_CATALOG_INDEX_TTL / AI_TOOL_CACHE_TTL، وحدود admission لكل عملية
+REDIS_URL = os.getenv("REDIS_URL", "")
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
 # تحديد موديل المستخدم المخصص (RE-FR-01)
 AUTH_USER_MODEL = 'trip_plan.User'
 
@@ -126,7 +148,123 @@ SIMPLE_JWT = {
 
 # إعدادات OpenRouter للذكاء الاصطناعي
 OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
+# يمكن توجيهه لخادم محلي وهمي أثناء اختبارات الحمل (python manage.py mock_openrouter)
+OPENROUTER_API_URL = os.getenv("OPENROUTER_API_URL", "https://openrouter.ai/api/v1/chat/completions")
 AI_MODEL = os.getenv("AI_MODEL", "anthropic/claude-3.5-sonnet")
 
+# توجيه النماذج حسب مرحلة المحادثة (gather: جمع المتطلبات، plan: الخيارات والتأكيد، repair: إصلاح JSON)
+# كل مرحلة قائمة مرشحين بالترتيب، و AI_MODEL هو الخيار الأخير دائماً؛ بدون إعداد تستخدم كل المراحل AI_MODEL
+# AI_FAST_MODEL اختصار لتوجيه gather و repair لنموذج صغير سريع
+AI_FAST_MODEL = os.getenv("AI_FAST_MODEL", "")
+AI_MODEL_ROUTES = {"gather": [AI_FAST_MODEL], "repair": [AI_FAST_MODEL]} if AI_FAST_MODEL else {}
+# يُتجاوز المرشح إذا تجاوزت نسبة أخطائه (ضمن آخر 200 استدعاء) هذا الحد أو تجاوز p50 ميزانية زمن المرحلة
+AI_ROUTER_MAX_ERROR_RATE = float(os.getenv("AI_ROUTER_MAX_ERROR_RATE", "0.25"))
+AI_ROUTER_LATENCY_BUDGET_MS = {"gather": 4000, "repair": 4000}
+# أقل عدد قياسات قبل الحكم على نموذج، ومدة (ثوانٍ) بدون قياسات قبل إعادة تجربة نموذج متجاوز
+AI_ROUTER_MIN_SAMPLES = int(os.getenv("AI_ROUTER_MIN_SAMPLES", "5"))
+AI_ROUTER_RETRY_AFTER = int(os.getenv("AI_ROUTER_RETRY_AFTER", "60"))
+
+# structured output: json_schema (مشتق من AIStructuredResponseSerializer) أو json_object أو off
+# النموذج الذي يرفض response_format يُنزّل تلقائياً للوضع الأضعف؛ يمكن تحديد وضع لكل نموذج:
+# AI_STRUCTURED_OUTPUT_MODELS = {"some/model": "json_object"}
+AI_STRUCTURED_OUTPUT = os.getenv("AI_STRUCTURED_OUTPUT", "json_schema")
+AI_STRUCTURED_OUTPUT_MODELS = {}
+
+# بادئات النماذج التي تحتاج علامة cache_control صريحة على الـ system prompt (prompt caching لدى المزود)
+AI_PROMPT_CACHE_CONTROL_PREFIXES = ("anthropic/", "google/gemini")
+
+# الحد الأقصى لعدد النتائج التي تعيدها أداة البحث (يُطبق كـ LIMIT داخل الاستعلام)
+AI_SEARCH_MAX_RESULTS = int(os.getenv("AI_SEARCH_MAX_RESULTS", "50"))
+# حجم الصفحة الافتراضي لنتائج البحث المرسلة للـ LLM عند عدم تحديد limit
+AI_SEARCH_DEFAULT_LIMIT = int(os.getenv("AI_SEARCH_DEFAULT_LIMIT", "8"))
+
+# مصدر البحث: index (فهرس NumPy داخل ذاكرة العملية) أو db (استعلام SQL واحد)
+AI_SEARCH_BACKEND = os.getenv("AI_SEARCH_BACKEND", "index")
+# أقصى عمر (بالثواني) لنسخة الفهرس قبل إعادة بنائها، لتعديلات تمت من عمليات أخرى
+AI_CATALOG_INDEX_TTL = int(os.getenv("AI_CATALOG_INDEX_TTL", "300"))
+
+# كاش نتائج أدوات الـ Agent (يُبطل تلقائياً عند تعديل الكتالوج من لوحة الإدارة)
+AI_TOOL_CACHE_ENABLED = os.getenv("AI_TOOL_CACHE_ENABLED", "True") == "True"
+AI_TOOL_CACHE_SIZE = int(os.getenv("AI_TOOL_CACHE_SIZE", "1024"))
+AI_TOOL_CACHE_TTL = int(os.getenv("AI_TOOL_CACHE_TTL", "600"))
+
+# كاش ردود الـ LLM لبادئات المحادثة المتطابقة (معطل افتراضياً)؛ الـ backend: local أو django
+AI_LLM_CACHE_ENABLED = os.getenv("AI_LLM_CACHE_ENABLED", "False") == "True"
+AI_LLM_CACHE_BACKEND = os.getenv("AI_LLM_CACHE_BACKEND", "local")
+AI_LLM_CACHE_SIZE = int(os.getenv("AI_LLM_CACHE_SIZE", "512"))
+AI_LLM_CACHE_TTL = int(os.getenv("AI_LLM_CACHE_TTL", "900"))
+
+# عميل HTTP المشترك لطلبات OpenRouter (connection pool + keep-alive)
+AI_HTTP_POOL_CONNECTIONS = int(os.getenv("AI_HTTP_POOL_CONNECTIONS", "4"))
+AI_HTTP_POOL_SIZE = int(os.getenv("AI_HTTP_POOL_SIZE", "10"))
+AI_HTTP_CONNECT_TIMEOUT = float(os.getenv("AI_HTTP_CONNECT_TIMEOUT", "5"))
+AI_HTTP_READ_TIMEOUT = float(os.getenv("AI_HTTP_READ_TIMEOUT", "30"))
+
+# تخزين نتائج الأدوات التي يتجاوز طولها الحد (حرف) في جدول ToolResultBlob بدل سجل الجلسة
+# (السجل يحمل ملخصاً ومرجعاً، والنموذج يسترجع التفاصيل بأداة get_tool_result)
+AI_TOOL_RESULT_OFFLOAD = os.getenv("AI_TOOL_RESULT_OFFLOAD", "True") == "True"
+AI_TOOL_RESULT_OFFLOAD_MIN_CHARS = int(os.getenv("AI_TOOL_RESULT_OFFLOAD_MIN_CHARS", "300"))
+
+# عدد الـ threads لتنفيذ عدة tool_calls من نفس الجولة بالتوازي (1 = تنفيذ متتابع)
+AI_TOOL_MAX_WORKERS = int(os.getenv("AI_TOOL_MAX_WORKERS", "4"))
+
+# ميزانية tokens لسجل المحادثة المرسل للـ LLM؛ الأدوار الأقدم تُضغط في ملخص تراكمي
+AI_HISTORY_TOKEN_BUDGET = int(os.getenv("AI_HISTORY_TOKEN_BUDGET", "3000"))
+AI_HISTORY_SUMMARY_MAX_CHARS = int(os.getenv("AI_HISTORY_SUMMARY_MAX_CHARS", "1500"))
+
+# استخراج المتطلبات من رسالة المستخدم بقواعد محلية وطرح سؤال gather_info التالي بدون استدعاء الـ LLM
+AI_REQUIREMENTS_FAST_PATH = os.getenv("AI_REQUIREMENTS_FAST_PATH", "True") == "True"
+
+# تنفيذ أداة البحث استباقياً عند اكتمال الميزانية/الأيام/الأشخاص (يوفر جولة LLM لإنتاج نداء البحث)
+# تجريبي ومعطل افتراضياً؛ نسبة التوفير الفعلية في speculative_search ضمن /api/admin/ai-metrics/
+AI_SPECULATIVE_SEARCH = os.getenv("AI_SPECULATIVE_SEARCH", "False") == "True"
+
+# مهام وضع searching الخلفية (عند تفعيل AI_ENABLE_SEARCHING_FIRST_RESPONSE؛ ينفذها python manage.py run_agent_worker)
+# عدد المحاولات لكل مهمة، والمدة (ثوانٍ) التي تُعتبر بعدها مهمة running متوقفة وتُحجز من جديد
+AI_JOB_MAX_ATTEMPTS = int(os.getenv("AI_JOB_MAX_ATTEMPTS", "3"))
+AI_JOB_STALE_AFTER = int(os.getenv("AI_JOB_STALE_AFTER", "300"))
+# فترة انتظار العامل (ثوانٍ) عندما يكون الطابور فارغاً
+AI_JOB_POLL_INTERVAL = float(os.getenv("AI_JOB_POLL_INTERVAL", "1.0"))
+
+# دمج طلبات الـ LLM والأدوات المتطابقة الجارية في نفس الوقت داخل العملية (طلب واحد للمزود والباقي ينتظر نتيجته)
+AI_SINGLE_FLIGHT_ENABLED = os.getenv("AI_SINGLE_FLIGHT_ENABLED", "True") == "True"
+
+# التحكم في قبول طلبات /api/ai/chat/ (العدادات في Django cache؛ تكون مشتركة بين العمليات مع Redis/Memcached)
+# حد الطلبات المتزامنة للخدمة كلها ولكل مستخدم
+AI_ADMISSION_ENABLED = os.getenv("AI_ADMISSION_ENABLED", "True") == "True"
+AI_ADMISSION_MAX_CONCURRENT = int(os.getenv("AI_ADMISSION_MAX_CONCURRENT", "32"))
+AI_ADMISSION_MAX_PER_USER = int(os.getenv("AI_ADMISSION_MAX_PER_USER", "2"))
+# أقصى عدد طلبات منتظرة وأقصى مدة انتظار (ثوانٍ) قبل الرد بـ 429 و Retry-After
+AI_ADMISSION_MAX_QUEUE = int(os.getenv("AI_ADMISSION_MAX_QUEUE", "64"))
+AI_ADMISSION_MAX_WAIT = float(os.getenv("AI_ADMISSION_MAX_WAIT", "5"))
+# عمر عدادات المقاعد (ثوانٍ) لتحريرها إذا توقفت عملية دون تحريرها
+AI_ADMISSION_SLOT_TTL = int(os.getenv("AI_ADMISSION_SLOT_TTL", "300"))
+
+# بوابة الطلبات الصادرة لمزود الـ LLM (الحالة مشتركة بين العمليات عبر Django cache)
+# token bucket: معدل الطلبات في الثانية والدفعة القصوى (0 = بدون حد)
+AI_PROVIDER_RATE_PER_SEC = float(os.getenv("AI_PROVIDER_RATE_PER_SEC", "10"))
+AI_PROVIDER_BURST = int(os.getenv("AI_PROVIDER_BURST", "20"))
+# أقصى انتظار (ثوانٍ) لتوكن أو لانتهاء Retry-After قبل الرد بخطأ فوري
+AI_PROVIDER_MAX_WAIT = float(os.getenv("AI_PROVIDER_MAX_WAIT", "10"))
+# circuit breaker: عدد الإخفاقات (5xx/timeout) خلال النافذة لفتح الدائرة، ومدة بقائها مفتوحة (ثوانٍ)
+AI_PROVIDER_BREAKER_FAILURES = int(os.getenv("AI_PROVIDER_BREAKER_FAILURES", "5"))
+AI_PROVIDER_BREAKER_WINDOW = int(os.getenv("AI_PROVIDER_BREAKER_WINDOW", "30"))
+AI_PROVIDER_BREAKER_COOLDOWN = int(os.getenv("AI_PROVIDER_BREAKER_COOLDOWN", "30"))
+# exponential backoff مع jitter لإعادة المحاولة بعد timeout أو 429 بدون Retry-After
+AI_PROVIDER_BACKOFF_BASE = float(os.getenv("AI_PROVIDER_BACKOFF_BASE", "0.5"))
+AI_PROVIDER_BACKOFF_MAX = float(os.getenv("AI_PROVIDER_BACKOFF_MAX", "8"))
+
+# الطلبات المتحوطة (hedged): طلب احتياطي إذا تأخر الرد أكثر من النسبة AI_HEDGE_PERCENTILE من أزمنة النموذج
+# (محصورة بين الحدين بالملي ثانية)؛ أول رد ناجح يفوز. معطلة افتراضياً
+AI_HEDGE_ENABLED = os.getenv("AI_HEDGE_ENABLED", "False") == "True"
+AI_HEDGE_PERCENTILE = int(os.getenv("AI_HEDGE_PERCENTILE", "90"))
+AI_HEDGE_MIN_DELAY_MS = int(os.getenv("AI_HEDGE_MIN_DELAY_MS", "1500"))
+AI_HEDGE_MAX_DELAY_MS = int(os.getenv("AI_HEDGE_MAX_DELAY_MS", "10000"))
+# نموذج الطلب الاحتياطي (فارغ = نفس النموذج) وأقصى نسبة طلبات احتياطية من كل الاستدعاءات
+AI_HEDGE_MODEL = os.getenv("AI_HEDGE_MODEL", "")
+AI_HEDGE_MAX_RATIO = float(os.getenv("AI_HEDGE_MAX_RATIO", "0.1"))
+# أقصى عدد طلبات احتياطية جارية معاً في العملية (بدون طابور: عند الامتلاء لا يوجد تحوط)
+AI_HEDGE_MAX_WORKERS = int(os.getenv("AI_HEDGE_MAX_WORKERS", "16"))
+
 # إعدادات CORS (للسماح للفرونت إند بالوصول)
 CORS_ALLOW_ALL_ORIGINS = True
\ No newline at end of file
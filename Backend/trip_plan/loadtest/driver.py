@@ -0,0 +1,250 @@
+import math
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth import get_user_model
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.test import Client
+from django.urls import reverse
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from ..models.travel_model import Destination, Event, Hotel
+from ..services.catalog_version import bump_catalog_version
+
+
+# محادثات نموذجية متعددة الأدوار (نفس صيغ المستخدمين الحقيقيين: أرقام عربية، جمل ناقصة، اختيار خيار)
+SCRIPTS = [
+    ["مرحبا، أريد التخطيط لرحلة", "ميزانيتي 3000 دولار", "5 أيام لشخصين", "ساحلية", "4 نجوم", "الخيار 1"],
+    ["أريد رحلة لـ 3 أشخاص بميزانية 4500$ لمدة 7 أيام", "لا يهم", "3 نجوم", "الخيار 2"],
+    ["بدي سافر مع عائلتي", "نحن ٤ أشخاص", "الميزانية ٦٠٠٠ دولار", "عشرة أيام", "جبلية", "5 نجوم", "الخيار 1"],
+    ["رحلة شهر عسل لشخصين، 8 أيام، ميزانية 5000 دولار، ساحلية، فندق 5 نجوم", "الخيار 1"],
+    ["ابحث لي عن رحلة رخيصة", "1000 دولار", "3 أيام", "شخص واحد", "لا يهم", "نجمتين", "الخيار 1"],
+]
+
+LOADTEST_USER_PREFIX = "loadtest_"
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    # nearest-rank
+    return round(ordered[max(0, math.ceil(pct / 100 * len(ordered)) - 1)], 1)
+
+
+def ensure_catalog(destinations=60, hotels_per_destination=30, seed=1):
+    """إضافة بيانات كتالوج تجريبية إذا كان عدد الوجهات أقل من المطلوب (لا يحذف شيئاً)"""
+    existing = Destination.objects.count()
+    if existing >= destinations:
+        return 0
+    rng = random.Random(seed)
+    seasons = ["صيف,ربيع", "شتاء", "صيف", "خريف,شتاء", "ربيع", ""]
+    for index in range(existing, destinations):
+        destination = Destination.objects.create(
+            name=f"Loadtest destination {index}",
+            country="Loadtest",
+            flight_cost=rng.randint(150, 900),
+            daily_living_cost=rng.randint(20, 120),
+            is_coastal=index % 2 == 0,
+            description="وجهة تجريبية لاختبار الحمل " * 10,
+            best_seasons=seasons[index % len(seasons)],
+        )
+        Hotel.objects.bulk_create(
+            Hotel(
+                destination=destination,
+                name=f"Loadtest hotel {index}-{h}",
+                stars=rng.randint(1, 5),
+                price_per_night=rng.randint(30, 400),
+                is_sea_view=h % 3 == 0,
+            )
+            for h in range(hotels_per_destination)
+        )
+        Event.objects.bulk_create(
+            Event(
+                destination=destination,
+                name=f"Loadtest event {index}-{e}",
+                description="فعالية تجريبية",
+                season=season,
+                price_per_person=e * 10,
+                is_free=e == 0,
+            )
+            for e, season in enumerate(("all", "summer", "winter"))
+        )
+    # bulk_create لا يطلق الـ signals، لذلك نبطل كاش الكتالوج يدوياً
+    bump_catalog_version()
+    return destinations - existing
+
+
+def ensure_users(count):
+    """مستخدمو اختبار الحمل (loadtest_0 ...) بدون كلمات مرور قابلة للدخول"""
+    User = get_user_model()
+    users = []
+    for index in range(count):
+        user, created = User.objects.get_or_create(username=f"{LOADTEST_USER_PREFIX}{index}")
+        if created:
+            user.set_unusable_password()
+            user.save(update_fields=["password"])
+        users.append(user)
+    return users
+
+
+class QueryCounter:
+    """
+    عداد استعلامات SQL عبر execute_wrapper على كل اتصال جديد (بما فيها اتصالات threads الأدوات)
+    - total: كل الاستعلامات في العملية
+    - thread_count(): استعلامات الـ thread الحالي (لتوزيع الاستعلامات على كل دور)
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.total = 0
+
+    def _wrapper(self, execute, sql, params, many, context):
+        with self._lock:
+            self.total += 1
+        self._local.count = getattr(self._local, "count", 0) + 1
+        return execute(sql, params, many, context)
+
+    def _install(self, connection, **kwargs):
+        if self._wrapper not in connection.execute_wrappers:
+            connection.execute_wrappers.append(self._wrapper)
+
+    def __enter__(self):
+        connection_created.connect(self._install, dispatch_uid="loadtest_query_counter")
+        return self
+
+    def __exit__(self, *exc):
+        connection_created.disconnect(dispatch_uid="loadtest_query_counter")
+
+    def thread_count(self):
+        return getattr(self._local, "count", 0)
+
+    def install_current(self):
+        """الاتصال الحالي قد يكون أنشئ قبل تسجيل الـ signal"""
+        for connection in connections.all(initialized_only=True):
+            self._install(connection)
+
+
+class TurnResult:
+    __slots__ = ("conversation", "turn", "latency_ms", "http_status", "status", "queries")
+
+    def __init__(self, conversation, turn, latency_ms, http_status, status, queries):
+        self.conversation = conversation
+        self.turn = turn
+        self.latency_ms = latency_ms
+        self.http_status = http_status
+        self.status = status
+        self.queries = queries
+
+
+class ChatLoadDriver:
+    """
+    تشغيل محادثات متعددة الأدوار بالتوازي عبر POST /api/ai/chat/ (AIChatPlanView) بـ JWT حقيقي
+    داخل نفس العملية عبر django.test.Client (كامل الـ middleware و DRF auth)
+    """
+
+    def __init__(self, users, conversations=20, concurrency=5, think_time_ms=0, seed=None, host="localhost"):
+        self.users = users
+        self.conversations = conversations
+        self.concurrency = concurrency
+        self.think_time_ms = think_time_ms
+        self.rng = random.Random(seed)
+        self.host = host
+        self.url = reverse("ai_chat_plan")
+        self.results = []
+        self.elapsed = 0
+        self._lock = threading.Lock()
+        self.counter = QueryCounter()
+        self._tokens = {user.pk: str(RefreshToken.for_user(user).access_token) for user in users}
+
+    def _conversation(self, index, script, user):
+        client = Client(HTTP_HOST=self.host)
+        headers = {"HTTP_AUTHORIZATION": f"Bearer {self._tokens[user.pk]}"}
+        session_id = None
+        results = []
+        self.counter.install_current()
+        try:
+            for turn, text in enumerate(script):
+                payload = {"message": text}
+                if session_id:
+                    payload["session_id"] = session_id
+
+                before = self.counter.thread_count()
+                started = time.perf_counter()
+                response = client.post(self.url, payload, content_type="application/json", **headers)
+                latency_ms = (time.perf_counter() - started) * 1000
+                self.counter.install_current()
+
+                try:
+                    data = response.json()
+                except ValueError:
+                    data = {}
+                results.append(TurnResult(
+                    index, turn, latency_ms, response.status_code,
+                    data.get("status") or f"http_{response.status_code}",
+                    self.counter.thread_count() - before,
+                ))
+                session_id = data.get("session_id") or session_id
+                if response.status_code != 200 or data.get("status") == "error":
+                    break
+                if self.think_time_ms:
+                    time.sleep(self.think_time_ms / 1000)
+        finally:
+            connections.close_all()
+
+        with self._lock:
+            self.results.extend(results)
+
+    def run(self):
+        plan = [
+            (index, self.rng.choice(SCRIPTS), self.users[index % len(self.users)])
+            for index in range(self.conversations)
+        ]
+        with self.counter:
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="loadtest") as pool:
+                for future in [pool.submit(self._conversation, *item) for item in plan]:
+                    future.result()
+            self.elapsed = time.perf_counter() - started
+        return self
+
+    def report(self, llm_calls=None):
+        turns = len(self.results)
+        latencies = [r.latency_ms for r in self.results]
+        by_status = {}
+        for result in self.results:
+            by_status.setdefault(result.status, []).append(result.latency_ms)
+
+        report = {
+            "conversations": self.conversations,
+            "concurrency": self.concurrency,
+            "turns": turns,
+            "elapsed_s": round(self.elapsed, 3),
+            "throughput_turns_per_s": round(turns / self.elapsed, 2) if self.elapsed else None,
+            "latency_ms": {
+                "p50": percentile(latencies, 50),
+                "p95": percentile(latencies, 95),
+                "p99": percentile(latencies, 99),
+                "max": round(max(latencies), 1) if latencies else None,
+            },
+            "errors": sum(1 for r in self.results if r.http_status != 200 or r.status == "error"),
+            "db_queries": {
+                "total": self.counter.total,
+                "per_turn": round(self.counter.total / turns, 2) if turns else None,
+                "request_thread_p95": percentile([r.queries for r in self.results], 95),
+            },
+            "by_status": {
+                status: {"turns": len(values), "p50_ms": percentile(values, 50), "p95_ms": percentile(values, 95)}
+                for status, values in sorted(by_status.items())
+            },
+        }
+        if llm_calls is not None:
+            report["llm_calls"] = {
+                "total": llm_calls,
+                "per_turn": round(llm_calls / turns, 2) if turns else None,
+            }
+        return report
@@ -0,0 +1,336 @@
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from ..services.conversation_history import TOOL_RESULT_REF_PREFIX
+from ..services.json_recovery import recover_json_object
+from ..services.requirements_extractor import REQUIRED_FIELDS, extract_requirements
+
+
+REQUIREMENTS_PREFIX = "collected_requirements (known so far) = "
+
+_COMPACTED_ROW_RE = re.compile(r"\(([^)]*)\)")
+# نتيجة أداة مخزنة في ToolResultBlob: "[tool_result ref=<hex>] " ثم نفس الملخص المضغوط
+_REFERENCE_PREFIX_RE = re.compile(r"^%s[0-9a-f]+\]\s*" % re.escape(TOOL_RESULT_REF_PREFIX))
+
+QUESTIONS = {
+    "budget": "ما هي ميزانيتك الإجمالية بالدولار؟",
+    "days": "كم يوماً ستستغرق الرحلة؟",
+    "people": "كم شخصاً سيسافر؟",
+    "is_coastal": "هل تفضل وجهة ساحلية أم جبلية أم لا يهم؟",
+    "min_stars": "كم عدد نجوم الفندق الذي تفضله؟",
+}
+
+
+class MockScenario:
+    """إعدادات سلوك الخادم الوهمي (كل النسب بين 0 و 1)"""
+
+    def __init__(self, latency_ms=300, jitter_ms=100, rate_429=0.0, slow_rate=0.0, slow_ms=3000,
+                 inline_tool_rate=0.2, malformed_rate=0.1, model_latency_ms=None, seed=None):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.rate_429 = rate_429
+        self.slow_rate = slow_rate
+        self.slow_ms = slow_ms
+        self.inline_tool_rate = inline_tool_rate
+        self.malformed_rate = malformed_rate
+        # زمن رد أساسي مختلف لنماذج محددة (لمحاكاة نموذج صغير سريع مقابل نموذج قوي بطيء)
+        self.model_latency_ms = model_latency_ms or {}
+        self.seed = seed
+
+    def latency_for(self, model):
+        return self.model_latency_ms.get(model, self.latency_ms)
+
+
+def _requirements_from(messages):
+    """المتطلبات من رسالة collected_requirements + ما يمكن استخراجه من رسائل المستخدم (بديل فهم النموذج)"""
+    requirements = {}
+    for message in messages:
+        content = message.get("content")
+        if message.get("role") == "system" and isinstance(content, str) and content.startswith(REQUIREMENTS_PREFIX):
+            known = recover_json_object(content[len(REQUIREMENTS_PREFIX):], record=False)
+            if isinstance(known, dict):
+                requirements.update({k: v for k, v in known.items() if v is not None})
+    for message in messages:
+        if message.get("role") == "user" and isinstance(message.get("content"), str):
+            values, _ = extract_requirements(message["content"])
+            requirements.update({k: v for k, v in values.items() if v is not None})
+    return requirements
+
+
+def _compacted_rows(content):
+    """نتيجة أداة قديمة مضغوطة في النافذة: (destination_id=1, hotel_id=2, total_cost=900); ..."""
+    rows = []
+    for group in _COMPACTED_ROW_RE.findall(content):
+        if "=" not in group:
+            continue
+        row = {}
+        for part in group.split(", "):
+            key, _, value = part.partition("=")
+            try:
+                row[key] = float(value) if "." in value else int(value)
+            except ValueError:
+                row[key] = value
+        rows.append(row)
+    return rows
+
+
+def _last_search_results(messages):
+    for message in reversed(messages):
+        if message.get("role") == "tool" and message.get("name") == "search_destinations_and_hotels":
+            content = _REFERENCE_PREFIX_RE.sub("", message.get("content") or "", count=1)
+            if content.startswith("[compacted]"):
+                return _compacted_rows(content)
+            data = recover_json_object(content, record=False)
+            if isinstance(data, dict):
+                return data.get("results") or []
+            return []
+    return None
+
+
+def _option(index, row):
+    return {
+        "option_id": index,
+        "destination_id": row.get("destination_id"),
+        "hotel_id": row.get("hotel_id"),
+        "total_cost": row.get("total_cost"),
+        "cost_breakdown": row.get("cost_breakdown") or {},
+    }
+
+
+class ScriptedResponder:
+    """يقرر رد النموذج الوهمي من محتوى الطلب (بنفس تسلسل المحادثة الحقيقي: أسئلة → بحث → خيارات → تأكيد)"""
+
+    def __init__(self, scenario, rng):
+        self.scenario = scenario
+        self.rng = rng
+
+    def respond(self, body):
+        messages = body.get("messages") or []
+        conversation = [m for m in messages if m.get("role") != "system"]
+        last = conversation[-1] if conversation else {}
+
+        # طلب إصلاح JSON (بدون أدوات)
+        if not body.get("tools"):
+            return "repair", self._final({"status": "gather_info", "message": "هل يمكنك توضيح طلبك؟",
+                                          "collected_requirements": {}}, malformed=False)
+
+        requirements = _requirements_from(messages)
+        results = _last_search_results(conversation)
+
+        if last.get("role") == "tool":
+            if not results:
+                return "no_options", self._final({
+                    "status": "no_options",
+                    "message": "لم أجد خيارات مناسبة. هل يمكن زيادة الميزانية؟",
+                    "collected_requirements": requirements,
+                })
+            return "options", self._final({
+                "status": "options_presented",
+                "message": "وجدت خيارات مناسبة. أيها تفضل؟",
+                "collected_requirements": requirements,
+                "options": [_option(i + 1, row) for i, row in enumerate(results[:3])],
+            })
+
+        user_text = last.get("content") or ""
+        if results and ("الخيار" in user_text or user_text.strip().isdigit()):
+            row = results[0]
+            return "plan", self._final({
+                "status": "plan_confirmed",
+                "message": "تم تأكيد رحلتك!",
+                "collected_requirements": requirements,
+                "selected_plan": {
+                    "option_id": 1,
+                    "destination_id": row.get("destination_id"),
+                    "hotel_id": row.get("hotel_id"),
+                    "total_cost": row.get("total_cost") or 0,
+                    "days": requirements.get("days") or 1,
+                    "cost_breakdown": row.get("cost_breakdown") or {},
+                },
+            })
+
+        if all(requirements.get(k) is not None for k in ("budget", "days", "people")):
+            arguments = {k: requirements[k] for k in ("budget", "days", "people", "is_coastal", "min_stars")
+                         if requirements.get(k) is not None}
+            if self.rng.random() < self.scenario.inline_tool_rate:
+                return "inline_tool_call", {
+                    "role": "assistant",
+                    "content": "<tool_call>%s</tool_call>" % json.dumps(
+                        {"name": "search_destinations_and_hotels", "arguments": arguments}, ensure_ascii=False),
+                }
+            return "tool_call", {
+                "role": "assistant",
+                "content": "",
+                "tool_calls": [{
+                    "id": "call_%08x" % self.rng.getrandbits(32),
+                    "type": "function",
+                    "function": {"name": "search_destinations_and_hotels",
+                                 "arguments": json.dumps(arguments, ensure_ascii=False)},
+                }],
+            }
+
+        missing = [f for f in REQUIRED_FIELDS if f not in requirements][:2]
+        return "gather_info", self._final({
+            "status": "gather_info",
+            "message": " ".join(QUESTIONS[f] for f in missing) or "هل هناك تفضيلات أخرى؟",
+            "collected_requirements": requirements,
+        })
+
+    def _final(self, data, malformed=None):
+        text = json.dumps(data, ensure_ascii=False)
+        if malformed is None:
+            malformed = self.rng.random() < self.scenario.malformed_rate
+        if malformed:
+            kind = self.rng.choice(("fence", "trailing_comma", "python", "prose"))
+            if kind == "fence":
+                text = "إليك الرد:\n```json\n%s\n```" % text
+            elif kind == "trailing_comma":
+                text = text[:-1] + ",}"
+            elif kind == "python":
+                text = repr(data)
+            else:
+                text = "بالتأكيد! " + text + "\nأتمنى لك رحلة سعيدة."
+        return {"role": "assistant", "content": text}
+
+
+class MockOpenRouterServer:
+    """
+    بديل محلي لـ OpenRouter chat/completions لقياس الأداء بدون مزود حقيقي
+    يدعم: tool_calls رسمية و <tool_call> نصية، JSON تالف، ردود 429 مع Retry-After، ردود بطيئة، stream
+    """
+
+    def __init__(self, scenario=None, host="127.0.0.1", port=0):
+        self.scenario = scenario or MockScenario()
+        self.rng = random.Random(self.scenario.seed)
+        self._rng_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.calls = 0
+        self.kinds = {}
+        self.models = {}
+        self._seen_prefixes = set()
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/api/v1/chat/completions"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self.url
+
+    def serve_forever(self):
+        self._server.serve_forever()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def stats(self):
+        with self._stats_lock:
+            return {"calls": self.calls, "responses": dict(self.kinds), "models": dict(self.models)}
+
+    def _count(self, kind, model=None):
+        with self._stats_lock:
+            self.calls += 1
+            self.kinds[kind] = self.kinds.get(kind, 0) + 1
+            if model:
+                self.models[model] = self.models.get(model, 0) + 1
+
+    def _usage(self, body):
+        """تقدير usage مع محاكاة prompt caching للـ system prompt المتكرر"""
+        messages = body.get("messages") or []
+        prompt_chars = len(json.dumps(messages, ensure_ascii=False)) + len(json.dumps(body.get("tools") or []))
+        prefix = json.dumps(messages[:1], ensure_ascii=False)
+        with self._stats_lock:
+            cached = len(prefix) // 3 if prefix in self._seen_prefixes else 0
+            self._seen_prefixes.add(prefix)
+        return {
+            "prompt_tokens": prompt_chars // 3,
+            "completion_tokens": 60,
+            "prompt_tokens_details": {"cached_tokens": cached},
+        }
+
+    def _handler_class(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _send_json(self, status, data, headers=None):
+                out = json.dumps(data, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(out)))
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(out)
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+                scenario = mock.scenario
+                with mock._rng_lock:
+                    roll_429 = mock.rng.random()
+                    roll_slow = mock.rng.random()
+                    delay = max(0, scenario.latency_for(body.get("model")) + mock.rng.uniform(
+                        -scenario.jitter_ms, scenario.jitter_ms))
+                    kind, message = ScriptedResponder(scenario, mock.rng).respond(body)
+
+                if roll_429 < scenario.rate_429:
+                    mock._count("429", body.get("model"))
+                    self._send_json(429, {"error": {"message": "Rate limit exceeded", "code": 429}},
+                                    {"Retry-After": "1"})
+                    return
+
+                if roll_slow < scenario.slow_rate:
+                    delay += scenario.slow_ms
+                time.sleep(delay / 1000)
+                mock._count(kind, body.get("model"))
+
+                usage = mock._usage(body)
+                if body.get("stream"):
+                    self._stream(message, usage)
+                else:
+                    self._send_json(200, {"choices": [{"message": message, "finish_reason": "stop"}], "usage": usage})
+
+            def _stream(self, message, usage):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+
+                def write(text):
+                    data = text.encode("utf-8")
+                    self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+
+                def event(payload):
+                    write("data: " + json.dumps(payload, ensure_ascii=False) + "\n\n")
+
+                write(": OPENROUTER PROCESSING\n\n")
+                for index, tc in enumerate(message.get("tool_calls") or []):
+                    event({"choices": [{"delta": {"tool_calls": [{
+                        "index": index, "id": tc["id"], "function": {"name": tc["function"]["name"], "arguments": ""},
+                    }]}}]})
+                    arguments = tc["function"]["arguments"]
+                    for i in range(0, len(arguments), 16):
+                        event({"choices": [{"delta": {"tool_calls": [{
+                            "index": index, "function": {"arguments": arguments[i:i + 16]},
+                        }]}}]})
+                content = message.get("content") or ""
+                for i in range(0, len(content), 12):
+                    event({"choices": [{"delta": {"content": content[i:i + 12]}}]})
+                event({"choices": [], "usage": usage})
+                write("data: [DONE]\n\n")
+                self.wfile.write(b"0\r\n\r\n")
+
+        return Handler
@@ -0,0 +1,164 @@
+import json
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from trip_plan.models.travel_model import ConversationMessage, ConversationSession
+from trip_plan.services.json_recovery import recover_json_object
+
+
+# عينات تمثيلية بنفس شكل ردود النموذج (نص عربي ثم JSON)، تُضاف إليها الردود المسجلة في الجلسات
+SEED_OUTPUTS = [
+    'مرحبا! لنساعدك بشكل مثالي، أحتاج بعض التفاصيل...\n'
+    '{"status": "gather_info", "message": "ما هي ميزانيتك الإجمالية بالدولار؟ وكم شخص سيسافر؟", '
+    '"collected_requirements": {}}',
+    'شكراً! تبقى نقطة واحدة...\n'
+    '{"status": "gather_info", "message": "هل تفضل وجهة ساحلية أم جبلية أم لا يهم؟", '
+    '"collected_requirements": {"budget": 3200, "people": 3}}',
+    'إليك أفضل الخيارات المتاحة...\n'
+    '{"status": "options_presented", "message": "وجدت خيارين رائعين. أيها تفضل؟ (أجب برقم الخيار)", '
+    '"collected_requirements": {"budget": 2500, "days": 6, "people": 2, "is_coastal": true, "min_stars": 4}, '
+    '"options": [{"option_id": 1, "destination_id": 12, "hotel_id": 45, "total_cost": 1980, '
+    '"cost_breakdown": {"flights": 750, "accommodation": 720, "daily_living": 510, "total": 1980}}, '
+    '{"option_id": 2, "destination_id": 8, "hotel_id": 23, "total_cost": 2350, '
+    '"cost_breakdown": {"flights": 800, "accommodation": 900, "daily_living": 650, "total": 2350}}]}',
+    'تم اختيار الخيار رقم 2. إليك ملخص الرحلة النهائي:\n'
+    '{"status": "plan_confirmed", "message": "رحلتك مؤكدة! \\"استمتع\\" برحلتك.", '
+    '"collected_requirements": {"budget": 2500, "days": 6, "people": 2, "season": "summer"}, '
+    '"selected_plan": {"option_id": 2, "destination_id": 8, "hotel_id": 23, "total_cost": 2350, "days": 6, '
+    '"cost_breakdown": {"flights": 800, "accommodation": 900, "daily_living": 650, "total": 2350}, '
+    '"events": [{"id": 3, "name": "مهرجان الصيف"}]}}',
+    '{"status": "no_options", "message": "لم أجد خيارات مناسبة بهذه المواصفات. هل تفضل تقليل عدد النجوم إلى 3؟", '
+    '"collected_requirements": {"budget": 1200, "days": 7, "people": 2, "min_stars": 5}}',
+]
+
+
+def _split(text, expected):
+    """النص قبل كائن الـ JSON الأخير + الكائن نفسه كنص قابل للتعديل"""
+    prose = text[:text.find("{")] if "{" in text else ""
+    return prose, json.dumps(expected, ensure_ascii=False)
+
+
+def _add_trailing_commas(body):
+    return body.replace("}", ", }").replace("]", ", ]")
+
+
+def _add_comments(body):
+    return body.replace(', "', ',\n  // ملاحظة\n  "', 2).replace("{", "{ /* json */ ", 1)
+
+
+def _unquote_keys(body, expected):
+    for key in expected:
+        body = body.replace('"%s":' % key, "%s:" % key)
+    return body
+
+
+MUTATIONS = {
+    "original": lambda prose, body, expected, rng: prose + body,
+    "fenced": lambda prose, body, expected, rng: prose + "```json\n" + body + "\n```",
+    "trailing_commas": lambda prose, body, expected, rng: prose + _add_trailing_commas(body),
+    "comments": lambda prose, body, expected, rng: prose + _add_comments(body),
+    "python_literals": lambda prose, body, expected, rng: prose + repr(expected),
+    "quoted": lambda prose, body, expected, rng: json.dumps(body, ensure_ascii=False),
+    "fragment": lambda prose, body, expected, rng: body[1:-1],
+    "unquoted_keys": lambda prose, body, expected, rng: prose + _unquote_keys(body, expected),
+    "braces_in_prose": lambda prose, body, expected, rng: "اختر {رقم الخيار} أو {لا}. " + prose + body,
+    "tool_call_before": lambda prose, body, expected, rng: (
+        '<tool_call>{"name": "search_events", "arguments": {"destination_id": 1}}</tool_call>\n' + prose + body
+    ),
+    # رد مقطوع: لا نتوقع نفس الكائن، فقط استرجاع status
+    "truncated": lambda prose, body, expected, rng: prose + body[:rng.randint(len(body) // 2, len(body) - 1)],
+}
+
+
+class Command(BaseCommand):
+    help = "قياس نسبة نجاح وسرعة استرجاع JSON من ردود النموذج (عينات ثابتة + ردود مسجلة + تعديلات fuzz)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--from-sessions", type=int, default=0,
+                            help="إضافة ردود assistant مسجلة من آخر N جلسة محادثة")
+        parser.add_argument("--corpus", help="ملف JSONL بردود خام إضافية (حقل text في كل سطر)")
+        parser.add_argument("--export", help="حفظ العينات المجمعة في ملف JSONL لإعادة الاستخدام")
+        parser.add_argument("--repeat", type=int, default=200, help="عدد مرات التكرار لقياس الزمن")
+        parser.add_argument("--seed", type=int, default=7)
+
+    def _collect(self, options):
+        outputs = list(SEED_OUTPUTS)
+        if options["corpus"]:
+            with open(options["corpus"], encoding="utf-8") as fh:
+                outputs.extend(json.loads(line)["text"] for line in fh if line.strip())
+        if options["from_sessions"]:
+            sessions = list(
+                ConversationSession.objects.order_by("-updated_at").values_list("pk", flat=True)[:options["from_sessions"]]
+            )
+            payloads = ConversationMessage.objects.filter(
+                session__in=sessions, role="assistant"
+            ).values_list("payload", flat=True)
+            for message in payloads.iterator():
+                content = message.get("content")
+                if isinstance(content, str) and "{" in content:
+                    outputs.append(content)
+        return outputs
+
+    def handle(self, *args, **options):
+        rng = random.Random(options["seed"])
+        outputs = self._collect(options)
+
+        if options["export"]:
+            with open(options["export"], "w", encoding="utf-8") as fh:
+                for text in outputs:
+                    fh.write(json.dumps({"text": text}, ensure_ascii=False) + "\n")
+
+        cases = []
+        skipped = 0
+        for text in outputs:
+            expected = recover_json_object(text, record=False)
+            if not isinstance(expected, dict) or "status" not in expected:
+                skipped += 1
+                continue
+            prose, body = _split(text, expected)
+            for name, mutate in MUTATIONS.items():
+                cases.append((name, mutate(prose, body, expected, rng), expected))
+
+        self.stdout.write(f"samples: {len(outputs) - skipped} (skipped without status: {skipped}), cases: {len(cases)}")
+        self.stdout.write(f"{'mutation':<18}{'cases':>7}{'ok':>7}{'rate':>9}{'us/op':>10}")
+
+        failures = []
+        for name in MUTATIONS:
+            group = [c for c in cases if c[0] == name]
+            ok = 0
+            for _, text, expected in group:
+                result = recover_json_object(text, record=False)
+                if name == "truncated":
+                    good = isinstance(result, dict) and result.get("status") == expected["status"]
+                else:
+                    good = result == expected
+                ok += good
+                if not good:
+                    failures.append((name, text))
+
+            started = time.perf_counter()
+            for _ in range(options["repeat"]):
+                for _, text, _ in group:
+                    recover_json_object(text, record=False)
+            per_op = (time.perf_counter() - started) / max(1, options["repeat"] * len(group)) * 1e6
+            rate = ok / len(group) if group else 0
+            self.stdout.write(f"{name:<18}{len(group):>7}{ok:>7}{rate:>9.1%}{per_op:>10.1f}")
+
+        # التحقق من أن الزمن خطي مع طول النص
+        self.stdout.write("scaling (prose + trailing JSON):")
+        base = SEED_OUTPUTS[2]
+        for factor in (1, 10, 100):
+            text = ("نص تمهيدي {غير مكتمل " * 20 * factor) + base
+            started = time.perf_counter()
+            for _ in range(20):
+                recover_json_object(text, record=False)
+            self.stdout.write(f"  {len(text):>8} chars: {(time.perf_counter() - started) / 20 * 1e6:>10.1f} us")
+
+        for name, text in failures[:10]:
+            self.stdout.write(self.style.WARNING(f"[{name}] {text[:200]!r}"))
+        if failures:
+            self.stdout.write(self.style.WARNING(f"{len(failures)} case(s) not recovered"))
+        else:
+            self.stdout.write(self.style.SUCCESS("all cases recovered"))
@@ -0,0 +1,108 @@
+import json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from trip_plan.loadtest.driver import ChatLoadDriver, ensure_catalog, ensure_users
+from trip_plan.loadtest.mock_openrouter import MockOpenRouterServer
+from trip_plan.services.ai_metrics import collect_ai_metrics
+
+from .mock_openrouter import add_scenario_arguments, scenario_from_options
+
+
+class Command(BaseCommand):
+    help = (
+        "اختبار حمل لـ /api/ai/chat/: محادثات متعددة الأدوار بالتوازي ضد خادم OpenRouter وهمي، "
+        "مع p50/p95/p99 والـ throughput واستعلامات قاعدة البيانات واستدعاءات الـ LLM لكل دور"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--conversations", type=int, default=20)
+        parser.add_argument("--concurrency", type=int, default=5)
+        parser.add_argument("--users", type=int, default=5, help="عدد مستخدمي loadtest_N الموزعة عليهم المحادثات")
+        parser.add_argument("--think-time-ms", type=int, default=0, help="انتظار بين أدوار المحادثة الواحدة")
+        parser.add_argument("--seed-destinations", type=int, default=0,
+                            help="إكمال الكتالوج حتى هذا العدد من الوجهات (0 = بدون إضافة)")
+        parser.add_argument("--hotels-per-destination", type=int, default=30)
+        parser.add_argument("--api-url", help="استخدام خادم وهمي يعمل مسبقاً بدل تشغيله داخل العملية")
+        parser.add_argument("--host", default=None, help="قيمة Host للطلبات (الافتراضي أول قيمة في ALLOWED_HOSTS)")
+        parser.add_argument("--json", action="store_true", help="طباعة التقرير كـ JSON")
+        add_scenario_arguments(parser)
+
+    def _host(self, options):
+        if options["host"]:
+            return options["host"]
+        hosts = [h for h in settings.ALLOWED_HOSTS if h and "*" not in h]
+        return hosts[0].lstrip(".") if hosts else "localhost"
+
+    def handle(self, *args, **options):
+        if options["seed_destinations"]:
+            added = ensure_catalog(options["seed_destinations"], options["hotels_per_destination"])
+            self.stdout.write(f"catalog: added {added} destination(s)")
+        users = ensure_users(max(1, options["users"]))
+
+        server = None
+        original_url = getattr(settings, "OPENROUTER_API_URL", None)
+        if options["api_url"]:
+            settings.OPENROUTER_API_URL = options["api_url"]
+        else:
+            server = MockOpenRouterServer(scenario_from_options(options))
+            settings.OPENROUTER_API_URL = server.start()
+
+        try:
+            driver = ChatLoadDriver(
+                users,
+                conversations=options["conversations"],
+                concurrency=options["concurrency"],
+                think_time_ms=options["think_time_ms"],
+                seed=options["seed"],
+                host=self._host(options),
+            ).run()
+        finally:
+            settings.OPENROUTER_API_URL = original_url
+            if server:
+                server.stop()
+
+        # مع خادم خارجي نعتمد على عدادات usage في الخدمة نفسها
+        if server:
+            llm_calls = server.stats()["calls"]
+        else:
+            llm_calls = sum(m["calls"] for m in collect_ai_metrics()["llm_usage"].values())
+        report = driver.report(llm_calls=llm_calls)
+        if server:
+            report["mock"] = server.stats()["responses"]
+            report["mock_models"] = server.stats()["models"]
+        report["ai_metrics"] = collect_ai_metrics()
+
+        if options["json"]:
+            self.stdout.write(json.dumps(report, ensure_ascii=False, indent=2, default=str))
+            return
+        self._print(report)
+
+    def _print(self, report):
+        latency = report["latency_ms"]
+        self.stdout.write(
+            f"conversations={report['conversations']} concurrency={report['concurrency']} "
+            f"turns={report['turns']} errors={report['errors']} elapsed={report['elapsed_s']}s"
+        )
+        self.stdout.write(f"throughput: {report['throughput_turns_per_s']} turns/s")
+        self.stdout.write(
+            "latency ms: " + " ".join(
+                f"{k}={v:.1f}" if v is not None else f"{k}=-" for k, v in latency.items()
+            )
+        )
+        db = report["db_queries"]
+        self.stdout.write(
+            f"db queries: total={db['total']} per_turn={db['per_turn']} request_thread_p95={db['request_thread_p95']}"
+        )
+        llm = report["llm_calls"]
+        self.stdout.write(f"llm calls: total={llm['total']} per_turn={llm['per_turn']}")
+        self.stdout.write(f"{'status':<20}{'turns':>7}{'p50 ms':>10}{'p95 ms':>10}")
+        for status, row in report["by_status"].items():
+            self.stdout.write(f"{status:<20}{row['turns']:>7}{row['p50_ms']:>10.1f}{row['p95_ms']:>10.1f}")
+        if "mock" in report:
+            self.stdout.write(f"mock responses: {report['mock']}")
+            self.stdout.write(f"mock calls per model: {report['mock_models']}")
+        cache = report["ai_metrics"].get("llm_cache") or {}
+        if cache:
+            self.stdout.write(f"llm cache: {cache}")
@@ -0,0 +1,57 @@
+from django.core.management.base import BaseCommand
+
+from trip_plan.loadtest.mock_openrouter import MockOpenRouterServer, MockScenario
+
+
+def add_scenario_arguments(parser):
+    """خيارات سلوك الخادم الوهمي المشتركة بين mock_openrouter و loadtest_chat"""
+    parser.add_argument("--latency-ms", type=int, default=300, help="زمن الرد الأساسي")
+    parser.add_argument("--jitter-ms", type=int, default=100)
+    parser.add_argument("--rate-429", type=float, default=0.0, help="نسبة ردود 429 (مع Retry-After)")
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="نسبة الردود البطيئة")
+    parser.add_argument("--slow-ms", type=int, default=3000, help="التأخير الإضافي للردود البطيئة")
+    parser.add_argument("--inline-tool-rate", type=float, default=0.2,
+                        help="نسبة استدعاءات الأدوات كنص <tool_call> بدل tool_calls")
+    parser.add_argument("--malformed-rate", type=float, default=0.1,
+                        help="نسبة الردود النهائية بـ JSON تالف (fence، فاصلة زائدة، dict بأسلوب Python...)")
+    parser.add_argument("--model-latency", action="append", default=[], metavar="MODEL=MS",
+                        help="زمن رد أساسي لنموذج محدد (يمكن تكراره)")
+    parser.add_argument("--seed", type=int, default=None)
+
+
+def scenario_from_options(options):
+    model_latency = {}
+    for item in options["model_latency"]:
+        model, _, ms = item.rpartition("=")
+        model_latency[model] = int(ms)
+    return MockScenario(
+        latency_ms=options["latency_ms"],
+        jitter_ms=options["jitter_ms"],
+        rate_429=options["rate_429"],
+        slow_rate=options["slow_rate"],
+        slow_ms=options["slow_ms"],
+        inline_tool_rate=options["inline_tool_rate"],
+        malformed_rate=options["malformed_rate"],
+        model_latency_ms=model_latency,
+        seed=options["seed"],
+    )
+
+
+class Command(BaseCommand):
+    help = "تشغيل خادم OpenRouter وهمي محلي (وجّه OPENROUTER_API_URL إلى الرابط المطبوع)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--host", default="127.0.0.1")
+        parser.add_argument("--port", type=int, default=8765)
+        add_scenario_arguments(parser)
+
+    def handle(self, *args, **options):
+        server = MockOpenRouterServer(scenario_from_options(options), host=options["host"], port=options["port"])
+        self.stdout.write(f"OPENROUTER_API_URL={server.url}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.stop()
+            self.stdout.write(f"mock stats: {server.stats()}")
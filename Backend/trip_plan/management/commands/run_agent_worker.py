@@ -0,0 +1,92 @@
+import logging
+import os
+import socket
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from trip_plan.models.travel_model import ConversationSession
+from trip_plan.services.agent_jobs import agent_job_queue
+from trip_plan.services.ai_agent_service import TravelAgentService
+
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = (
+        "عامل خلفي لمهام وضع searching: ينفذ pending_tool_calls وجولة الـ LLM التالية "
+        "ويحفظ الرد في AgentJob (يمكن تشغيل عدة عمال بالتوازي)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--once", action="store_true", help="تنفيذ المهام المتاحة حالياً ثم الخروج")
+        parser.add_argument("--max-jobs", type=int, default=0, help="الخروج بعد هذا العدد من المهام (0 = بلا حد)")
+        parser.add_argument("--poll-interval", type=float, default=None,
+                            help="فترة الانتظار عند فراغ الطابور (افتراضياً AI_JOB_POLL_INTERVAL)")
+
+    def handle(self, *args, **options):
+        worker = f"{socket.gethostname()}:{os.getpid()}"
+        poll_interval = options["poll_interval"]
+        if poll_interval is None:
+            poll_interval = getattr(settings, "AI_JOB_POLL_INTERVAL", 1.0)
+
+        self.stdout.write(f"agent worker {worker} started")
+        processed = 0
+        try:
+            while True:
+                close_old_connections()
+                job = agent_job_queue.claim(worker)
+                if job is None:
+                    if options["once"]:
+                        break
+                    time.sleep(poll_interval)
+                    continue
+
+                self._run_job(job)
+                processed += 1
+                if options["max_jobs"] and processed >= options["max_jobs"]:
+                    break
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write(f"agent worker {worker} stopped after {processed} job(s)")
+
+    def _run_job(self, job):
+        started = time.perf_counter()
+        # نقرأ الجلسة من جديد: قد تكون تغيرت (أو حُذفت) منذ إنشاء المهمة
+        session = ConversationSession.objects.filter(pk=job.session_id).first()
+        if session is None:
+            agent_job_queue.drop(job, "Conversation session no longer exists")
+            self.stdout.write(f"job {job.job_id}: dropped (session deleted)")
+            return
+        if not session.state.get('pending_tool_calls'):
+            # ألغاها discard_pending_tool_calls بعد فشل مهمة سابقة، أو اكتمل الدور من مسار آخر:
+            # لا شيء لإكماله، ولا نستدعي discard حتى لا تُحذف رسالة assistant صحيحة من السجل
+            agent_job_queue.drop(job, "No pending tool calls in session")
+            self.stdout.write(f"job {job.job_id}: dropped (nothing pending)")
+            return
+
+        service = TravelAgentService(user=job.user)
+        try:
+            result = service.resume_pending_tool_calls(session)
+        except Exception as e:
+            logger.exception("Agent job %s crashed", job.job_id)
+            result = {
+                "status": "error",
+                "message": f"حدث خطأ غير متوقع: {str(e)}",
+                "session_id": session.session_id,
+            }
+
+        if result.get("status") == "error":
+            final = agent_job_queue.fail(job, result.get("message"), result)
+            session = ConversationSession.objects.filter(pk=job.session_id).first()
+            if final and session is not None:
+                service.discard_pending_tool_calls(session)
+            outcome = "failed" if final else "retry"
+        else:
+            agent_job_queue.complete(job, result)
+            outcome = result.get("status")
+
+        self.stdout.write(f"job {job.job_id}: {outcome} in {(time.perf_counter() - started) * 1000:.0f} ms")
@@ -0,0 +1,58 @@
+# Generated by Django 5.0.14 on 2026-10-16 00:00
+
+from django.db import migrations, models
+
+
+# نسخة ثابتة من SEASON_BITS / SEASON_SYNONYMS وقت كتابة الـ migration
+# (لا نستورد من models: أي تعديل لاحق عليها يجب ألا يغيّر ما تحسبه هذه الـ migration)
+SEASON_BITS = {
+    "summer": 1,
+    "winter": 2,
+    "spring": 4,
+    "autumn": 8,
+}
+
+SEASON_SYNONYMS = {
+    "summer": ["summer", "صيف"],
+    "winter": ["winter", "شتاء"],
+    "spring": ["spring", "ربيع"],
+    "autumn": ["autumn", "fall", "خريف"],
+}
+
+
+def season_mask_from_text(text):
+    low = (text or "").lower()
+    mask = 0
+    for season, tokens in SEASON_SYNONYMS.items():
+        if any(tok in low for tok in tokens):
+            mask |= SEASON_BITS[season]
+    return mask
+
+
+def populate_season_mask(apps, schema_editor):
+    """تحويل قيم best_seasons النصية الحالية إلى season_mask"""
+    Destination = apps.get_model('trip_plan', 'Destination')
+    for dest in Destination.objects.only('id', 'best_seasons').iterator():
+        mask = season_mask_from_text(dest.best_seasons)
+        if mask:
+            Destination.objects.filter(id=dest.id).update(season_mask=mask)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trip_plan', '0004_imageasset_event'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='destination',
+            name='season_mask',
+            field=models.PositiveSmallIntegerField(db_index=True, default=0, editable=False),
+        ),
+        migrations.RunPython(populate_season_mask, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='event',
+            index=models.Index(fields=['destination', 'season'], name='event_dest_season_idx'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.0.14 on 2026-10-16 00:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trip_plan', '0006_agentjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ToolResultBlob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('digest', models.CharField(max_length=64, unique=True)),
+                ('tool_name', models.CharField(max_length=100)),
+                ('content', models.TextField()),
+                ('size', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
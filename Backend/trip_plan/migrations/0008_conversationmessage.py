@@ -0,0 +1,67 @@
+# Generated by Django 5.0.14 on 2026-10-16 00:00
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+BATCH_SIZE = 500
+
+
+def split_state_messages(apps, schema_editor):
+    """نقل state['messages'] لكل جلسة إلى صفوف ConversationMessage وحفظ عددها في state['message_count']"""
+    ConversationSession = apps.get_model('trip_plan', 'ConversationSession')
+    ConversationMessage = apps.get_model('trip_plan', 'ConversationMessage')
+
+    for session in ConversationSession.objects.iterator(chunk_size=BATCH_SIZE):
+        state = session.state or {}
+        messages = state.pop('messages', None) or []
+        ConversationMessage.objects.bulk_create(
+            (
+                ConversationMessage(session=session, seq=seq, role=message.get('role') or '', payload=message)
+                for seq, message in enumerate(messages)
+            ),
+            batch_size=BATCH_SIZE,
+        )
+        state['message_count'] = len(messages)
+        session.state = state
+        session.save(update_fields=['state'])
+
+
+def merge_state_messages(apps, schema_editor):
+    ConversationSession = apps.get_model('trip_plan', 'ConversationSession')
+    ConversationMessage = apps.get_model('trip_plan', 'ConversationMessage')
+
+    for session in ConversationSession.objects.iterator(chunk_size=BATCH_SIZE):
+        state = session.state or {}
+        state.pop('message_count', None)
+        state['messages'] = list(
+            ConversationMessage.objects.filter(session=session).order_by('seq').values_list('payload', flat=True)
+        )
+        session.state = state
+        session.save(update_fields=['state'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trip_plan', '0007_toolresultblob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ConversationMessage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('seq', models.PositiveIntegerField()),
+                ('role', models.CharField(max_length=20)),
+                ('payload', models.JSONField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('session', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='messages', to='trip_plan.conversationsession')),
+            ],
+            options={
+                'ordering': ['session', 'seq'],
+                'constraints': [models.UniqueConstraint(fields=('session', 'seq'), name='conversationmessage_session_seq_uniq')],
+            },
+        ),
+        migrations.RunPython(split_state_messages, merge_state_messages),
+    ]
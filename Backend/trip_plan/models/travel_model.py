@@ -1,5 +1,63 @@
+import uuid
+
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
 
+# ==================== المواسم ====================
+# المكان الوحيد لتعريف المواسم ومرادفاتها العربية/الإنجليزية
+
+# بتات المواسم المستخدمة في Destination.season_mask (وجهة قد تناسب أكثر من موسم)
+SEASON_BITS = {
+    "summer": 1,
+    "winter": 2,
+    "spring": 4,
+    "autumn": 8,
+}
+
+SEASON_SYNONYMS = {
+    "summer": ["summer", "صيف"],
+    "winter": ["winter", "شتاء"],
+    "spring": ["spring", "ربيع"],
+    "autumn": ["autumn", "fall", "خريف"],
+}
+
+ALL_SEASONS_MASK = sum(SEASON_BITS.values())
+
+
+def normalize_season(value):
+    """تحويل اسم موسم (عربي/إنجليزي) إلى المفتاح الموحد مثل summer، أو all، أو None إذا لم يُعرف"""
+    low = str(value or "").strip().lower()
+    if not low:
+        return None
+    if low in ("all", "كل المواسم"):
+        return "all"
+    for season, tokens in SEASON_SYNONYMS.items():
+        if low in tokens or any(tok in low for tok in tokens):
+            return season
+    return None
+
+
+def season_mask_from_text(text):
+    """تحويل نص best_seasons (مثل: صيف,ربيع) إلى bitmask"""
+    low = (text or "").lower()
+    mask = 0
+    for season, tokens in SEASON_SYNONYMS.items():
+        if any(tok in low for tok in tokens):
+            mask |= SEASON_BITS[season]
+    return mask
+
+
+def season_masks_containing(season):
+    """
+    كل قيم season_mask الممكنة التي تحتوي الموسم المطلوب
+    (عددها 8 فقط، لذلك season_mask__in يستخدم الـ index بدل فحص كل الصفوف)
+    """
+    bit = SEASON_BITS.get(season, 0)
+    if not bit:
+        return []
+    return [mask for mask in range(1, ALL_SEASONS_MASK + 1) if mask & bit]
+
+
 class Destination(models.Model):
     name = models.CharField(max_length=255)
     country = models.CharField(max_length=100)
@@ -12,6 +70,15 @@ class Destination(models.Model):
         blank=True,
         help_text="مثال: صيف,ربيع أو شتاء,خريف"
     )
+    # نسخة مفهرسة من best_seasons تُحدّث تلقائياً عند الحفظ (انظر SEASON_BITS)
+    season_mask = models.PositiveSmallIntegerField(default=0, db_index=True, editable=False)
+
+    def save(self, *args, **kwargs):
+        self.season_mask = season_mask_from_text(self.best_seasons)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'best_seasons' in update_fields:
+            kwargs['update_fields'] = set(update_fields) | {'season_mask'}
+        super().save(*args, **kwargs)
 
 class Hotel(models.Model):
     destination = models.ForeignKey(Destination, related_name='hotels', on_delete=models.CASCADE)
@@ -31,6 +98,11 @@ class Event(models.Model):
     duration_hours = models.PositiveIntegerField(default=2)
     is_free = models.BooleanField(default=False)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['destination', 'season'], name='event_dest_season_idx'),
+        ]
+
     def __str__(self):
         return f"{self.name} - {self.destination.name}"
 
@@ -44,10 +116,82 @@ class ConversationSession(models.Model):
     """حفظ حالة المحادثة للمستخدم"""
     user = models.ForeignKey('User', on_delete=models.CASCADE, related_name='conversations')
     session_id = models.CharField(max_length=100, unique=True)
-    state = models.JSONField(default=dict)  # حفظ المتطلبات المجمعة
+    state = models.JSONField(default=dict)  # حفظ المتطلبات المجمعة (الرسائل نفسها في ConversationMessage)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     is_active = models.BooleanField(default=True)
     
     class Meta:
-        ordering = ['-updated_at']
\ No newline at end of file
+        ordering = ['-updated_at']
+
+class ConversationMessage(models.Model):
+    """
+    رسالة واحدة من سجل المحادثة (append-only): كل دور يضيف صفوفه الجديدة فقط بدل إعادة كتابة state كاملة
+    seq = ترتيب الرسالة داخل الجلسة (0، 1، ...)؛ الفهرس الفريد (session, seq) يخدم قراءة آخر الرسائل
+    """
+    session = models.ForeignKey(ConversationSession, on_delete=models.CASCADE, related_name='messages')
+    seq = models.PositiveIntegerField()
+    role = models.CharField(max_length=20)
+    payload = models.JSONField()  # نفس شكل الرسالة المرسلة للـ LLM (role, content, tool_calls, ...)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['session', 'seq']
+        constraints = [
+            models.UniqueConstraint(fields=['session', 'seq'], name='conversationmessage_session_seq_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.session_id} #{self.seq} ({self.role})"
+
+class ToolResultBlob(models.Model):
+    """
+    نتيجة أداة Agent كاملة مخزنة مرة واحدة خارج ConversationSession.state (المفتاح = sha256 للمحتوى)
+    سجل الجلسة يحمل ملخصاً صغيراً ومرجعاً فقط، والنموذج يسترجع التفاصيل عند الحاجة عبر أداة get_tool_result
+    """
+    digest = models.CharField(max_length=64, unique=True)
+    tool_name = models.CharField(max_length=100)
+    content = models.TextField()  # نفس نص رسالة role: tool الأصلية (JSON)
+    size = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.tool_name} - {self.digest[:16]}"
+
+class AgentJob(models.Model):
+    """
+    مهمة خلفية لإكمال دور محادثة في وضع searching (تنفيذ pending_tool_calls ثم جولة الـ LLM التالية)
+    ينفذها أمر run_agent_worker خارج عمليات الـ HTTP، والنتيجة تُقرأ من ai/chat/jobs/<job_id>/
+    """
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'بانتظار التنفيذ'),
+        (STATUS_RUNNING, 'قيد التنفيذ'),
+        (STATUS_DONE, 'مكتملة'),
+        (STATUS_FAILED, 'فشلت'),
+    ]
+
+    job_id = models.UUIDField(default=uuid.uuid4, unique=True, editable=False)
+    session = models.ForeignKey(ConversationSession, on_delete=models.CASCADE, related_name='agent_jobs')
+    user = models.ForeignKey('User', on_delete=models.CASCADE, related_name='agent_jobs')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    result = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder)  # رد الـ Agent النهائي (نفس شكل رد /api/ai/chat/)
+    error = models.TextField(blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    worker = models.CharField(max_length=100, blank=True)  # معرف العامل الذي حجز المهمة
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['created_at']
+        indexes = [
+            # العامل يبحث دائماً عن أقدم مهمة بحالة معينة
+            models.Index(fields=['status', 'created_at'], name='agentjob_status_created_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.job_id} - {self.status}"
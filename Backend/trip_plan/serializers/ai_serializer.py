@@ -1,24 +1,26 @@
 from rest_framework import serializers
 from .travel_serializer import DestinationSerializer, HotelSerializer
 
+class AICostBreakdownSerializer(serializers.Serializer):
+    flights = serializers.FloatField(required=False)
+    accommodation = serializers.FloatField(required=False)
+    daily_living = serializers.FloatField(required=False)
+    total = serializers.FloatField(required=False)
+
 class AIPlanDetailsSerializer(serializers.Serializer):
     """توصيف تفاصيل الخطة التي يولدها الـ AI"""
+    option_id = serializers.IntegerField(required=False, help_text="رقم الخيار المختار من options")
     destination_id = serializers.IntegerField(help_text="ID الوجهة المختارة من قاعدة البيانات")
     hotel_id = serializers.IntegerField(help_text="ID الفندق المختار")
     total_cost = serializers.FloatField(help_text="التكلفة الإجمالية المحسوبة")
     days = serializers.IntegerField(help_text="عدد أيام الإقامة")
+    cost_breakdown = AICostBreakdownSerializer(required=False)
     events = serializers.ListField(
         child=serializers.DictField(),
         required=False,
         allow_empty=True
     )
 
-class AICostBreakdownSerializer(serializers.Serializer):
-    flights = serializers.FloatField(required=False)
-    accommodation = serializers.FloatField(required=False)
-    daily_living = serializers.FloatField(required=False)
-    total = serializers.FloatField(required=False)
-
 class AIOptionSerializer(serializers.Serializer):
     option_id = serializers.IntegerField()
     destination_id = serializers.IntegerField()
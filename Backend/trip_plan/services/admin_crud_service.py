@@ -1,6 +1,17 @@
 from django.db import transaction
-from ..models.travel_model import Destination, Hotel, ImageAsset, Event
+from ..models.travel_model import Destination, Hotel, ImageAsset, Event, season_mask_from_text
 from django.shortcuts import get_object_or_404
+from .catalog_version import bump_catalog_version
+
+
+def _catalog_changed():
+    """
+    زيادة رقم نسخة الكتالوج بعد نجاح الـ transaction
+    (يُعيد بناء فهرس البحث ويُبطل نتائج الأدوات المخزنة؛ في كل العمليات فقط مع cache مشترك (REDIS_URL)،
+    ومع LocMemCache الافتراضي تلتقط العمليات الأخرى التعديل بعد انتهاء TTL الفهرس/الكاش)
+    """
+    transaction.on_commit(bump_catalog_version)
+
 
 class AdminCRUDService:
 
@@ -15,6 +26,7 @@ class AdminCRUDService:
         if images:
             for img in images:
                 ImageAsset.objects.create(destination=destination, file=img)
+        _catalog_changed()
         return destination
 
     @staticmethod
@@ -24,6 +36,10 @@ class AdminCRUDService:
         destination = Destination.objects.filter(id=dest_id)
         if not destination.exists():
             raise Exception("الوجهة غير موجودة")
+
+        # update() لا يستدعي save()، لذلك نحدّث season_mask يدوياً مع best_seasons
+        if 'best_seasons' in data:
+            data['season_mask'] = season_mask_from_text(data.get('best_seasons'))
         
         destination.update(**data)
         instance = destination.first()
@@ -31,12 +47,15 @@ class AdminCRUDService:
         if new_images:
             for img in new_images:
                 ImageAsset.objects.create(destination=instance, file=img)
+        _catalog_changed()
         return instance
 
     @staticmethod
     def delete_destination(dest_id):
         """حذف الوجهة (سيتم حذف الفنادق والصور المرتبطة تلقائياً بسبب CASCADE)"""
-        return Destination.objects.filter(id=dest_id).delete()
+        result = Destination.objects.filter(id=dest_id).delete()
+        _catalog_changed()
+        return result
 
     # -----------------------
     # إدارة الفنادق (Hotels)
@@ -49,9 +68,11 @@ class AdminCRUDService:
         if images:
             for img in images:
                 ImageAsset.objects.create(hotel=hotel, file=img)
+        _catalog_changed()
         return hotel
 
     @staticmethod
+    @transaction.atomic
     def update_hotel(hotel_id, data, new_images=None):
         hotel = Hotel.objects.filter(id=hotel_id)
         if not hotel.exists():
@@ -63,19 +84,32 @@ class AdminCRUDService:
         if new_images:
             for img in new_images:
                 ImageAsset.objects.create(hotel=instance, file=img)
+        _catalog_changed()
         return instance
 
     @staticmethod
     def delete_hotel(hotel_id):
-        return Hotel.objects.filter(id=hotel_id).delete()
+        result = Hotel.objects.filter(id=hotel_id).delete()
+        _catalog_changed()
+        return result
 
     # -----------------------
     # إدارة الصور (Images)
     # -----------------------
+    @staticmethod
+    @transaction.atomic
+    def save_image(serializer):
+        """إضافة أو تعديل صورة عبر serializer تم التحقق منه"""
+        image = serializer.save()
+        _catalog_changed()
+        return image
+
     @staticmethod
     def delete_image(image_id):
         """حذف صورة محددة فقط (RE-FR-16)"""
-        return ImageAsset.objects.filter(id=image_id).delete()
+        result = ImageAsset.objects.filter(id=image_id).delete()
+        _catalog_changed()
+        return result
 
     # -----------------------
     # إدارة الفعاليات (Events)
@@ -87,6 +121,7 @@ class AdminCRUDService:
         if images:
             for img in images:
                 ImageAsset.objects.create(event=event, file=img)
+        _catalog_changed()
         return event
 
     @staticmethod
@@ -102,8 +137,11 @@ class AdminCRUDService:
         if new_images:
             for img in new_images:
                 ImageAsset.objects.create(event=instance, file=img)
+        _catalog_changed()
         return instance
 
     @staticmethod
     def delete_event(event_id):
-        return Event.objects.filter(id=event_id).delete()
\ No newline at end of file
+        result = Event.objects.filter(id=event_id).delete()
+        _catalog_changed()
+        return result
\ No newline at end of file
@@ -0,0 +1,239 @@
+import asyncio
+import math
+import random
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .concurrency import run_in_worker_thread
+from .latency import LatencyWindow
+
+
+ADMISSION_KEY_PREFIX = "trip_plan:admission"
+
+
+class AdmissionRejected(Exception):
+    """الطلب رُفض لأن الخدمة مشبعة؛ retry_after بالثواني لترويسة Retry-After"""
+
+    def __init__(self, reason, retry_after):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionSlot:
+    """مقعد محجوز لطلب محادثة واحد؛ يجب تحريره مرة واحدة عند انتهاء الطلب (أو انتهاء الـ stream)"""
+
+    def __init__(self, controller, user_id):
+        self.controller = controller
+        self.user_id = user_id
+        self.acquired_at = time.monotonic()
+        self._released = False
+
+    def release(self):
+        if self._released or self.controller is None:
+            return
+        self._released = True
+        self.controller._release(self.user_id, (time.monotonic() - self.acquired_at) * 1000)
+
+
+class AdmissionControl:
+    """
+    التحكم في قبول طلبات /api/ai/chat/ قبل حجز worker لمدة طويلة:
+    - حد أقصى لعدد الطلبات المتزامنة لكل مستخدم (AI_ADMISSION_MAX_PER_USER) وللخدمة كلها (AI_ADMISSION_MAX_CONCURRENT)
+    - العدادات مشتركة بين العمليات عبر Django cache (incr/decr)، ولها TTL يحرر المقاعد إذا توقفت عملية دون تحريرها
+    - الطلب الذي لا يجد مقعداً ينتظر حتى AI_ADMISSION_MAX_WAIT ثانية ضمن طابور محدود (AI_ADMISSION_MAX_QUEUE)،
+      وبعدها (أو إذا كان الطابور ممتلئاً) يُرفض فوراً بـ 429 و Retry-After
+    ملاحظة: مع LocMemCache (الافتراضي) تكون الحدود لكل عملية؛ للحدود المشتركة يلزم cache مشترك (REDIS_URL في الإعدادات)
+    """
+
+    GLOBAL_KEY = ADMISSION_KEY_PREFIX + ":global"
+    WAITING_KEY = ADMISSION_KEY_PREFIX + ":waiting"
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hold_ms = LatencyWindow(maxlen=200)
+        self.wait_ms = LatencyWindow(maxlen=200)
+        self.admitted = 0
+        self.admitted_after_wait = 0
+        self.rejected = {"user_limit": 0, "global_limit": 0, "queue_full": 0}
+        self.max_queue_depth = 0
+
+    @staticmethod
+    def is_enabled():
+        return getattr(settings, "AI_ADMISSION_ENABLED", True)
+
+    @staticmethod
+    def _user_key(user_id):
+        return "%s:user:%s" % (ADMISSION_KEY_PREFIX, user_id)
+
+    @staticmethod
+    def _slot_ttl():
+        return getattr(settings, "AI_ADMISSION_SLOT_TTL", 300)
+
+    def _incr(self, key):
+        try:
+            value = cache.incr(key)
+        except ValueError:
+            # المفتاح غير موجود (أول طلب أو انتهى الـ TTL)
+            cache.add(key, 0, timeout=self._slot_ttl())
+            value = cache.incr(key)
+        # كل حجز يمدد عمر العداد، فلا ينتهي أثناء حمل مستمر
+        cache.touch(key, self._slot_ttl())
+        return value
+
+    def _decr(self, key):
+        try:
+            if cache.decr(key) < 0:
+                # انتهى الـ TTL ثم أُعيد إنشاء العداد أثناء وجود مقاعد قديمة
+                cache.set(key, 0, timeout=self._slot_ttl())
+        except ValueError:
+            pass
+
+    def _try_acquire(self, user_id):
+        """محاولة حجز مقعد مرة واحدة: None عند النجاح أو سبب الرفض"""
+        user_key = self._user_key(user_id)
+        if self._incr(user_key) > getattr(settings, "AI_ADMISSION_MAX_PER_USER", 2):
+            self._decr(user_key)
+            return "user_limit"
+        if self._incr(self.GLOBAL_KEY) > getattr(settings, "AI_ADMISSION_MAX_CONCURRENT", 32):
+            self._decr(self.GLOBAL_KEY)
+            self._decr(user_key)
+            return "global_limit"
+        return None
+
+    def _release(self, user_id, held_ms):
+        self._decr(self.GLOBAL_KEY)
+        self._decr(self._user_key(user_id))
+        self.hold_ms.observe(held_ms)
+
+    def _enter_queue(self):
+        """دخول طابور الانتظار المشترك؛ False إذا كان ممتلئاً"""
+        depth = self._incr(self.WAITING_KEY)
+        with self._lock:
+            self.max_queue_depth = max(self.max_queue_depth, depth)
+        if depth > getattr(settings, "AI_ADMISSION_MAX_QUEUE", 64):
+            self._decr(self.WAITING_KEY)
+            return False
+        return True
+
+    def retry_after(self):
+        """تقدير ثواني Retry-After من متوسط مدة حجز المقعد مؤخراً (بين 1 و 30)"""
+        typical = self.hold_ms.percentile(50)
+        if typical is None:
+            return 1
+        return min(30, max(1, int(math.ceil(typical / 1000))))
+
+    def _admit(self, user_id, waited_ms=None):
+        with self._lock:
+            self.admitted += 1
+            if waited_ms is not None:
+                self.admitted_after_wait += 1
+        if waited_ms is not None:
+            self.wait_ms.observe(waited_ms)
+        return AdmissionSlot(self, user_id)
+
+    def _reject(self, reason, waited_ms=None):
+        with self._lock:
+            self.rejected[reason] += 1
+        if waited_ms is not None:
+            self.wait_ms.observe(waited_ms, error=True)
+        return AdmissionRejected(reason, self.retry_after())
+
+    @staticmethod
+    def _poll_delay(attempt):
+        # backoff قصير مع jitter حتى لا تستيقظ الطلبات المنتظرة معاً
+        return min(0.25, 0.02 * (2 ** attempt)) * random.uniform(0.5, 1.0)
+
+    def acquire(self, user_id):
+        """
+        حجز مقعد للمستخدم (ينتظر حتى AI_ADMISSION_MAX_WAIT ثانية)
+        يعيد AdmissionSlot أو يرفع AdmissionRejected (مقعد بدون أثر إذا كان التحكم معطلاً)
+        """
+        if not self.is_enabled():
+            return AdmissionSlot(None, user_id)
+        reason = self._try_acquire(user_id)
+        if reason is None:
+            return self._admit(user_id)
+
+        max_wait = getattr(settings, "AI_ADMISSION_MAX_WAIT", 5)
+        if max_wait <= 0:
+            raise self._reject(reason)
+        if not self._enter_queue():
+            raise self._reject("queue_full")
+
+        started = time.monotonic()
+        deadline = started + max_wait
+        attempt = 0
+        try:
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise self._reject(reason, (time.monotonic() - started) * 1000)
+                time.sleep(min(remaining, self._poll_delay(attempt)))
+                attempt += 1
+                reason = self._try_acquire(user_id)
+                if reason is None:
+                    return self._admit(user_id, (time.monotonic() - started) * 1000)
+        finally:
+            self._decr(self.WAITING_KEY)
+
+    async def aacquire(self, user_id):
+        """نسخة async من acquire: الانتظار عبر asyncio.sleep بدل حجز thread"""
+        if not self.is_enabled():
+            return AdmissionSlot(None, user_id)
+        reason = await run_in_worker_thread(self._try_acquire, user_id)
+        if reason is None:
+            return self._admit(user_id)
+
+        max_wait = getattr(settings, "AI_ADMISSION_MAX_WAIT", 5)
+        if max_wait <= 0:
+            raise self._reject(reason)
+        if not await run_in_worker_thread(self._enter_queue):
+            raise self._reject("queue_full")
+
+        started = time.monotonic()
+        deadline = started + max_wait
+        attempt = 0
+        try:
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise self._reject(reason, (time.monotonic() - started) * 1000)
+                await asyncio.sleep(min(remaining, self._poll_delay(attempt)))
+                attempt += 1
+                reason = await run_in_worker_thread(self._try_acquire, user_id)
+                if reason is None:
+                    return self._admit(user_id, (time.monotonic() - started) * 1000)
+        finally:
+            await run_in_worker_thread(self._decr, self.WAITING_KEY)
+
+    async def arelease(self, slot):
+        await run_in_worker_thread(slot.release)
+
+    def stats(self):
+        with self._lock:
+            data = {
+                "enabled": self.is_enabled(),
+                "in_flight": cache.get(self.GLOBAL_KEY, 0),
+                "queue_depth": cache.get(self.WAITING_KEY, 0),
+                "max_queue_depth": self.max_queue_depth,
+                "admitted": self.admitted,
+                "admitted_after_wait": self.admitted_after_wait,
+                "rejected": dict(self.rejected),
+            }
+        data["limits"] = {
+            "max_concurrent": getattr(settings, "AI_ADMISSION_MAX_CONCURRENT", 32),
+            "max_per_user": getattr(settings, "AI_ADMISSION_MAX_PER_USER", 2),
+            "max_queue": getattr(settings, "AI_ADMISSION_MAX_QUEUE", 64),
+            "max_wait_s": getattr(settings, "AI_ADMISSION_MAX_WAIT", 5),
+        }
+        data["wait_ms"] = self.wait_ms.snapshot()
+        data["hold_ms"] = self.hold_ms.snapshot()
+        data["retry_after_s"] = self.retry_after()
+        return data
+
+
+admission_control = AdmissionControl()
@@ -0,0 +1,153 @@
+import logging
+import threading
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Q
+from django.utils import timezone
+
+from ..models.travel_model import AgentJob
+
+
+logger = logging.getLogger(__name__)
+
+
+class AgentJobQueue:
+    """
+    طابور مهام خلفية مخزن في قاعدة البيانات (جدول AgentJob) لإكمال أدوار وضع searching
+    - enqueue: من طلب الـ HTTP (مهمة واحدة نشطة لكل جلسة)
+    - claim: من العامل عبر SELECT ... FOR UPDATE SKIP LOCKED، فعدة عمال لا يحجزون نفس المهمة
+    - مهمة running لم تنتهِ خلال AI_JOB_STALE_AFTER ثانية (عامل توقف) تُحجز من جديد حتى AI_JOB_MAX_ATTEMPTS
+    """
+
+    ACTIVE_STATUSES = (AgentJob.STATUS_PENDING, AgentJob.STATUS_RUNNING)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.enqueued = 0
+        self.claimed = 0
+        self.completed = 0
+        self.failed = 0
+        self.retried = 0
+        self.dropped = 0
+
+    def _count(self, attr):
+        with self._lock:
+            setattr(self, attr, getattr(self, attr) + 1)
+
+    @staticmethod
+    def active_job(session):
+        return (
+            AgentJob.objects.filter(session=session, status__in=AgentJobQueue.ACTIVE_STATUSES)
+            .order_by('created_at')
+            .first()
+        )
+
+    def enqueue(self, session):
+        """إضافة مهمة لإكمال الدور المعلق في الجلسة (أو إعادة المهمة النشطة إن وجدت)"""
+        job = self.active_job(session)
+        if job is None:
+            job = AgentJob.objects.create(session=session, user_id=session.user_id)
+            self._count("enqueued")
+        return job
+
+    def claim(self, worker):
+        """حجز أقدم مهمة متاحة لهذا العامل، أو None إذا لم توجد"""
+        max_attempts = getattr(settings, "AI_JOB_MAX_ATTEMPTS", 3)
+        stale_before = timezone.now() - timedelta(seconds=getattr(settings, "AI_JOB_STALE_AFTER", 300))
+
+        while True:
+            with transaction.atomic():
+                job = (
+                    AgentJob.objects.select_for_update(skip_locked=True)
+                    .filter(
+                        Q(status=AgentJob.STATUS_PENDING)
+                        | Q(status=AgentJob.STATUS_RUNNING, started_at__lt=stale_before)
+                    )
+                    .order_by('created_at')
+                    .first()
+                )
+                if job is None:
+                    return None
+
+                if job.attempts >= max_attempts:
+                    # عامل سابق توقف أثناء تنفيذها عدة مرات: لا نعيد المحاولة
+                    job.status = AgentJob.STATUS_FAILED
+                    job.error = job.error or "Worker did not finish the job"
+                    job.finished_at = timezone.now()
+                    job.save(update_fields=['status', 'error', 'finished_at'])
+                    self._count("failed")
+                    continue
+
+                job.status = AgentJob.STATUS_RUNNING
+                job.worker = worker
+                job.attempts += 1
+                job.started_at = timezone.now()
+                job.save(update_fields=['status', 'worker', 'attempts', 'started_at'])
+            self._count("claimed")
+            return job
+
+    @staticmethod
+    def _save(job, fields):
+        # update بدل save(update_fields): صف المهمة قد يكون حُذف مع جلسته (CASCADE) أثناء التنفيذ
+        AgentJob.objects.filter(pk=job.pk).update(**{field: getattr(job, field) for field in fields})
+
+    def complete(self, job, result):
+        job.status = AgentJob.STATUS_DONE
+        job.result = result
+        job.error = ""
+        job.finished_at = timezone.now()
+        self._save(job, ['status', 'result', 'error', 'finished_at'])
+        self._count("completed")
+
+    def fail(self, job, error, result=None):
+        """
+        فشل محاولة: تعود المهمة للطابور إذا بقيت محاولات (حالة الجلسة لم تتغير بعد)،
+        وإلا تُعلَّم failed نهائياً. يعيد True إذا كان الفشل نهائياً
+        """
+        job.error = str(error)[:2000]
+        if job.attempts < getattr(settings, "AI_JOB_MAX_ATTEMPTS", 3):
+            job.status = AgentJob.STATUS_PENDING
+            self._save(job, ['status', 'error'])
+            self._count("retried")
+            return False
+
+        job.status = AgentJob.STATUS_FAILED
+        job.result = result
+        job.finished_at = timezone.now()
+        self._save(job, ['status', 'error', 'result', 'finished_at'])
+        self._count("failed")
+        logger.warning("Agent job %s failed after %d attempt(s): %s", job.job_id, job.attempts, job.error)
+        return True
+
+    def drop(self, job, reason):
+        """
+        إنهاء مهمة لم يعد لها ما تنفذه (الجلسة حُذفت، أو الأدوات المعلقة أُلغيت أو اكتمل الدور)
+        تُعلَّم failed مباشرة بدون إعادة محاولة وبدون لمس حالة الجلسة
+        """
+        job.status = AgentJob.STATUS_FAILED
+        job.error = reason
+        job.finished_at = timezone.now()
+        self._save(job, ['status', 'error', 'finished_at'])
+        self._count("dropped")
+        logger.info("Agent job %s dropped: %s", job.job_id, reason)
+
+    def stats(self):
+        """عدد المهام حسب الحالة (من قاعدة البيانات) + عدادات هذه العملية"""
+        counts = dict.fromkeys((status for status, _ in AgentJob.STATUS_CHOICES), 0)
+        for row in AgentJob.objects.values('status').order_by().annotate(count=Count('id')):
+            counts[row['status']] = row['count']
+        with self._lock:
+            return {
+                "queue": counts,
+                "enqueued": self.enqueued,
+                "claimed": self.claimed,
+                "completed": self.completed,
+                "failed": self.failed,
+                "retried": self.retried,
+                "dropped": self.dropped,
+            }
+
+
+agent_job_queue = AgentJobQueue()
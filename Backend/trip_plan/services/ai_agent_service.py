@@ -1,20 +1,60 @@
 import os
+import asyncio
 import json
 import re
-import ast
 import logging
+import httpx
 import requests
+import time
 import uuid
+from concurrent.futures import as_completed
+from functools import partial
 from decimal import Decimal
-from django.db.models import Q
+from django.db.models import F, Value, DecimalField, ExpressionWrapper
 from django.utils import timezone
 from django.conf import settings
-from ..models.travel_model import Destination, Hotel, ConversationSession, Event
+from django.db import transaction
+from ..models.travel_model import (
+    Destination, Hotel, ConversationSession, Event, normalize_season, season_masks_containing,
+)
 from ..serializers.travel_serializer import DestinationSerializer, HotelSerializer, EventSerializer
+from .catalog_index import CatalogIndex, trip_costs
+from .tool_cache import tool_result_cache
+from .llm_http import AbortableRequest, abortable_request, get_llm_http_client, get_async_llm_http_client
+from .llm_cache import llm_response_cache
+from .cache_utils import MISSING
+from .concurrency import call_with_own_db_connection, get_llm_hedge_pool, get_tool_executor, run_in_worker_thread
+from .latency import tool_latency
+from .conversation_history import ConversationHistory
+from .stream_parser import TrailingJSONStreamParser
+from .json_recovery import recover_json_object, recover_json_with_mode
+from .structured_output import model_capabilities, response_format_for, is_structured_output_rejection, REJECTION_STATUSES
+from .prompt_cache import apply_cache_hints, llm_usage
+from .model_router import model_router, phase_for
+from .requirements_extractor import requirements_fast_path
+from .agent_jobs import agent_job_queue
+from .single_flight import llm_flight, async_llm_flight
+from .provider_gateway import ProviderUnavailable, provider_gateway
+from .hedging import hedge_policy
+from .tool_result_store import tool_result_store
+from .message_log import message_log
+from . import speculative_search as speculation
 
 
 logger = logging.getLogger(__name__)
 
+# كل الحقول المتاحة لنتيجة البحث، والحقول المختصرة التي تُرسل افتراضياً للـ LLM
+SEARCH_RESULT_FIELDS = (
+    'destination_id', 'destination_name', 'country', 'is_coastal', 'description',
+    'hotel_id', 'hotel_name', 'stars', 'is_sea_view', 'price_per_night',
+    'total_cost', 'cost_breakdown',
+)
+DEFAULT_SEARCH_FIELDS = (
+    'destination_id', 'destination_name', 'country', 'is_coastal',
+    'hotel_id', 'hotel_name', 'stars', 'is_sea_view', 'price_per_night',
+    'total_cost', 'cost_breakdown',
+)
+
 
 class TravelAgentService:
     """
@@ -26,12 +66,27 @@ class TravelAgentService:
     - مخرجات منظمة (Structured Output)
     """
     
+    # الحد الأقصى لجولات تنفيذ الأدوات في الدور الواحد
+    MAX_TOOL_ROUNDS = 4
+
+    # الحقل الذي سأل عنه المسار السريع في الدور السابق (لفهم جواب مثل "5" وحده)
+    AWAITING_FIELD_KEY = 'awaiting_field'
+
+    # مفاتيح حالة تبقى محفوظة مع الجلسة عبر الأدوار (بجانب requirements و messages)
+    PERSISTENT_STATE_KEYS = (ConversationHistory.STATE_KEY, speculation.STATE_KEY)
+
+    _tools_definition = None
+
     def __init__(self, user=None):
         self.api_key = settings.OPENROUTER_API_KEY
         self.model = getattr(settings, "AI_MODEL", "arcee-ai/trinity-large-preview:free")
-        self.api_url = "https://openrouter.ai/api/v1/chat/completions"
+        # آخر نموذج استُدعي فعلياً (قد يختلف عن self.model حسب AI_MODEL_ROUTES)
+        self.last_model = None
+        self.api_url = getattr(settings, "OPENROUTER_API_URL", "https://openrouter.ai/api/v1/chat/completions")
         self.user = user
         
+        self.history = ConversationHistory()
+        
         self.legacy_status_mode = getattr(settings, "AI_LEGACY_STATUS_MODE", True)
         self.enable_searching_first_response = getattr(settings, "AI_ENABLE_SEARCHING_FIRST_RESPONSE", False)
 
@@ -240,7 +295,8 @@ class TravelAgentService:
     
     @staticmethod
     def search_destinations_and_hotels(budget=None, days=None, people=None, 
-                                      is_coastal=None, min_stars=3, season=None, is_sea_view=None):
+                                      is_coastal=None, min_stars=3, season=None, is_sea_view=None,
+                                      limit=None, offset=0, fields=None):
         """
         أداة البحث: تبحث عن وجهات وفنادق مناسبة حسب المتطلبات
         
@@ -250,90 +306,139 @@ class TravelAgentService:
             people: عدد الأشخاص (اختياري)
             is_coastal: ساحلي أم لا (اختياري)
             min_stars: الحد الأدنى للنجوم (افتراضي 3)
+            limit: عدد النتائج في الصفحة (افتراضي AI_SEARCH_DEFAULT_LIMIT)
+            offset: عدد النتائج التي يتم تخطيها (للصفحات التالية)
+            fields: الحقول المطلوبة لكل نتيجة (افتراضياً DEFAULT_SEARCH_FIELDS بدون الوصف)
         
         Returns:
-            قائمة بالخيارات المتاحة مع التكلفة المحسوبة
+            صفحة من الخيارات المتاحة (الأرخص أولاً) مع التكلفة المحسوبة
         """
-        # جلب الوجهات
-        destinations = Destination.objects.prefetch_related(
-            'hotels', 'dest_images'
-        ).all()
-        
+        with_cost = bool(budget and days and people)
+        if with_cost:
+            days, people = int(days), int(people)
+
+        # تحديد حجم الصفحة: الصفحة لا تتجاوز AI_SEARCH_MAX_RESULTS
+        max_results = getattr(settings, "AI_SEARCH_MAX_RESULTS", 50)
+        try:
+            limit = int(limit or getattr(settings, "AI_SEARCH_DEFAULT_LIMIT", 8))
+            offset = max(int(offset or 0), 0)
+        except (TypeError, ValueError):
+            limit, offset = getattr(settings, "AI_SEARCH_DEFAULT_LIMIT", 8), 0
+        limit = max(1, min(limit, max_results)) if max_results else max(1, limit)
+
+        if isinstance(fields, str):
+            fields = [f.strip() for f in fields.split(",")]
+        selected_fields = [f for f in (fields or DEFAULT_SEARCH_FIELDS) if f in SEARCH_RESULT_FIELDS]
+        for key in ('hotel_id', 'destination_id'):
+            if key not in selected_fields:
+                selected_fields.insert(0, key)
+
+        # نجلب صفاً إضافياً لمعرفة وجود صفحة تالية بدون استعلام count منفصل
+        filters = dict(
+            budget=budget, days=days, people=people, is_coastal=is_coastal,
+            min_stars=min_stars, season=season, is_sea_view=is_sea_view, limit=offset + limit + 1,
+        )
+
+        # index: فهرس NumPy داخل الذاكرة (بدون استعلامات) | db: استعلام SQL واحد
+        if getattr(settings, "AI_SEARCH_BACKEND", "index") == "index":
+            rows = CatalogIndex.search(**filters)
+        else:
+            rows = TravelAgentService._search_rows_in_db(**filters)
+
+        rows = list(rows)
+        has_more = len(rows) > offset + limit
+        rows = rows[offset:offset + limit]
+
+        results = []
+        for row in rows:
+            if with_cost:
+                total_cost = TravelAgentService.calculate_trip_cost(
+                    row['destination__flight_cost'],
+                    row['destination__daily_living_cost'],
+                    row['price_per_night'],
+                    days,
+                    people
+                )
+                cost_breakdown = {
+                    'flights': float(row['destination__flight_cost']) * people,
+                    'accommodation': float(row['price_per_night']) * days,
+                    'daily_living': float(row['destination__daily_living_cost']) * days * people,
+                    'total': total_cost
+                }
+            else:
+                total_cost = None
+                cost_breakdown = None
+
+            result = {
+                'destination_id': row['destination_id'],
+                'destination_name': row['destination__name'],
+                'country': row['destination__country'],
+                'is_coastal': row['destination__is_coastal'],
+                'description': row['destination__description'],
+                'hotel_id': row['id'],
+                'hotel_name': row['name'],
+                'stars': row['stars'],
+                'is_sea_view': row['is_sea_view'],
+                'price_per_night': float(row['price_per_night']),
+                'total_cost': total_cost,
+                'cost_breakdown': cost_breakdown
+            }
+            results.append({key: result[key] for key in selected_fields})
+
+        return {
+            'results': results,
+            'offset': offset,
+            'limit': limit,
+            'has_more': has_more,
+        }
+
+    @staticmethod
+    def _search_rows_in_db(budget=None, days=None, people=None, is_coastal=None,
+                           min_stars=3, season=None, is_sea_view=None, limit=None):
+        """مسار البحث عبر قاعدة البيانات: استعلام واحد مع حساب التكلفة والفلترة والترتيب والـ LIMIT"""
+        with_cost = bool(budget and days and people)
+
+        # استعلام واحد على الفنادق مع join للوجهة بدل حلقة استعلامات لكل وجهة (N+1)
+        hotels = Hotel.objects.filter(stars__gte=min_stars or 1)
+
         # فلترة حسب الساحلية
         if is_coastal is not None:
-            destinations = destinations.filter(is_coastal=is_coastal)
+            hotels = hotels.filter(destination__is_coastal=is_coastal)
 
-        # فلترة موسمية حسب best_seasons (قيم نصية مفصولة بفواصل)
+        if is_sea_view is not None:
+            hotels = hotels.filter(is_sea_view=is_sea_view)
+
+        # فلترة موسمية عبر season_mask المفهرس (IN على القيم التي تحتوي بت الموسم)
+        season = normalize_season(season) if season else None
         if season and season != "all":
-            season_map = {
-                "summer": ["summer", "صيف"],
-                "winter": ["winter", "شتاء"],
-                "spring": ["spring", "ربيع"],
-                "autumn": ["autumn", "fall", "خريف"],
-            }
-            tokens = season_map.get(str(season).lower(), [str(season)])
-            season_q = Q()
-            for tok in tokens:
-                season_q |= Q(best_seasons__icontains=tok)
-            destinations = destinations.filter(season_q)
-        
-        results = []
-        
-        for dest in destinations:
-            # جلب الفنادق المناسبة
-            hotels = dest.hotels.prefetch_related('hotel_images').filter(
-                stars__gte=min_stars
-            )
+            hotels = hotels.filter(destination__season_mask__in=season_masks_containing(season))
 
-            if is_sea_view is not None:
-                hotels = hotels.filter(is_sea_view=is_sea_view)
-            
-            for hotel in hotels:
-                # حساب التكلفة إذا توفرت المعلومات
-                if budget and days and people:
-                    total_cost = TravelAgentService.calculate_trip_cost(
-                        dest.flight_cost,
-                        dest.daily_living_cost,
-                        hotel.price_per_night,
-                        days,
-                        people
-                    )
-                    
-                    # تخطي إذا تجاوز الميزانية
-                    if total_cost > budget:
-                        continue
-                    
-                    cost_breakdown = {
-                        'flights': float(dest.flight_cost) * people,
-                        'accommodation': float(hotel.price_per_night) * days,
-                        'daily_living': float(dest.daily_living_cost) * days * people,
-                        'total': total_cost
-                    }
-                else:
-                    total_cost = None
-                    cost_breakdown = None
-                
-                # إضافة النتيجة
-                results.append({
-                    'destination_id': dest.id,
-                    'destination_name': dest.name,
-                    'country': dest.country,
-                    'is_coastal': dest.is_coastal,
-                    'description': dest.description,
-                    'hotel_id': hotel.id,
-                    'hotel_name': hotel.name,
-                    'stars': hotel.stars,
-                    'is_sea_view': hotel.is_sea_view,
-                    'price_per_night': float(hotel.price_per_night),
-                    'total_cost': total_cost,
-                    'cost_breakdown': cost_breakdown
-                })
-        
-        # ترتيب حسب التكلفة
-        if budget and days and people:
-            results.sort(key=lambda x: x['total_cost'])
-        
-        return results
+        rows = hotels.values(
+            'id', 'name', 'stars', 'is_sea_view', 'price_per_night',
+            'destination_id', 'destination__name', 'destination__country',
+            'destination__is_coastal', 'destination__description',
+            'destination__flight_cost', 'destination__daily_living_cost',
+        )
+
+        if with_cost:
+            # حساب التكلفة الكلية داخل قاعدة البيانات ثم الفلترة والترتيب والـ LIMIT في نفس الاستعلام
+            rows = rows.annotate(
+                total_cost_db=ExpressionWrapper(
+                    F('destination__flight_cost') * Value(int(people))
+                    + F('price_per_night') * Value(int(days))
+                    + F('destination__daily_living_cost') * Value(int(days) * int(people)),
+                    output_field=DecimalField(max_digits=16, decimal_places=2),
+                )
+            ).filter(
+                total_cost_db__lte=Decimal(str(budget))
+            ).order_by('total_cost_db', 'id')
+        else:
+            rows = rows.order_by('destination_id', 'id')
+
+        if limit:
+            rows = rows[:limit]
+
+        return rows
     
     @staticmethod
     def calculate_trip_cost(flight_cost, daily_living_cost, hotel_price, days, people):
@@ -342,16 +447,16 @@ class TravelAgentService:
         
         Formula: (flight_cost × people) + (hotel_price × days) + (daily_living × days × people)
         """
-        flight_total = float(flight_cost) * people
-        accommodation = float(hotel_price) * days
-        living = float(daily_living_cost) * days * people
-        
-        return round(flight_total + accommodation + living, 2)
+        total = trip_costs(
+            float(flight_cost), float(daily_living_cost), float(hotel_price), days, people
+        )
+        return round(float(total), 2)
 
     @staticmethod
     def calculate_trip_cost_tool(flight_cost, daily_living_cost, hotel_price, days, people):
         """
         أداة مستقلة لحساب التكلفة الكلية يمكن للـ LLM استدعاؤها مباشرة
+        (نفس معادلة trip_costs المستخدمة على مصفوفات الفهرس في البحث)
         """
         total = TravelAgentService.calculate_trip_cost(
             flight_cost, daily_living_cost, hotel_price, days, people
@@ -388,22 +493,47 @@ class TravelAgentService:
     @staticmethod
     def search_events(destination_id, season="all", max_price=None):
         events = Event.objects.filter(destination_id=destination_id)
+        # توحيد اسم الموسم (صيف/summer ...) ليطابق قيم Event.season على index (destination, season)
+        season = normalize_season(season) or season or "all"
         if season != "all":
             events = events.filter(season__in=[season, "all"])
         if max_price is not None:
             events = events.filter(price_per_person__lte=max_price)
         return EventSerializer(events, many=True).data
     
+    @staticmethod
+    def get_tool_result(ref):
+        """
+        أداة استرجاع نتيجة أداة سابقة كاملة من ToolResultBlob
+        (السجل يحمل ملخصاً بصيغة [tool_result ref=...] بدل النتيجة الكاملة)
+        """
+        content = tool_result_store.fetch(ref)
+        if content is None:
+            return {"error": f"Tool result not found: {ref}"}
+        try:
+            return json.loads(content)
+        except ValueError:
+            return {"content": content}
+
     # ==================== Function Calling Definition ====================
     
     def get_tools_definition(self):
-        """تعريف الأدوات المتاحة للـ LLM"""
+        """
+        تعريف الأدوات المتاحة للـ LLM
+        يُبنى مرة واحدة لكل عملية: نفس الكائن في كل طلب يبقي الـ prefix المرسل للمزود ثابتاً byte-by-byte
+        """
+        if TravelAgentService._tools_definition is None:
+            TravelAgentService._tools_definition = self._build_tools_definition()
+        return TravelAgentService._tools_definition
+
+    @staticmethod
+    def _build_tools_definition():
         return [
             {
                 "type": "function",
                 "function": {
                     "name": "search_destinations_and_hotels",
-                    "description": "البحث عن وجهات سياحية وفنادق مناسبة حسب متطلبات المستخدم",
+                    "description": "البحث عن وجهات سياحية وفنادق مناسبة حسب متطلبات المستخدم. يعيد صفحة مختصرة من أرخص الخيارات؛ استخدم offset عندما يكون has_more = true لجلب الصفحة التالية",
                     "parameters": {
                         "type": "object",
                         "properties": {
@@ -436,6 +566,21 @@ class TravelAgentService:
                             "is_sea_view": {
                                 "type": "boolean",
                                 "description": "هل تريد فندقاً مطلاً على البحر؟"
+                            },
+                            "limit": {
+                                "type": "integer",
+                                "description": "عدد النتائج المطلوبة في الصفحة",
+                                "default": getattr(settings, "AI_SEARCH_DEFAULT_LIMIT", 8)
+                            },
+                            "offset": {
+                                "type": "integer",
+                                "description": "عدد النتائج التي يتم تخطيها (للصفحة التالية)",
+                                "default": 0
+                            },
+                            "fields": {
+                                "type": "array",
+                                "description": "الحقول المطلوبة لكل نتيجة (description غير مُضمن افتراضياً)",
+                                "items": {"type": "string", "enum": list(SEARCH_RESULT_FIELDS)}
                             }
                         },
                         "required": []
@@ -527,6 +672,23 @@ class TravelAgentService:
                         "required": ["destination_id"]
                     }
                 }
+            },
+            {
+                "type": "function",
+                "function": {
+                    "name": "get_tool_result",
+                    "description": "استرجاع النتيجة الكاملة لأداة سابقة تظهر في السجل كملخص بصيغة [tool_result ref=...] (عند الحاجة لتفاصيل غير موجودة في الملخص)",
+                    "parameters": {
+                        "type": "object",
+                        "properties": {
+                            "ref": {
+                                "type": "string",
+                                "description": "قيمة ref من الملخص"
+                            }
+                        },
+                        "required": ["ref"]
+                    }
+                }
             }
         ]
     
@@ -554,44 +716,79 @@ class TravelAgentService:
             session_id=str(uuid.uuid4()),
             state={
                 'requirements': {},
-                'messages': []
+                'message_count': 0
             }
         )
         return session
     
-    def save_session_state(self, session, requirements, messages):
-        """حفظ حالة المحادثة"""
-        session.state = {
+    @staticmethod
+    def _build_session_state(session, requirements, message_count, extra=None):
+        state = {
             'requirements': requirements,
-            'messages': messages
+            'message_count': message_count
         }
-        session.updated_at = timezone.now()
-        session.save()
+        # الملخص التراكمي للأدوار القديمة وآخر بحث استباقي يبقيان محفوظين مع الجلسة
+        for key in TravelAgentService.PERSISTENT_STATE_KEYS:
+            if session.state.get(key):
+                state[key] = session.state[key]
+        if extra:
+            state.update(extra)
+        return state
+
+    def save_session_state(self, session, requirements, messages, extra=None):
+        """
+        حفظ حالة المحادثة (extra: مفاتيح إضافية تُحفظ مع الحالة لهذا الدور فقط)
+        messages: القائمة المحمّلة بـ message_log.load مع رسائل هذا الدور؛ الجديدة فقط تُضاف لـ ConversationMessage
+        """
+        with transaction.atomic():
+            message_count = message_log.append(session, messages)
+            session.state = self._build_session_state(session, requirements, message_count, extra)
+            session.updated_at = timezone.now()
+            session.save()
+
+    async def aget_or_create_session(self, session_id=None):
+        """نسخة async من get_or_create_session (Django async ORM)"""
+        if not self.user:
+            return None
+
+        if session_id:
+            try:
+                return await ConversationSession.objects.aget(
+                    session_id=session_id,
+                    user=self.user,
+                    is_active=True
+                )
+            except ConversationSession.DoesNotExist:
+                pass
+
+        return await ConversationSession.objects.acreate(
+            user=self.user,
+            session_id=str(uuid.uuid4()),
+            state={
+                'requirements': {},
+                'message_count': 0
+            }
+        )
+
+    async def asave_session_state(self, session, requirements, messages, extra=None):
+        """نسخة async من save_session_state"""
+        await run_in_worker_thread(self.save_session_state, session, requirements, messages, extra)
     
     # ==================== LLM Integration ====================
     
-    def call_llm(self, messages, tools=None, max_retries=3):
-        """
-        استدعاء LLM عبر OpenRouter API
-        
-        Args:
-            messages: قائمة الرسائل
-            tools: الأدوات المتاحة (اختياري)
-            max_retries: عدد المحاولات عند الفشل
-        
-        Returns:
-            رد LLM
-        """
-        headers = {
+    def _request_headers(self):
+        return {
             "Authorization": f"Bearer {self.api_key}",
             "Content-Type": "application/json",
             "HTTP-Referer": "http://localhost:8000",
             "X-Title": "AI Travel Planner"
         }
-        
+
+    def _build_payload(self, messages, tools=None, structured_mode="none", model=None):
+        model = model or self.model
         payload = {
-            "model": self.model,
-            "messages": messages,
+            "model": model,
+            "messages": apply_cache_hints(messages, model),
             "temperature": 0.2,
             "top_p": 0.95,
             "max_tokens": 1500,
@@ -601,174 +798,553 @@ class TravelAgentService:
         if tools:
             payload["tools"] = tools
             payload["tool_choice"] = "auto"
+
+        # structured output حسب قدرة النموذج (json_schema / json_object / none)
+        response_format = response_format_for(structured_mode)
+        if response_format:
+            payload["response_format"] = response_format
+            # OpenRouter: توجيه الطلب فقط لمزودين يدعمون response_format
+            payload["provider"] = {"require_parameters": True}
+
+        # OpenRouter: إرجاع تفاصيل الاستهلاك (ومنها cached_tokens) في حقل usage
+        payload["usage"] = {"include": True}
+        return payload
+
+    @staticmethod
+    def _llm_cache_lookup(payload):
+        """(مفتاح, رد مخزن أو MISSING) من كاش ردود الـ LLM إذا كان مفعلاً"""
+        if not getattr(settings, "AI_LLM_CACHE_ENABLED", False):
+            return None, MISSING
+        return llm_response_cache.lookup(payload)
+
+    def _prepare_llm_request(self, messages, tools, model):
+        """(وضع الـ structured output, الـ payload, مفتاح الكاش, رد مخزن أو MISSING) لاستدعاء جديد"""
+        structured_mode = model_capabilities.mode_for(model)
+        payload = self._build_payload(messages, tools, structured_mode, model)
+        cache_key, cached = self._llm_cache_lookup(payload)
+        return structured_mode, payload, cache_key, cached
+
+    @staticmethod
+    def _provider_unavailable_error(error):
+        """رد خطأ فوري بدل الانتظار عندما ترفض ProviderGateway الإرسال"""
+        return {
+            "error": f"Provider unavailable: {error.reason}",
+            "retry_after": error.retry_after,
+        }
+
+    def _hedge_payload(self, payload, messages, tools, model, hedge_model):
+        if hedge_model == model:
+            return payload
+        return self._build_payload(messages, tools, model_capabilities.mode_for(hedge_model), hedge_model)
+
+    @classmethod
+    def _record_abandoned(cls, model, started, future):
+        """
+        تسجيل نتيجة طلب خسر سباق التحوط عند انتهائه: زمنه يبقى ضمن نافذة النموذج
+        (وإلا تنخفض عتبة التحوط بشكل زائف لأن الطلبات البطيئة لا تُقاس)
+        """
+        if future.cancelled():
+            return
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        if future.exception() is not None:
+            cls._record_attempt(model, elapsed_ms, error=future.exception())
+        else:
+            cls._record_attempt(model, elapsed_ms, future.result())
+
+    def _post_llm(self, headers, payload):
+        # عميل مشترك مع keep-alive (بدون handshake جديد في كل جولة)
+        return get_llm_http_client().post(self.api_url, headers=headers, json=payload)
+
+    def _send_hedge(self, headers, payload, messages, tools, model, hedge_model, primary, hedge):
+        """
+        الطلب الاحتياطي (على pool التحوط بعد عتبة التأخير): يُرسل فقط إذا لم ينتهِ الطلب الأصلي وضمن ميزانية التحوط
+        يعيد (الرد, زمنه) أو None إذا لم يُرسل؛ الرد الناجح يقطع الطلب الأصلي فيستيقظ thread المستدعي فوراً
+        """
+        if primary.finished or not hedge_policy.try_start():
+            return None
+        hedge_payload = self._hedge_payload(payload, messages, tools, model, hedge_model)
+        with abortable_request(hedge):
+            response = self._post_llm(headers, hedge_payload)
+        elapsed_ms = (time.perf_counter() - hedge.started_at) * 1000
+        if response.status_code == 200:
+            primary.abort()
+        return response, elapsed_ms
+
+    @staticmethod
+    def _record_attempt(model, elapsed_ms, response=None, error=None):
+        """تسجيل نتيجة طلب لم يُستخدم رده (خسر سباق التحوط أو فشل)"""
+        if error is not None:
+            model_router.observe(model, elapsed_ms, error=True)
+            provider_gateway.record_failure()
+            return
+        model_router.observe(model, elapsed_ms, error=response.status_code != 200)
+        provider_gateway.record_response(response.status_code, response.headers.get("Retry-After"))
+        response.close()
+
+    @classmethod
+    def _record_hedge_loser(cls, hedge_model, hedge, future):
+        """الطلب الأصلي فاز: تسجيل الطلب الاحتياطي عند انتهائه (إذا أُرسل فعلاً)"""
+        if future.cancelled():
+            return
+        error = future.exception()
+        if error is None and future.result() is None:
+            return
+        hedge_policy.record("primary")
+        if error is None:
+            response, elapsed_ms = future.result()
+            cls._record_attempt(hedge_model, elapsed_ms, response)
+        elif hedge.aborted and hedge.started_at is not None:
+            # قُطع لأن الأصلي أجاب: زمنه حتى القطع حد أدنى لزمنه الحقيقي
+            model_router.observe(hedge_model, (time.perf_counter() - hedge.started_at) * 1000)
+        elif not hedge.aborted:
+            cls._record_attempt(hedge_model, 0, error=error)
+
+    def _post_llm_hedged(self, headers, payload, model, messages, tools):
+        """
+        إرسال الطلب مع تحوط اختياري (انظر HedgePolicy)
+        الطلب الأصلي يعمل على thread المستدعي (لا يمر عبر أي pool)، والطلب الاحتياطي فقط يُجدول على pool التحوط
+        يعيد (الرد, النموذج الذي أجاب, زمن الرد بالملي ثانية)؛ إذا فشل الطلبان فالنتيجة (أو الاستثناء) للطلب الأصلي
+        """
+        started = time.perf_counter()
+        delay = hedge_policy.delay_for(model)
+        if delay is None:
+            response = self._post_llm(headers, payload)
+            return response, model, (time.perf_counter() - started) * 1000
+
+        hedge_model = hedge_policy.hedge_model(model)
+        primary, hedge = AbortableRequest(), AbortableRequest()
+        hedge_future = get_llm_hedge_pool().schedule(
+            delay, partial(self._send_hedge, headers, payload, messages, tools, model, hedge_model, primary, hedge)
+        )
+        response = error = None
+        try:
+            with abortable_request(primary):
+                response = self._post_llm(headers, payload)
+        except Exception as e:
+            error = e
+        primary_ms = (time.perf_counter() - started) * 1000
+
+        if primary.aborted:
+            # الاحتياطي أجاب أولاً وقطع الطلب الأصلي: زمن الأصلي حتى القطع حد أدنى لزمنه الحقيقي
+            hedge_policy.record("hedge")
+            model_router.observe(model, primary_ms)
+            hedge_response, hedge_ms = hedge_future.result()
+            return hedge_response, hedge_model, hedge_ms
+
+        if error is None and response.status_code == 200:
+            if not hedge_future.cancel():
+                hedge.abort()
+                hedge_future.add_done_callback(partial(self._record_hedge_loser, hedge_model, hedge))
+            return response, model, primary_ms
+
+        # الأصلي فشل: إذا كان الاحتياطي قد أُرسل ننتظر نتيجته
+        hedge_result = hedge_error = None
+        if not hedge_future.cancel():
+            try:
+                hedge_result = hedge_future.result()
+            except Exception as e:
+                hedge_error = e
+        if hedge_result is not None and hedge_result[0].status_code == 200:
+            hedge_policy.record("hedge")
+            self._record_attempt(model, primary_ms, response, error)
+            return hedge_result[0], hedge_model, hedge_result[1]
+        if hedge_result is not None or hedge_error is not None:
+            hedge_policy.record("none")
+            hedge_ms = (time.perf_counter() - hedge.started_at) * 1000 if hedge.started_at else 0
+            self._record_attempt(hedge_model, hedge_ms, hedge_result[0] if hedge_result else None, hedge_error)
+        if error is not None:
+            raise error
+        return response, model, primary_ms
+
+    async def _apost_llm_hedged(self, client, headers, payload, model, messages, tools):
+        """نسخة async من _post_llm_hedged: الطلب الخاسر يُلغى فعلياً (إغلاق الاتصال)"""
+        started = time.perf_counter()
+        delay = hedge_policy.delay_for(model)
+        if delay is None:
+            response = await client.post(self.api_url, headers=headers, json=payload)
+            return response, model, (time.perf_counter() - started) * 1000
+
+        primary = asyncio.ensure_future(client.post(self.api_url, headers=headers, json=payload))
+        attempts = {primary: (model, started)}
+        try:
+            done, _ = await asyncio.wait({primary}, timeout=delay)
+            if done or not await run_in_worker_thread(hedge_policy.try_start):
+                response = await primary
+                return response, model, (time.perf_counter() - started) * 1000
+
+            hedge_model = hedge_policy.hedge_model(model)
+            hedge_payload = await run_in_worker_thread(self._hedge_payload, payload, messages, tools, model, hedge_model)
+            hedge = asyncio.ensure_future(client.post(self.api_url, headers=headers, json=hedge_payload))
+            attempts[hedge] = (hedge_model, time.perf_counter())
+
+            winner = None
+            pending = set(attempts)
+            while pending and winner is None:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None and task.result().status_code == 200:
+                        winner = task
+                        break
+
+            if winner is None:
+                hedge_policy.record("none")
+                winner = primary
+            else:
+                hedge_policy.record("primary" if winner is primary else "hedge")
+            for task, (attempt_model, attempt_started) in attempts.items():
+                if task is winner:
+                    continue
+                if task.done():
+                    await run_in_worker_thread(self._record_abandoned, attempt_model, attempt_started, task)
+                else:
+                    task.cancel()
+                    # زمنه حتى الإلغاء حد أدنى لزمنه الحقيقي
+                    model_router.observe(attempt_model, (time.perf_counter() - attempt_started) * 1000)
+
+            winner_model, winner_started = attempts[winner]
+            return winner.result(), winner_model, (time.perf_counter() - winner_started) * 1000
+        finally:
+            for task in attempts:
+                if not task.done():
+                    task.cancel()
+
+    def call_llm(self, messages, tools=None, max_retries=3, model=None):
+        """
+        استدعاء LLM عبر OpenRouter API
+        
+        Args:
+            messages: قائمة الرسائل
+            tools: الأدوات المتاحة (اختياري)
+            max_retries: عدد المحاولات عند الفشل
+            model: النموذج المطلوب (افتراضياً AI_MODEL، انظر ModelRouter)
         
+        Returns:
+            رد LLM
+        """
+        model = model or self.model
+        self.last_model = model
+        structured_mode, payload, cache_key, cached = self._prepare_llm_request(messages, tools, model)
+        if cached is not MISSING:
+            return cached
+
+        def request():
+            return self._request_llm(messages, tools, max_retries, model, structured_mode, payload, cache_key)
+
+        if not getattr(settings, "AI_SINGLE_FLIGHT_ENABLED", True):
+            return request()
+        # طلبات متطابقة جارية في نفس الوقت (نفس البادئة من عدة مستخدمين) تنتظر استدعاءً واحداً للمزود
+        result, _ = llm_flight.do(cache_key or llm_response_cache.make_key(payload), request)
+        return result
+
+    def _accept_llm_response(self, response, served_model, model, elapsed_ms, cache_key):
+        """رد 200 من المزود (من الطلب الأصلي أو الاحتياطي)"""
+        self.last_model = served_model
+        model_router.observe(served_model, elapsed_ms)
+        data = response.json()
+        llm_usage.record(served_model, data.get("usage"))
+        if served_model == model:
+            # مفتاح الكاش يتضمن النموذج المطلوب: لا نخزن تحته رد نموذج آخر
+            llm_response_cache.store(cache_key, data)
+        return data
+
+    def _request_llm(self, messages, tools, max_retries, model, structured_mode, payload, cache_key):
+        """إرسال الطلب لـ OpenRouter مع إعادة المحاولة وتخزين الرد الناجح في كاش الردود"""
+        headers = self._request_headers()
+
         for attempt in range(max_retries):
+            # حد المعدل المشترك و Retry-After و circuit breaker (انظر ProviderGateway)
             try:
-                response = requests.post(
-                    self.api_url,
-                    headers=headers,
-                    json=payload,
-                    timeout=30
-                )
+                delay = provider_gateway.reserve()
+            except ProviderUnavailable as e:
+                return self._provider_unavailable_error(e)
+            if delay:
+                time.sleep(delay)
+
+            started = time.perf_counter()
+            try:
+                response, served_model, elapsed_ms = self._post_llm_hedged(headers, payload, model, messages, tools)
+                provider_gateway.record_response(response.status_code, response.headers.get("Retry-After"), attempt)
                 
                 if response.status_code == 200:
-                    return response.json()
+                    return self._accept_llm_response(response, served_model, model, elapsed_ms, cache_key)
                 elif response.status_code == 429:  # Rate limit
+                    model_router.observe(model, elapsed_ms, error=True)
                     if attempt < max_retries - 1:
-                        import time
-                        time.sleep(2 ** attempt)  # Exponential backoff
+                        # الانتظار حتى Retry-After يتم في reserve() التالي (أو رفض فوري إذا طال)
                         continue
+                elif structured_mode != "none" and is_structured_output_rejection(response.status_code, response.text):
+                    # النموذج/المزود لا يدعم response_format: نسجل ذلك ونعيد بالوضع الأضعف
+                    structured_mode = model_capabilities.downgrade(model, structured_mode)
+                    payload = self._build_payload(messages, tools, structured_mode, model)
+                    continue
                 else:
+                    model_router.observe(model, elapsed_ms, error=True)
                     return {
                         "error": f"API Error: {response.status_code}",
                         "details": response.text
                     }
                     
             except requests.Timeout:
+                model_router.observe(model, (time.perf_counter() - started) * 1000, error=True)
+                provider_gateway.record_failure()
                 if attempt < max_retries - 1:
+                    time.sleep(provider_gateway.backoff(attempt))
                     continue
                 return {"error": "Request timeout"}
             except Exception as e:
+                model_router.observe(model, (time.perf_counter() - started) * 1000, error=True)
+                provider_gateway.record_failure()
                 return {"error": str(e)}
         
         return {"error": "Max retries exceeded"}
 
-    @staticmethod
-    def _extract_json_from_llm_text(text: str):
-        """
-        يحاول استخراج JSON صالح من ردود LLM غير المنضبطة.
-        يدعم الحالات التالية:
-        - JSON داخل markdown fences
-        - نص مقتبس يحتوي JSON/fragment
-        - fragment يبدأ بـ \"status\": ... بدون أقواس خارجية
-        - وجود JSON ضمن نص أكبر: نأخذ من أول { إلى آخر }
-        """
-        if not text:
-            return None
+    async def acall_llm(self, messages, tools=None, max_retries=3, model=None):
+        """نسخة async من call_llm عبر httpx.AsyncClient مشترك (لا تحجز thread أثناء انتظار المزود)"""
+        model = model or self.model
+        self.last_model = model
+        structured_mode, payload, cache_key, cached = await run_in_worker_thread(
+            self._prepare_llm_request, messages, tools, model
+        )
+        if cached is not MISSING:
+            return cached
+
+        def request():
+            return self._arequest_llm(messages, tools, max_retries, model, structured_mode, payload, cache_key)
 
-        clean = text.strip()
-
-        # إزالة markdown fences إن وجدت
-        if "```json" in clean:
-            clean = clean.split("```json", 1)[1].split("```", 1)[0].strip()
-        elif "```" in clean:
-            clean = clean.split("```", 1)[1].split("```", 1)[0].strip()
-
-        def _sanitize_json_like(s: str) -> str:
-            if not s:
-                return s
-            # إزالة trailing commas قبل } أو ]
-            s = re.sub(r",\s*(\}|\])", r"\1", s)
-            # إزالة محارف لا تظهر لكنها تسبب فشل parsing أحياناً
-            s = s.replace("\ufeff", "").replace("\u200b", "")
-            return s
-
-        def _try_json_repair(s: str):
-            """محاولة إصلاح JSON محلياً إن كانت مكتبة json_repair متاحة."""
+        if not getattr(settings, "AI_SINGLE_FLIGHT_ENABLED", True):
+            return await request()
+        result, _ = await async_llm_flight.do(cache_key or llm_response_cache.make_key(payload), request)
+        return result
+
+    async def _arequest_llm(self, messages, tools, max_retries, model, structured_mode, payload, cache_key):
+        """نسخة async من _request_llm"""
+        headers = self._request_headers()
+        client = get_async_llm_http_client()
+
+        for attempt in range(max_retries):
             try:
-                from json_repair import repair_json  # type: ignore
-            except Exception:
-                return None
+                # ProviderGateway و model_capabilities و كاش الردود تعمل عبر Django cache (I/O متزامن):
+                # تُستدعى من worker thread حتى لا تحجز الـ event loop مع cache مشترك (Redis/Memcached)
+                delay = await run_in_worker_thread(provider_gateway.reserve)
+            except ProviderUnavailable as e:
+                return self._provider_unavailable_error(e)
+            if delay:
+                await asyncio.sleep(delay)
+
+            started = time.perf_counter()
             try:
-                repaired = repair_json(s)
-                if isinstance(repaired, str):
-                    return json.loads(_sanitize_json_like(repaired))
-                if isinstance(repaired, dict):
-                    return repaired
-            except Exception:
-                return None
-            return None
+                response, served_model, elapsed_ms = await self._apost_llm_hedged(
+                    client, headers, payload, model, messages, tools
+                )
+                await run_in_worker_thread(
+                    provider_gateway.record_response, response.status_code, response.headers.get("Retry-After"), attempt
+                )
 
-        def _try_python_dict_like(s: str):
-            """يتعامل مع مخرجات تشبه Python dict (single quotes, True/False/None) ثم يحولها لـ dict."""
-            try:
-                parsed = ast.literal_eval(s)
-                if isinstance(parsed, dict):
-                    return parsed
-            except Exception:
-                return None
-            return None
+                if response.status_code == 200:
+                    return await run_in_worker_thread(
+                        self._accept_llm_response, response, served_model, model, elapsed_ms, cache_key
+                    )
+                elif response.status_code == 429:  # Rate limit
+                    model_router.observe(model, elapsed_ms, error=True)
+                    if attempt < max_retries - 1:
+                        continue
+                elif structured_mode != "none" and is_structured_output_rejection(response.status_code, response.text):
+                    structured_mode = await run_in_worker_thread(model_capabilities.downgrade, model, structured_mode)
+                    payload = self._build_payload(messages, tools, structured_mode, model)
+                    continue
+                else:
+                    model_router.observe(model, elapsed_ms, error=True)
+                    return {
+                        "error": f"API Error: {response.status_code}",
+                        "details": response.text
+                    }
 
-        # 1) محاولة مباشرة
-        try:
-            return json.loads(_sanitize_json_like(clean))
-        except Exception:
-            pass
+            except httpx.TimeoutException:
+                model_router.observe(model, (time.perf_counter() - started) * 1000, error=True)
+                await run_in_worker_thread(provider_gateway.record_failure)
+                if attempt < max_retries - 1:
+                    await asyncio.sleep(provider_gateway.backoff(attempt))
+                    continue
+                return {"error": "Request timeout"}
+            except Exception as e:
+                model_router.observe(model, (time.perf_counter() - started) * 1000, error=True)
+                await run_in_worker_thread(provider_gateway.record_failure)
+                return {"error": str(e)}
 
-        repaired = _try_json_repair(clean)
-        if repaired is not None:
-            return repaired
+        return {"error": "Max retries exceeded"}
 
-        py_like = _try_python_dict_like(clean)
-        if py_like is not None:
-            return py_like
+    def call_llm_stream(self, messages, tools=None, max_retries=3, model=None):
+        """
+        استدعاء LLM بوضع stream: true (Server-Sent Events من المزود)
 
-        # 2) إذا كان النص عبارة عن JSON مُقتبس كـ string
-        if clean.startswith('"') and clean.endswith('"'):
+        Yields:
+            ("delta", نص جزئي) أثناء التوليد، ثم في النهاية إما
+            ("message", رسالة assistant مجمعة بنفس شكل choices[0].message) أو ("error", وصف الخطأ)
+        """
+        model = model or self.model
+        self.last_model = model
+        headers = self._request_headers()
+        structured_mode = model_capabilities.mode_for(model)
+        payload = self._build_payload(messages, tools, structured_mode, model)
+        cache_key, cached = self._llm_cache_lookup(payload)
+        if cached is not MISSING:
+            # رد مخزن: يُرسل دفعة واحدة بنفس تسلسل الأحداث
+            message = cached["choices"][0]["message"]
+            if message.get("content"):
+                yield "delta", message["content"]
+            yield "message", message
+            return
+        payload["stream"] = True
+
+        response = None
+        for attempt in range(max_retries):
             try:
-                inner = json.loads(clean)  # يفك الاقتباس والهروب
-                if isinstance(inner, str):
-                    clean = inner.strip()
-            except Exception:
-                pass
-
-        # 3) لو هو fragment بدون أقواس خارجية لكنه يحتوي status
-        if not clean.startswith("{") and '"status"' in clean:
-            candidate = "{" + clean.strip().strip(",") + "}"
+                delay = provider_gateway.reserve()
+            except ProviderUnavailable as e:
+                yield "error", self._provider_unavailable_error(e)["error"]
+                return
+            if delay:
+                time.sleep(delay)
+
+            started = time.perf_counter()
             try:
-                return json.loads(_sanitize_json_like(candidate))
-            except Exception:
-                pass
+                response = get_llm_http_client().post(
+                    self.api_url,
+                    headers=headers,
+                    json=payload,
+                    stream=True,
+                )
+            except requests.Timeout:
+                model_router.observe(model, (time.perf_counter() - started) * 1000, error=True)
+                provider_gateway.record_failure()
+                if attempt < max_retries - 1:
+                    time.sleep(provider_gateway.backoff(attempt))
+                    continue
+                yield "error", "Request timeout"
+                return
+            except Exception as e:
+                model_router.observe(model, (time.perf_counter() - started) * 1000, error=True)
+                provider_gateway.record_failure()
+                yield "error", str(e)
+                return
+            provider_gateway.record_response(response.status_code, response.headers.get("Retry-After"), attempt)
+
+            # إعادة المحاولة ممكنة فقط قبل أول byte من الرد
+            if response.status_code == 429 and attempt < max_retries - 1:
+                model_router.observe(model, (time.perf_counter() - started) * 1000, error=True)
+                response.close()
+                continue
+            # response.text يقرأ الرد كله: لا نلمسه مع 200 حتى يبقى البث تدريجياً
+            if (
+                structured_mode != "none" and attempt < max_retries - 1
+                and response.status_code in REJECTION_STATUSES
+                and is_structured_output_rejection(response.status_code, response.text)
+            ):
+                response.close()
+                structured_mode = model_capabilities.downgrade(model, structured_mode)
+                payload = self._build_payload(messages, tools, structured_mode, model)
+                payload["stream"] = True
+                continue
+            break
+
+        if response.status_code != 200:
+            model_router.observe(model, (time.perf_counter() - started) * 1000, error=True)
+            yield "error", f"API Error: {response.status_code}"
+            response.close()
+            return
+
+        content_parts = []
+        tool_calls = {}
+        response.encoding = "utf-8"
+        try:
+            for line in response.iter_lines(decode_unicode=True):
+                # أسطر SSE فارغة أو تعليقات (مثل : OPENROUTER PROCESSING)
+                if not line or not line.startswith("data:"):
+                    continue
+                data = line[len("data:"):].strip()
+                if data == "[DONE]":
+                    break
+                try:
+                    chunk = json.loads(data)
+                except ValueError:
+                    continue
+                if chunk.get("usage"):
+                    llm_usage.record(model, chunk["usage"])
+                if chunk.get("error"):
+                    model_router.observe(model, (time.perf_counter() - started) * 1000, error=True)
+                    yield "error", str(chunk["error"].get("message") if isinstance(chunk["error"], dict) else chunk["error"])
+                    return
+
+                delta = (chunk.get("choices") or [{}])[0].get("delta") or {}
+                text = delta.get("content")
+                if text:
+                    content_parts.append(text)
+                    yield "delta", text
+
+                # tool_calls تصل مجزأة حسب index (الاسم أولاً ثم arguments على دفعات)
+                for tc in delta.get("tool_calls") or []:
+                    slot = tool_calls.setdefault(tc.get("index", 0), {
+                        "id": "", "type": "function", "function": {"name": "", "arguments": ""},
+                    })
+                    if tc.get("id"):
+                        slot["id"] = tc["id"]
+                    fn = tc.get("function") or {}
+                    if fn.get("name"):
+                        slot["function"]["name"] += fn["name"]
+                    if fn.get("arguments"):
+                        slot["function"]["arguments"] += fn["arguments"]
+        except requests.RequestException as e:
+            model_router.observe(model, (time.perf_counter() - started) * 1000, error=True)
+            yield "error", str(e)
+            return
+        finally:
+            response.close()
+
+        # زمن الرد كاملاً (وليس حتى أول byte) ليكون قابلاً للمقارنة مع الاستدعاءات العادية
+        model_router.observe(model, (time.perf_counter() - started) * 1000)
+        message = {"role": "assistant", "content": "".join(content_parts)}
+        if tool_calls:
+            message["tool_calls"] = [tool_calls[i] for i in sorted(tool_calls)]
+        llm_response_cache.store(cache_key, {"choices": [{"message": message}]})
+        yield "message", message
 
-        # 4) استخراج أول JSON object من النص (بشكل أكثر تحمّلاً)
-        if "{" in clean and "}" in clean:
-            start = clean.find("{")
-            if start != -1:
-                depth = 0
-                end = None
-                for i in range(start, len(clean)):
-                    ch = clean[i]
-                    if ch == "{":
-                        depth += 1
-                    elif ch == "}":
-                        depth -= 1
-                        if depth == 0:
-                            end = i
-                            break
-                if end is None:
-                    end = clean.rfind("}")
-                if end is not None and end > start:
-                    candidate = clean[start:end + 1]
-                    try:
-                        return json.loads(_sanitize_json_like(candidate))
-                    except Exception:
-                        repaired = _try_json_repair(candidate)
-                        if repaired is not None:
-                            return repaired
-                        py_like = _try_python_dict_like(candidate)
-                        if py_like is not None:
-                            return py_like
-
-        return None
+    @staticmethod
+    def _extract_json_from_llm_text(text: str):
+        """
+        يحاول استخراج JSON صالح من ردود LLM غير المنضبطة (مرور خطي واحد، انظر json_recovery).
+        يدعم الحالات التالية:
+        - JSON داخل markdown fences أو ضمن نص أكبر (نأخذ الكائن الأخير الذي يحمل status)
+        - trailing commas، تعليقات، dict بأسلوب Python (single quotes, True/False/None)
+        - نص مقتبس يحتوي JSON/fragment
+        - fragment يبدأ بـ \"status\": ... بدون أقواس خارجية
+        - رد مقطوع في النهاية (تُغلق الأقواس المفتوحة)
+        """
+        return recover_json_object(text)
     
     def execute_tool_call(self, tool_name, arguments):
-        """تنفيذ استدعاء أداة"""
+        """تنفيذ استدعاء أداة (مع كاش النتائج للأدوات القابلة للتخزين)"""
         if tool_name == "search_destinations_and_hotels":
-            return self.search_destinations_and_hotels(**arguments)
+            func = self.search_destinations_and_hotels
         elif tool_name == "calculate_trip_cost_tool":
-            return self.calculate_trip_cost_tool(**arguments)
+            func = self.calculate_trip_cost_tool
         elif tool_name == "get_destination_details":
-            return self.get_destination_details(**arguments)
+            func = self.get_destination_details
         elif tool_name == "get_hotel_details":
-            return self.get_hotel_details(**arguments)
+            func = self.get_hotel_details
         elif tool_name == "search_events":
-            return self.search_events(**arguments)
+            func = self.search_events
+        elif tool_name == "get_tool_result":
+            func = self.get_tool_result
         else:
             return {"error": f"Unknown tool: {tool_name}"}
 
-    def _repair_json_via_llm(self, bad_text: str):
-        """طلب إصلاح/استخراج JSON صالح عندما يفشل parsing."""
-        repair_messages = [
+        if not getattr(settings, "AI_TOOL_CACHE_ENABLED", True):
+            return func(**arguments)
+        return tool_result_cache.get_or_compute(tool_name, func, arguments)
+
+    @staticmethod
+    def _repair_messages(bad_text: str):
+        return [
             {
                 "role": "system",
                 "content": "أعد صياغة المحتوى التالي كـ JSON صالح فقط بدون أي نص إضافي. إذا كانت هناك حقول ناقصة، ضعها بقيم null. يجب أن يحتوي JSON على status و message و collected_requirements.",
@@ -776,7 +1352,7 @@ class TravelAgentService:
             {"role": "user", "content": bad_text or ""},
         ]
 
-        llm_response = self.call_llm(repair_messages, tools=None)
+    def _repaired_json_from_response(self, llm_response):
         if "error" in llm_response:
             return None
 
@@ -784,7 +1360,426 @@ class TravelAgentService:
         message = choice.get("message", {})
         repaired_text = message.get("content", "")
         return self._extract_json_from_llm_text(repaired_text)
+
+    def _repair_json_via_llm(self, bad_text: str):
+        """طلب إصلاح/استخراج JSON صالح عندما يفشل parsing."""
+        llm_response = self.call_llm(
+            self._repair_messages(bad_text), tools=None, model=model_router.choose("repair")
+        )
+        return self._repaired_json_from_response(llm_response)
+
+    async def _arepair_json_via_llm(self, bad_text: str):
+        llm_response = await self.acall_llm(
+            self._repair_messages(bad_text), tools=None, model=model_router.choose("repair")
+        )
+        return self._repaired_json_from_response(llm_response)
     
+    # ==================== Conversation Turn Helpers ====================
+
+    def _build_llm_messages(self, session, requirements, messages):
+        """
+        بناء رسائل LLM بترتيب ثابت لصالح prompt caching لدى المزود (الثابت أولاً والمتغير آخراً):
+        الـ system prompt → ملخص الأدوار القديمة → نافذة الأدوار الأخيرة (انظر ConversationHistory)
+        → المتطلبات المعروفة (تتغير كل دور لذلك تأتي في النهاية)
+        """
+        llm_messages = [{"role": "system", "content": self.system_prompt}]
+        summary, window = self.history.window(session.state, messages, message_log.offset(session))
+        if summary:
+            llm_messages.append({
+                "role": "system",
+                "content": f"ملخص الأدوار السابقة من المحادثة (للسياق فقط):\n{summary}",
+            })
+        llm_messages.extend(window)
+
+        requirements_context = json.dumps(requirements, ensure_ascii=False, sort_keys=True)
+        llm_messages.append({"role": "system", "content": f"collected_requirements (known so far) = {requirements_context}"})
+        return llm_messages
+
+    @staticmethod
+    def _extract_tool_calls_from_message(msg: dict):
+        """يستخرج tool_calls بصيغتين: الرسمي + نص <tool_call>..."""
+        extracted = msg.get("tool_calls", []) or []
+
+        assistant_content_local = msg.get("content", "") or ""
+        if (not extracted
+                and "<tool_call>" in assistant_content_local
+                and "</tool_call>" in assistant_content_local):
+            try:
+                raw_tool_section_local = assistant_content_local.split("<tool_call>")[1].split("</tool_call>")[0].strip()
+                logger.info("Inline tool_call detected")
+
+                def _coerce_arg_value(v: str):
+                    vv = (v or "").strip()
+                    low = vv.lower()
+                    if low == "true":
+                        return True
+                    if low == "false":
+                        return False
+                    try:
+                        if re.fullmatch(r"[-+]?\d+", vv):
+                            return int(vv)
+                        if re.fullmatch(r"[-+]?\d*\.\d+", vv):
+                            return float(vv)
+                    except Exception:
+                        pass
+                    return vv
+
+                parsed_name_local = None
+                parsed_args_local = None
+
+                # 1) JSON داخل <tool_call>
+                if raw_tool_section_local.startswith("{"):
+                    parsed = json.loads(raw_tool_section_local)
+                    parsed_name_local = parsed.get("name")
+                    parsed_args_local = parsed.get("arguments", {})
+                    logger.info("Inline tool_call parsed as JSON: %s", parsed_name_local)
+
+                # 2) صيغة XML-like
+                if not parsed_name_local:
+                    lines_local = [ln.strip() for ln in raw_tool_section_local.splitlines() if ln.strip()]
+                    if lines_local:
+                        parsed_name_local = lines_local[0]
+                        parsed_args_local = {}
+                        logger.info("Inline tool_call parsed as XML-like: %s", parsed_name_local)
+
+                        pairs_local = re.findall(
+                            r"<arg_key>\s*(.*?)\s*</\s*arg_key\s*>\s*<arg_value>\s*(.*?)\s*</\s*arg_value\s*>",
+                            raw_tool_section_local,
+                            flags=re.IGNORECASE | re.DOTALL,
+                        )
+                        for k, v in pairs_local:
+                            parsed_args_local[k.strip()] = _coerce_arg_value(v)
+
+                        logger.info("Inline tool_call args keys: %s", list(parsed_args_local.keys()))
+
+                if parsed_name_local and isinstance(parsed_args_local, dict):
+                    extracted = [{
+                        "id": "inline-tool-call",
+                        "type": "function",
+                        "function": {
+                            "name": parsed_name_local,
+                            "arguments": json.dumps(parsed_args_local, ensure_ascii=False),
+                        },
+                    }]
+                    msg["content"] = ""
+                else:
+                    logger.warning(
+                        "Inline tool_call could not be parsed. raw_tool_section=%s",
+                        raw_tool_section_local,
+                    )
+            except Exception:
+                logger.exception("Inline tool_call parsing failed")
+                extracted = []
+
+        return extracted
+
+    @staticmethod
+    def _tool_calls_signature(tool_calls):
+        """توقيع ثابت لمجموعة tool_calls (للحماية من تكرار نفس الأدوات بنفس args)"""
+        def arguments_of(tc):
+            # نفس الـ args بترتيب/مسافات مختلفة = نفس النداء
+            arguments = tc.get("function", {}).get("arguments")
+            try:
+                return json.loads(arguments) if isinstance(arguments, str) else arguments
+            except ValueError:
+                return arguments
+
+        try:
+            return json.dumps(
+                [
+                    {
+                        "name": tc.get("function", {}).get("name"),
+                        "arguments": arguments_of(tc),
+                    }
+                    for tc in tool_calls
+                ],
+                ensure_ascii=False,
+                sort_keys=True,
+            )
+        except Exception:
+            return str([(tc.get("function", {}).get("name"), tc.get("function", {}).get("arguments")) for tc in tool_calls])
+
+    def _run_tool_call(self, tool_call):
+        """تنفيذ tool_call واحد؛ يعيد (رسالة role: tool, الزمن بالملي ثانية)"""
+        started = time.perf_counter()
+        function_name = tool_call["function"]["name"]
+        function_args = json.loads(tool_call["function"]["arguments"] or "{}")
+
+        tool_result = self.execute_tool_call(function_name, function_args)
+
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        tool_latency.observe(function_name, elapsed_ms)
+        return {
+            "role": "tool",
+            "tool_call_id": tool_call.get("id", ""),
+            "name": function_name,
+            "content": json.dumps(tool_result, ensure_ascii=False)
+        }, elapsed_ms
+
+    def _iter_tool_results(self, tool_calls):
+        """
+        تنفيذ أدوات الجولة بالتوازي على thread pool محدود (كل thread باتصال DB خاص يُعاد استخدامه حتى CONN_MAX_AGE)
+        Yields: (index, رسالة role: tool, الزمن) بترتيب انتهاء التنفيذ
+        """
+        if len(tool_calls) < 2 or getattr(settings, "AI_TOOL_MAX_WORKERS", 4) < 2:
+            for index, tool_call in enumerate(tool_calls):
+                tool_message, elapsed_ms = self._run_tool_call(tool_call)
+                yield index, tool_message, elapsed_ms
+            return
+
+        executor = get_tool_executor()
+        futures = {
+            executor.submit(call_with_own_db_connection, self._run_tool_call, tool_call): index
+            for index, tool_call in enumerate(tool_calls)
+        }
+        for future in as_completed(futures):
+            tool_message, elapsed_ms = future.result()
+            yield futures[future], tool_message, elapsed_ms
+
+    def _execute_tool_calls(self, tool_calls):
+        """تنفيذ tool_calls جولة واحدة وإرجاع رسائل role: tool بنفس الترتيب الأصلي"""
+        started = time.perf_counter()
+        tool_messages = [None] * len(tool_calls)
+        timings = {}
+        for index, tool_message, elapsed_ms in self._iter_tool_results(tool_calls):
+            tool_messages[index] = tool_message
+            timings[index] = elapsed_ms
+
+        round_ms = (time.perf_counter() - started) * 1000
+        tool_latency.observe("__round__", round_ms)
+        logger.info(
+            "Tool round finished: %d call(s), wall=%.1fms, sum=%.1fms",
+            len(tool_calls), round_ms, sum(timings.values()),
+        )
+        return tool_messages
+
+    @staticmethod
+    def _append_assistant_message(messages, message):
+        # إضافة رد AI للرسائل
+        assistant_message = message.get("content", "")
+        messages.append({
+            "role": "assistant",
+            "content": assistant_message
+        })
+        return assistant_message
+
+    def _merge_response_data(self, requirements, assistant_message, response_data):
+        """
+        تحديث requirements من الـ JSON المستخرج وتوحيد الحالة
+        يعيد رداً نصياً (text_response) إذا لم يكن هناك JSON صالح
+        """
+        if not isinstance(response_data, dict):
+            # إذا لم يكن JSON، نرجع رد نصي
+            return {
+                "status": "text_response",
+                "message": assistant_message,
+            }
+
+        # تحديث requirements من رد الـ LLM لمنع تكرار الأسئلة
+        incoming = response_data.get("collected_requirements")
+        if isinstance(incoming, dict):
+            requirements.update({k: v for k, v in incoming.items() if v is not None})
+        response_data["collected_requirements"] = requirements
+
+        # توحيد أسماء الحالات (Backward compatibility مع الـ serializer الحالي)
+        if self.legacy_status_mode:
+            status_value = response_data.get("status")
+            if status_value in ("gather_info", "clarify"):
+                response_data["status"] = "missing_info"
+        return response_data
+
+    def _plan_visual_data(self, response_data):
+        """إضافة البيانات المرئية إذا كانت الخطة مكتملة"""
+        if response_data.get("status") != "plan_confirmed":
+            return
+        plan = response_data.get("selected_plan", {})
+        dest_id = plan.get("destination_id")
+        hotel_id = plan.get("hotel_id")
+        
+        if dest_id and hotel_id:
+            dest_details = self.get_destination_details(dest_id)
+            hotel_details = self.get_hotel_details(hotel_id)
+            
+            response_data["visual_data"] = {
+                "destination": dest_details,
+                "hotel": hotel_details
+            }
+
+    async def _aexecute_tool_calls(self, tool_calls):
+        """تنفيذ الأدوات (ORM متزامن) في thread عامل بدون حجز الـ event loop"""
+        return await run_in_worker_thread(self._execute_tool_calls, tool_calls)
+
+    def _requirements_fast_path(self, session, requirements, messages, user_input):
+        """
+        رد gather_info محلي (بدون رحلة للمزود) عندما تكون رسالة المستخدم مفهومة بالكامل بالقواعد المحلية
+        يعيد (response_data, الحقل المسؤول عنه) أو None للمتابعة مع الـ LLM
+        """
+        if not getattr(settings, "AI_REQUIREMENTS_FAST_PATH", True):
+            return None
+
+        question = requirements_fast_path.process(
+            requirements, messages, user_input, session.state.get(self.AWAITING_FIELD_KEY)
+        )
+        if question is None:
+            return None
+
+        field, text = question
+        response_data = {
+            "status": "gather_info",
+            "message": text,
+            "collected_requirements": dict(requirements),
+        }
+        # نفس شكل رد النموذج في السجل (نص + JSON) حتى يبقى السياق متسقاً في الأدوار التالية
+        self._append_assistant_message(messages, {
+            "content": f"{text}\n{json.dumps(response_data, ensure_ascii=False)}",
+        })
+        response_data = self._merge_response_data(requirements, text, response_data)
+        response_data["session_id"] = session.session_id
+        return response_data, field
+
+    def _plan_speculative_search(self, session, requirements, messages):
+        """
+        إذا اكتملت الميزانية/الأيام/الأشخاص بوسائط بحث جديدة: يضيف رسالة assistant بنداء البحث للسجل
+        ويعيد الـ tool_call ليتم تنفيذه قبل أول استدعاء للـ LLM (وإلا None)
+        """
+        if not getattr(settings, "AI_SPECULATIVE_SEARCH", False):
+            return None
+        tool_call = speculation.speculative_search.plan(
+            session.state, requirements, self.search_destinations_and_hotels
+        )
+        if tool_call:
+            messages.append({"role": "assistant", "content": None, "tool_calls": [tool_call]})
+        return tool_call
+
+    @staticmethod
+    def _route_model(requirements, messages):
+        """النموذج المناسب لمرحلة المحادثة الحالية (AI_MODEL لكل المراحل إذا لم تُضبط AI_MODEL_ROUTES)"""
+        return model_router.choose(phase_for(requirements, messages))
+
+    def _record_speculation(self, session, tool_call, message):
+        if tool_call:
+            speculation.speculative_search.record_outcome(
+                session.state, self.search_destinations_and_hotels, tool_call,
+                self._extract_tool_calls_from_message(message),
+            )
+
+    def _speculative_results(self, speculative_call, messages):
+        """{توقيع النداء الاستباقي: رسالة نتيجته} (آخر رسالة في messages بعد تنفيذه مباشرة)"""
+        if not speculative_call:
+            return {}
+        return {self._tool_calls_signature([speculative_call]): messages[-1]}
+
+    @staticmethod
+    def _reuse_speculative_result(speculative_results, signature, tool_calls):
+        """
+        إذا طلب النموذج نفس البحث الاستباقي: نتيجته المنفذة سابقاً بمعرف نداء النموذج (بدون تنفيذ الأداة مرة ثانية)
+        تُستخدم مرة واحدة؛ تكرار الطلب بعدها يوقفه فحص تكرار الأدوات
+        """
+        tool_message = speculative_results.pop(signature, None)
+        if tool_message is None:
+            return None
+        return [dict(tool_message, tool_call_id=tool_calls[0].get("id", ""))]
+
+    def _finalize_response(self, session, requirements, messages, message):
+        """إضافة رد الـ AI النهائي للسجل، تحليل الـ JSON، تحديث المتطلبات وحفظ الجلسة"""
+        assistant_message = self._append_assistant_message(messages, message)
+
+        # محاولة تحليل الرد كـ JSON (الإصلاح عبر LLM فقط كحل أخير)
+        model = self.last_model or self.model
+        response_data, outcome = recover_json_with_mode(assistant_message)
+        if response_data is None:
+            response_data = self._repair_json_via_llm(assistant_message)
+            outcome = "failed" if response_data is None else "repaired"
+        model_capabilities.record_parse(model, outcome)
+        response_data = self._merge_response_data(requirements, assistant_message, response_data)
+
+        # حفظ الحالة بعد تحديث requirements (لمنع تكرار الأسئلة)
+        self.save_session_state(session, requirements, messages)
+
+        response_data["session_id"] = session.session_id
+        self._plan_visual_data(response_data)
+        return response_data
+
+    async def _afinalize_response(self, session, requirements, messages, message):
+        """نسخة async من _finalize_response"""
+        assistant_message = self._append_assistant_message(messages, message)
+
+        model = self.last_model or self.model
+        response_data, outcome = recover_json_with_mode(assistant_message)
+        if response_data is None:
+            response_data = await self._arepair_json_via_llm(assistant_message)
+            outcome = "failed" if response_data is None else "repaired"
+        model_capabilities.record_parse(model, outcome)
+        response_data = self._merge_response_data(requirements, assistant_message, response_data)
+
+        await self.asave_session_state(session, requirements, messages)
+
+        response_data["session_id"] = session.session_id
+        if response_data.get("status") == "plan_confirmed":
+            await run_in_worker_thread(self._plan_visual_data, response_data)
+        return response_data
+
+    def searching_response(self, session, requirements, job):
+        return {
+            "status": "searching" if not self.legacy_status_mode else "missing_info",
+            "message": "جاري البحث عن أفضل الخيارات المناسبة لك...",
+            "collected_requirements": requirements,
+            "session_id": session.session_id,
+            "job_id": str(job.job_id),
+        }
+
+    # ==================== Background Resume (run_agent_worker) ====================
+
+    def resume_pending_tool_calls(self, session):
+        """
+        إكمال دور محفوظ في وضع searching خارج طلب الـ HTTP (ينفذه run_agent_worker):
+        تنفيذ pending_tool_calls ثم جولات الـ LLM المتبقية حتى الرد النهائي
+        عند خطأ من المزود تبقى حالة الجلسة كما هي حتى يمكن إعادة المحاولة
+        """
+        requirements = session.state.get('requirements', {}) or {}
+        messages = message_log.load(session)
+        tool_calls = session.state.get('pending_tool_calls') or []
+        if not tool_calls:
+            return {
+                "status": "error",
+                "message": "لا توجد عملية بحث معلقة في هذه الجلسة",
+                "session_id": session.session_id,
+            }
+
+        tools = self.get_tools_definition()
+        seen_tool_signatures = {self._tool_calls_signature(tool_calls)}
+        message = None
+        for _ in range(self.MAX_TOOL_ROUNDS):
+            messages.extend(self._execute_tool_calls(tool_calls))
+            llm_response = self.call_llm(
+                self._build_llm_messages(session, requirements, messages), tools,
+                model=self._route_model(requirements, messages),
+            )
+            if "error" in llm_response:
+                return {
+                    "status": "error",
+                    "message": f"حدث خطأ في الاتصال بخدمة الذكاء الاصطناعي: {llm_response['error']}",
+                    "session_id": session.session_id,
+                }
+
+            message = llm_response.get("choices", [{}])[0].get("message", {})
+            tool_calls = self._extract_tool_calls_from_message(message)
+            if not tool_calls:
+                break
+            signature = self._tool_calls_signature(tool_calls)
+            if signature in seen_tool_signatures:
+                logger.warning("Tool loop repeating detected; stopping early")
+                break
+            seen_tool_signatures.add(signature)
+            messages.append(message)
+
+        return self._finalize_response(session, requirements, messages, message)
+
+    def discard_pending_tool_calls(self, session):
+        """بعد فشل المهمة نهائياً: حذف نداء الأدوات غير المكتمل من السجل حتى يستطيع المستخدم المتابعة"""
+        messages = message_log.pop_last(session, message_log.load(session), role='assistant')
+        self.save_session_state(session, session.state.get('requirements', {}) or {}, messages)
+
     # ==================== Main Run Method ====================
     
     def run(self, user_input, session_id=None):
@@ -798,6 +1793,7 @@ class TravelAgentService:
         Returns:
             رد منظم مع حالة المحادثة
         """
+        session = None
         try:
             # الحصول على الجلسة أو إنشاء واحدة جديدة
             session = self.get_or_create_session(session_id)
@@ -810,24 +1806,36 @@ class TravelAgentService:
             
             # استرجاع الحالة السابقة
             requirements = session.state.get('requirements', {}) or {}
-            messages = session.state.get('messages', []) or []
+            messages = message_log.load(session)
+
+            # دور سابق ما زال بانتظار العامل: لا نبدأ دوراً جديداً فوق نداء أدوات بلا نتائج
+            if session.state.get('pending_tool_calls'):
+                return self.searching_response(session, requirements, agent_job_queue.enqueue(session))
             
             # إضافة رسالة المستخدم
             messages.append({
                 "role": "user",
                 "content": user_input
             })
+
+            # مسار سريع لجمع المتطلبات بدون استدعاء الـ LLM
+            fast = self._requirements_fast_path(session, requirements, messages, user_input)
+            if fast:
+                response_data, field = fast
+                self.save_session_state(session, requirements, messages, {self.AWAITING_FIELD_KEY: field})
+                return response_data
             
-            # بناء رسائل LLM
-            requirements_context = json.dumps(requirements, ensure_ascii=False)
-            llm_messages = [
-                {"role": "system", "content": self.system_prompt},
-                {"role": "system", "content": f"collected_requirements (known so far) = {requirements_context}"},
-            ] + messages
-            
+            # بحث استباقي: نتائج البحث تصل للنموذج مع أول استدعاء بدل جولة إضافية
+            speculative_call = self._plan_speculative_search(session, requirements, messages)
+            if speculative_call:
+                messages.extend(self._execute_tool_calls([speculative_call]))
+
             # استدعاء LLM مع الأدوات
             tools = self.get_tools_definition()
-            llm_response = self.call_llm(llm_messages, tools)
+            llm_response = self.call_llm(
+                self._build_llm_messages(session, requirements, messages), tools,
+                model=self._route_model(requirements, messages),
+            )
             
             # معالجة الأخطاء
             if "error" in llm_response:
@@ -840,89 +1848,13 @@ class TravelAgentService:
             # استخراج رد AI الأولي
             choice = llm_response.get("choices", [{}])[0]
             message = choice.get("message", {})
-
-            def _extract_tool_calls_from_message(msg: dict):
-                """يستخرج tool_calls بصيغتين: الرسمي + نص <tool_call>..."""
-                extracted = msg.get("tool_calls", []) or []
-
-                assistant_content_local = msg.get("content", "") or ""
-                if (not extracted
-                        and "<tool_call>" in assistant_content_local
-                        and "</tool_call>" in assistant_content_local):
-                    try:
-                        raw_tool_section_local = assistant_content_local.split("<tool_call>")[1].split("</tool_call>")[0].strip()
-                        logger.info("Inline tool_call detected")
-
-                        def _coerce_arg_value(v: str):
-                            vv = (v or "").strip()
-                            low = vv.lower()
-                            if low == "true":
-                                return True
-                            if low == "false":
-                                return False
-                            try:
-                                if re.fullmatch(r"[-+]?\d+", vv):
-                                    return int(vv)
-                                if re.fullmatch(r"[-+]?\d*\.\d+", vv):
-                                    return float(vv)
-                            except Exception:
-                                pass
-                            return vv
-
-                        parsed_name_local = None
-                        parsed_args_local = None
-
-                        # 1) JSON داخل <tool_call>
-                        if raw_tool_section_local.startswith("{"):
-                            parsed = json.loads(raw_tool_section_local)
-                            parsed_name_local = parsed.get("name")
-                            parsed_args_local = parsed.get("arguments", {})
-                            logger.info("Inline tool_call parsed as JSON: %s", parsed_name_local)
-
-                        # 2) صيغة XML-like
-                        if not parsed_name_local:
-                            lines_local = [ln.strip() for ln in raw_tool_section_local.splitlines() if ln.strip()]
-                            if lines_local:
-                                parsed_name_local = lines_local[0]
-                                parsed_args_local = {}
-                                logger.info("Inline tool_call parsed as XML-like: %s", parsed_name_local)
-
-                                pairs_local = re.findall(
-                                    r"<arg_key>\s*(.*?)\s*</\s*arg_key\s*>\s*<arg_value>\s*(.*?)\s*</\s*arg_value\s*>",
-                                    raw_tool_section_local,
-                                    flags=re.IGNORECASE | re.DOTALL,
-                                )
-                                for k, v in pairs_local:
-                                    parsed_args_local[k.strip()] = _coerce_arg_value(v)
-
-                                logger.info("Inline tool_call args keys: %s", list(parsed_args_local.keys()))
-
-                        if parsed_name_local and isinstance(parsed_args_local, dict):
-                            extracted = [{
-                                "id": "inline-tool-call",
-                                "type": "function",
-                                "function": {
-                                    "name": parsed_name_local,
-                                    "arguments": json.dumps(parsed_args_local, ensure_ascii=False),
-                                },
-                            }]
-                            msg["content"] = ""
-                        else:
-                            logger.warning(
-                                "Inline tool_call could not be parsed. raw_tool_section=%s",
-                                raw_tool_section_local,
-                            )
-                    except Exception:
-                        logger.exception("Inline tool_call parsing failed")
-                        extracted = []
-
-                return extracted
+            self._record_speculation(session, speculative_call, message)
 
             # تنفيذ الأدوات على شكل حلقات (حتى لو النموذج كرر <tool_call> بعد النتائج)
-            max_tool_rounds = 4
-            seen_tool_signatures = set()
-            for round_idx in range(max_tool_rounds):
-                tool_calls = _extract_tool_calls_from_message(message)
+            speculative_results = self._speculative_results(speculative_call, messages)
+            seen_tool_signatures = set(speculative_results)
+            for round_idx in range(self.MAX_TOOL_ROUNDS):
+                tool_calls = self._extract_tool_calls_from_message(message)
                 if not tool_calls:
                     break
 
@@ -938,66 +1870,29 @@ class TravelAgentService:
                     },
                 )
 
-                # حماية من التكرار (نفس الأدوات ونفس args)
-                try:
-                    signature = json.dumps(
-                        [
-                            {
-                                "name": tc.get("function", {}).get("name"),
-                                "arguments": tc.get("function", {}).get("arguments"),
-                            }
-                            for tc in tool_calls
-                        ],
-                        ensure_ascii=False,
-                        sort_keys=True,
-                    )
-                except Exception:
-                    signature = str([(tc.get("function", {}).get("name"), tc.get("function", {}).get("arguments")) for tc in tool_calls])
-
-                if signature in seen_tool_signatures:
+                # حماية من التكرار (نفس الأدوات ونفس args)؛ إعادة طلب البحث الاستباقي تأخذ نتيجته المنفذة
+                signature = self._tool_calls_signature(tool_calls)
+                reused = self._reuse_speculative_result(speculative_results, signature, tool_calls)
+                if reused is None and signature in seen_tool_signatures:
                     logger.warning("Tool loop repeating detected; stopping early")
                     break
                 seen_tool_signatures.add(signature)
 
-                # خيار اختياري: رد 'searching' أولاً (يتطلب أن الواجهة تتصل مرة ثانية بنفس session)
-                if self.enable_searching_first_response and round_idx == 0:
-                    session.state = {
-                        'requirements': requirements,
-                        'messages': messages + [message],
-                        'pending_tool_calls': tool_calls,
-                    }
-                    session.updated_at = timezone.now()
-                    session.save()
-                    return {
-                        "status": "searching" if not self.legacy_status_mode else "missing_info",
-                        "message": "جاري البحث عن أفضل الخيارات المناسبة لك...",
-                        "collected_requirements": requirements,
-                        "session_id": session.session_id,
-                    }
+                # خيار اختياري: رد 'searching' أولاً، والأدوات وجولة الـ LLM التالية ينفذها run_agent_worker
+                # (الواجهة تنتظر النتيجة من ai/chat/jobs/<job_id>/)
+                if self.enable_searching_first_response and round_idx == 0 and reused is None:
+                    self.save_session_state(session, requirements, messages + [message], {'pending_tool_calls': tool_calls})
+                    return self.searching_response(session, requirements, agent_job_queue.enqueue(session))
 
                 logger.info("Executing %d tool_call(s)", len(tool_calls))
                 messages.append(message)
-
-                for tool_call in tool_calls:
-                    function_name = tool_call["function"]["name"]
-                    function_args = json.loads(tool_call["function"]["arguments"])
-
-                    tool_result = self.execute_tool_call(function_name, function_args)
-
-                    messages.append({
-                        "role": "tool",
-                        "tool_call_id": tool_call.get("id", ""),
-                        "name": function_name,
-                        "content": json.dumps(tool_result, ensure_ascii=False)
-                    })
-
-                llm_messages = [
-                    {"role": "system", "content": self.system_prompt},
-                    {"role": "system", "content": f"collected_requirements (known so far) = {json.dumps(requirements, ensure_ascii=False)}"},
-                ] + messages
+                messages.extend(reused or self._execute_tool_calls(tool_calls))
 
                 # نعيد الاستدعاء مع tools لتفادي نماذج لا تلتزم وتعيد tool_call كنص
-                llm_response = self.call_llm(llm_messages, tools)
+                llm_response = self.call_llm(
+                    self._build_llm_messages(session, requirements, messages), tools,
+                    model=self._route_model(requirements, messages),
+                )
 
                 if "error" in llm_response:
                     return {
@@ -1018,70 +1913,219 @@ class TravelAgentService:
                 },
             )
 
-            # إضافة رد AI للرسائل
-            assistant_message = message.get("content", "")
-            messages.append({
-                "role": "assistant",
-                "content": assistant_message
-            })
+            return self._finalize_response(session, requirements, messages, message)
+            
+        except Exception as e:
+            return {
+                "status": "error",
+                "message": f"حدث خطأ غير متوقع: {str(e)}",
+                "session_id": session.session_id if session else None
+            }
 
-            # محاولة تحليل الرد كـ JSON
-            try:
-                response_data = self._extract_json_from_llm_text(assistant_message)
-                if response_data is None:
-                    response_data = self._repair_json_via_llm(assistant_message)
-                if response_data is None:
-                    raise json.JSONDecodeError("Invalid JSON from LLM", assistant_message, 0)
-
-                # تحديث requirements من رد الـ LLM لمنع تكرار الأسئلة
-                if isinstance(response_data, dict):
-                    incoming = response_data.get("collected_requirements")
-                    if isinstance(incoming, dict):
-                        requirements.update({k: v for k, v in incoming.items() if v is not None})
-                        response_data["collected_requirements"] = requirements
-                    else:
-                        response_data["collected_requirements"] = requirements
-
-                    # توحيد أسماء الحالات (Backward compatibility مع الـ serializer الحالي)
-                    if self.legacy_status_mode:
-                        status_value = response_data.get("status")
-                        if status_value in ("gather_info", "clarify"):
-                            response_data["status"] = "missing_info"
-
-                # حفظ الحالة بعد تحديث requirements (لمنع تكرار الأسئلة)
-                self.save_session_state(session, requirements, messages)
-
-                response_data["session_id"] = session.session_id
-                
-                # إضافة البيانات المرئية إذا كانت الخطة مكتملة
-                if response_data.get("status") == "plan_confirmed":
-                    plan = response_data.get("selected_plan", {})
-                    dest_id = plan.get("destination_id")
-                    hotel_id = plan.get("hotel_id")
-                    
-                    if dest_id and hotel_id:
-                        dest_details = self.get_destination_details(dest_id)
-                        hotel_details = self.get_hotel_details(hotel_id)
-                        
-                        response_data["visual_data"] = {
-                            "destination": dest_details,
-                            "hotel": hotel_details
-                        }
-                
+    async def arun(self, user_input, session_id=None):
+        """
+        نسخة async من run لمسار ASGI: انتظار المزود والـ ORM لا يحجز worker thread
+        (نفس منطق run: جولات الأدوات، الحماية من التكرار، وضع searching)
+        """
+        session = None
+        try:
+            session = await self.aget_or_create_session(session_id)
+            if not session:
+                return {
+                    "status": "error",
+                    "message": "فشل في إنشاء جلسة المحادثة"
+                }
+
+            requirements = session.state.get('requirements', {}) or {}
+            messages = await message_log.aload(session)
+            if session.state.get('pending_tool_calls'):
+                job = await run_in_worker_thread(agent_job_queue.enqueue, session)
+                return self.searching_response(session, requirements, job)
+            messages.append({"role": "user", "content": user_input})
+
+            fast = self._requirements_fast_path(session, requirements, messages, user_input)
+            if fast:
+                response_data, field = fast
+                await self.asave_session_state(session, requirements, messages, {self.AWAITING_FIELD_KEY: field})
                 return response_data
-                
-            except json.JSONDecodeError:
-                # إذا لم يكن JSON، نرجع رد نصي
-                self.save_session_state(session, requirements, messages)
+
+            speculative_call = self._plan_speculative_search(session, requirements, messages)
+            if speculative_call:
+                messages.extend(await self._aexecute_tool_calls([speculative_call]))
+
+            tools = self.get_tools_definition()
+            llm_response = await self.acall_llm(
+                self._build_llm_messages(session, requirements, messages), tools,
+                model=self._route_model(requirements, messages),
+            )
+            if "error" in llm_response:
                 return {
-                    "status": "text_response",
-                    "message": assistant_message,
+                    "status": "error",
+                    "message": f"حدث خطأ في الاتصال بخدمة الذكاء الاصطناعي: {llm_response['error']}",
                     "session_id": session.session_id
                 }
-            
+
+            message = llm_response.get("choices", [{}])[0].get("message", {})
+            self._record_speculation(session, speculative_call, message)
+
+            speculative_results = self._speculative_results(speculative_call, messages)
+            seen_tool_signatures = set(speculative_results)
+            for round_idx in range(self.MAX_TOOL_ROUNDS):
+                tool_calls = self._extract_tool_calls_from_message(message)
+                if not tool_calls:
+                    break
+
+                signature = self._tool_calls_signature(tool_calls)
+                reused = self._reuse_speculative_result(speculative_results, signature, tool_calls)
+                if reused is None and signature in seen_tool_signatures:
+                    logger.warning("Tool loop repeating detected; stopping early")
+                    break
+                seen_tool_signatures.add(signature)
+
+                if self.enable_searching_first_response and round_idx == 0 and reused is None:
+                    await self.asave_session_state(
+                        session, requirements, messages + [message], {'pending_tool_calls': tool_calls}
+                    )
+                    job = await run_in_worker_thread(agent_job_queue.enqueue, session)
+                    return self.searching_response(session, requirements, job)
+
+                logger.info("Executing %d tool_call(s)", len(tool_calls))
+                messages.append(message)
+                messages.extend(reused or await self._aexecute_tool_calls(tool_calls))
+
+                llm_response = await self.acall_llm(
+                    self._build_llm_messages(session, requirements, messages), tools,
+                    model=self._route_model(requirements, messages),
+                )
+                if "error" in llm_response:
+                    return {
+                        "status": "error",
+                        "message": f"حدث خطأ: {llm_response['error']}",
+                        "session_id": session.session_id
+                    }
+                message = llm_response.get("choices", [{}])[0].get("message", {})
+
+            return await self._afinalize_response(session, requirements, messages, message)
+
         except Exception as e:
+            logger.exception("Async chat turn failed")
             return {
                 "status": "error",
                 "message": f"حدث خطأ غير متوقع: {str(e)}",
                 "session_id": session.session_id if session else None
             }
+
+    def run_stream(self, user_input, session_id=None):
+        """
+        نسخة streaming من run: تولد أحداثاً (event, data) أثناء المحادثة بدل انتظار الرد كاملاً
+
+        الأحداث:
+            session       → {"session_id"} فوراً
+            tool_round    → بداية جولة أدوات {"round", "tools"} (و "speculative" للبحث الاستباقي)
+            tool_done     → انتهاء أداة {"round", "name", "ms"}
+            delta         → نص عربي جزئي قبل كائن الـ JSON
+            message_delta → نص جزئي من حقل "message" داخل الـ JSON أثناء توليده
+            final         → الرد المنظم النهائي (نفس شكل رد run)
+            error         → خطأ
+        """
+        session = None
+        try:
+            session = self.get_or_create_session(session_id)
+            if not session:
+                yield "error", {"status": "error", "message": "فشل في إنشاء جلسة المحادثة"}
+                return
+
+            yield "session", {"session_id": session.session_id}
+
+            requirements = session.state.get('requirements', {}) or {}
+            messages = message_log.load(session)
+            if session.state.get('pending_tool_calls'):
+                yield "final", self.searching_response(session, requirements, agent_job_queue.enqueue(session))
+                return
+            messages.append({"role": "user", "content": user_input})
+
+            fast = self._requirements_fast_path(session, requirements, messages, user_input)
+            if fast:
+                response_data, field = fast
+                self.save_session_state(session, requirements, messages, {self.AWAITING_FIELD_KEY: field})
+                yield "message_delta", {"text": response_data["message"]}
+                yield "final", response_data
+                return
+
+            speculative_call = self._plan_speculative_search(session, requirements, messages)
+            if speculative_call:
+                yield "tool_round", {"round": 0, "tools": [speculation.SEARCH_TOOL], "speculative": True}
+                for _, tool_message, elapsed_ms in self._iter_tool_results([speculative_call]):
+                    messages.append(tool_message)
+                    yield "tool_done", {"round": 0, "name": tool_message["name"], "ms": round(elapsed_ms, 1)}
+
+            tools = self.get_tools_definition()
+            speculative_results = self._speculative_results(speculative_call, messages)
+            seen_tool_signatures = set(speculative_results)
+            message = None
+
+            for round_idx in range(self.MAX_TOOL_ROUNDS + 1):
+                parser = TrailingJSONStreamParser()
+                message = None
+                llm_stream = self.call_llm_stream(
+                    self._build_llm_messages(session, requirements, messages), tools,
+                    model=self._route_model(requirements, messages),
+                )
+                for kind, value in llm_stream:
+                    if kind == "delta":
+                        prose, message_text = parser.feed(value)
+                        if prose:
+                            yield "delta", {"text": prose}
+                        if message_text:
+                            yield "message_delta", {"text": message_text}
+                    elif kind == "message":
+                        message = value
+                    elif kind == "error":
+                        yield "error", {
+                            "status": "error",
+                            "message": f"حدث خطأ في الاتصال بخدمة الذكاء الاصطناعي: {value}",
+                            "session_id": session.session_id,
+                        }
+                        return
+
+                if round_idx == 0:
+                    self._record_speculation(session, speculative_call, message)
+                tool_calls = self._extract_tool_calls_from_message(message)
+                if not tool_calls or round_idx == self.MAX_TOOL_ROUNDS:
+                    break
+
+                signature = self._tool_calls_signature(tool_calls)
+                reused = self._reuse_speculative_result(speculative_results, signature, tool_calls)
+                if reused is None and signature in seen_tool_signatures:
+                    logger.warning("Tool loop repeating detected; stopping early")
+                    break
+                seen_tool_signatures.add(signature)
+
+                messages.append(message)
+                if reused:
+                    messages.extend(reused)
+                    continue
+
+                yield "tool_round", {
+                    "round": round_idx,
+                    "tools": [tc.get("function", {}).get("name") for tc in tool_calls],
+                }
+                tool_messages = [None] * len(tool_calls)
+                for index, tool_message, elapsed_ms in self._iter_tool_results(tool_calls):
+                    tool_messages[index] = tool_message
+                    yield "tool_done", {
+                        "round": round_idx,
+                        "name": tool_message["name"],
+                        "ms": round(elapsed_ms, 1),
+                    }
+                messages.extend(tool_messages)
+
+            yield "final", self._finalize_response(session, requirements, messages, message)
+
+        except Exception as e:
+            logger.exception("Streaming chat turn failed")
+            yield "error", {
+                "status": "error",
+                "message": f"حدث خطأ غير متوقع: {str(e)}",
+                "session_id": session.session_id if session else None
+            }
@@ -0,0 +1,44 @@
+from .admission_control import admission_control
+from .agent_jobs import agent_job_queue
+from .hedging import hedge_policy
+from .json_recovery import json_recovery_stats
+from .latency import tool_latency
+from .llm_cache import llm_response_cache
+from .llm_http import get_llm_http_client
+from .message_log import message_log
+from .model_router import model_router
+from .prompt_cache import llm_usage
+from .provider_gateway import provider_gateway
+from .requirements_extractor import requirements_fast_path
+from .single_flight import async_llm_flight, llm_flight, tool_flight
+from .speculative_search import speculative_search
+from .structured_output import model_capabilities
+from .tool_cache import tool_result_cache
+from .tool_result_store import tool_result_store
+
+
+def collect_ai_metrics():
+    """تجميع مؤشرات مكونات خدمة الذكاء الاصطناعي داخل هذه العملية (لأغراض المراقبة)"""
+    return {
+        "admission": admission_control.stats(),
+        "tool_cache": tool_result_cache.stats(),
+        "tool_result_store": tool_result_store.stats(),
+        "message_log": message_log.stats(),
+        "llm_cache": llm_response_cache.stats(),
+        "llm_http": get_llm_http_client().stats(),
+        "llm_usage": llm_usage.stats(),
+        "provider_gateway": provider_gateway.stats(),
+        "tool_latency_ms": tool_latency.snapshot(),
+        "requirements_fast_path": requirements_fast_path.stats(),
+        "speculative_search": speculative_search.stats(),
+        "json_recovery": json_recovery_stats.stats(),
+        "models": model_capabilities.stats(),
+        "model_routing": model_router.stats(),
+        "hedging": hedge_policy.stats(),
+        "agent_jobs": agent_job_queue.stats(),
+        "single_flight": {
+            "llm": llm_flight.stats(),
+            "llm_async": async_llm_flight.stats(),
+            "tools": tool_flight.stats(),
+        },
+    }
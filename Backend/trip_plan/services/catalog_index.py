@@ -0,0 +1,140 @@
+import logging
+import threading
+import time
+
+import numpy as np
+from django.conf import settings
+
+from ..models.travel_model import Hotel, SEASON_BITS, normalize_season
+from .catalog_version import get_catalog_version
+
+
+logger = logging.getLogger(__name__)
+
+
+def trip_costs(flight_cost, daily_living_cost, hotel_price, days, people):
+    """
+    معادلة التكلفة الكلية، تعمل على قيم مفردة أو على مصفوفات NumPy كاملة
+
+    Formula: (flight_cost × people) + (hotel_price × days) + (daily_living × days × people)
+    """
+    return flight_cost * people + hotel_price * days + daily_living_cost * days * people
+
+
+class CatalogSnapshot:
+    """نسخة عمودية (columnar) ثابتة من بيانات الفنادق والوجهات، صف لكل فندق"""
+
+    def __init__(self, rows, version=None):
+        self.built_at = time.monotonic()
+        self.version = version
+        self.size = len(rows)
+
+        self.hotel_id = np.array([r['id'] for r in rows], dtype=np.int64)
+        self.destination_id = np.array([r['destination_id'] for r in rows], dtype=np.int64)
+        self.stars = np.array([r['stars'] for r in rows], dtype=np.int8)
+        self.is_sea_view = np.array([r['is_sea_view'] for r in rows], dtype=bool)
+        self.price_per_night = np.array([float(r['price_per_night']) for r in rows], dtype=np.float64)
+        self.flight_cost = np.array([float(r['destination__flight_cost']) for r in rows], dtype=np.float64)
+        self.daily_living_cost = np.array([float(r['destination__daily_living_cost']) for r in rows], dtype=np.float64)
+        self.is_coastal = np.array([r['destination__is_coastal'] for r in rows], dtype=bool)
+        self.season_mask = np.array([r['destination__season_mask'] for r in rows], dtype=np.int16)
+
+        # الحقول النصية تبقى في قوائم بايثون (تُقرأ فقط لصفوف النتيجة النهائية)
+        self.rows = rows
+
+
+class CatalogIndex:
+    """
+    فهرس بحث داخل ذاكرة العملية (process-local)
+    - يُبنى مرة واحدة باستعلام واحد ثم تُنفذ عمليات البحث بدون أي استعلام لقاعدة البيانات
+    - تُحسب التكلفة لكل الفنادق كتعبير NumPy واحد، ثم اختيار top-k بدل الترتيب الكامل
+    - يُعاد بناؤه عند تغير رقم نسخة الكتالوج (تعديلات AdminCRUDService) أو بعد انتهاء الـ TTL
+    """
+
+    _snapshot = None
+    _lock = threading.Lock()
+
+    @classmethod
+    def invalidate(cls):
+        """إلغاء النسخة الحالية؛ سيُعاد البناء عند أول بحث قادم"""
+        cls._snapshot = None
+
+    @classmethod
+    def rebuild(cls):
+        # نقرأ رقم النسخة قبل الاستعلام: أي تعديل أثناء البناء سيؤدي لإعادة بناء لاحقة
+        version = get_catalog_version()
+        rows = list(
+            Hotel.objects.values(
+                'id', 'name', 'stars', 'is_sea_view', 'price_per_night',
+                'destination_id', 'destination__name', 'destination__country',
+                'destination__is_coastal', 'destination__description',
+                'destination__flight_cost', 'destination__daily_living_cost',
+                'destination__season_mask',
+            ).order_by('destination_id', 'id')
+        )
+        snapshot = CatalogSnapshot(rows, version=version)
+        cls._snapshot = snapshot
+        logger.info("Catalog index rebuilt with %d hotel row(s)", snapshot.size)
+        return snapshot
+
+    @staticmethod
+    def _is_fresh(snapshot, version):
+        if snapshot is None or snapshot.version != version:
+            return False
+        ttl = getattr(settings, "AI_CATALOG_INDEX_TTL", 300)
+        return not ttl or time.monotonic() - snapshot.built_at < ttl
+
+    @classmethod
+    def get_snapshot(cls):
+        version = get_catalog_version()
+        snapshot = cls._snapshot
+        if cls._is_fresh(snapshot, version):
+            return snapshot
+
+        with cls._lock:
+            snapshot = cls._snapshot
+            if cls._is_fresh(snapshot, version):
+                return snapshot
+            return cls.rebuild()
+
+    @classmethod
+    def search(cls, budget=None, days=None, people=None, is_coastal=None,
+               min_stars=3, season=None, is_sea_view=None, limit=None):
+        """
+        نفس فلاتر search_destinations_and_hotels لكن على المصفوفات
+        يعيد صفوفاً بنفس مفاتيح استعلام values() في مسار قاعدة البيانات
+        """
+        snap = cls.get_snapshot()
+        if snap.size == 0:
+            return []
+
+        mask = snap.stars >= (min_stars or 1)
+        if is_coastal is not None:
+            mask &= snap.is_coastal == bool(is_coastal)
+        if is_sea_view is not None:
+            mask &= snap.is_sea_view == bool(is_sea_view)
+        season = normalize_season(season) if season else None
+        if season and season != "all":
+            mask &= (snap.season_mask & SEASON_BITS[season]) != 0
+
+        idx = np.flatnonzero(mask)
+
+        if budget and days and people:
+            costs = trip_costs(
+                snap.flight_cost[idx], snap.daily_living_cost[idx], snap.price_per_night[idx],
+                int(days), int(people)
+            )
+            within = np.round(costs, 2) <= float(budget)
+            idx, costs = idx[within], costs[within]
+
+            # top-k: partition خطي لإيجاد التكلفة رقم k ثم ترتيب المرشحين فقط (بالتكلفة ثم hotel_id)
+            if limit and limit < idx.size:
+                kth = np.partition(costs, limit - 1)[limit - 1]
+                candidates = costs <= kth
+                idx, costs = idx[candidates], costs[candidates]
+            order = np.lexsort((snap.hotel_id[idx], costs))
+            idx = idx[order][:limit] if limit else idx[order]
+        elif limit:
+            idx = idx[:limit]
+
+        return [snap.rows[i] for i in idx.tolist()]
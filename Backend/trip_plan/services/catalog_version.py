@@ -0,0 +1,26 @@
+from django.core.cache import cache
+
+
+CATALOG_VERSION_KEY = "trip_plan:catalog_version"
+
+
+def get_catalog_version():
+    """
+    رقم نسخة بيانات الكتالوج (الوجهات/الفنادق/الفعاليات/الصور) في Django cache
+    مشترك بين العمليات فقط مع cache مشترك (REDIS_URL)؛ مع LocMemCache لكل عملية رقمها الخاص
+    """
+    version = cache.get(CATALOG_VERSION_KEY)
+    if version is None:
+        cache.add(CATALOG_VERSION_KEY, 1, timeout=None)
+        version = cache.get(CATALOG_VERSION_KEY, 1)
+    return version
+
+
+def bump_catalog_version():
+    """زيادة رقم النسخة بعد أي تعديل إداري، فتصبح كل النتائج المخزنة للنسخة السابقة غير صالحة"""
+    try:
+        return cache.incr(CATALOG_VERSION_KEY)
+    except ValueError:
+        # المفتاح غير موجود (أول تشغيل أو تم مسح الكاش)
+        cache.add(CATALOG_VERSION_KEY, 1, timeout=None)
+        return cache.incr(CATALOG_VERSION_KEY)
@@ -0,0 +1,136 @@
+import heapq
+import itertools
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+
+
+_tool_executor = None
+_tool_executor_lock = threading.Lock()
+
+
+def get_tool_executor():
+    """thread pool محدود ومشترك على مستوى العملية لتنفيذ أدوات الـ Agent بالتوازي"""
+    global _tool_executor
+    if _tool_executor is None:
+        with _tool_executor_lock:
+            if _tool_executor is None:
+                _tool_executor = ThreadPoolExecutor(
+                    max_workers=getattr(settings, "AI_TOOL_MAX_WORKERS", 4),
+                    thread_name_prefix="agent-tool",
+                )
+    return _tool_executor
+
+
+class DelayedTaskPool:
+    """
+    thread pool محدود لمهام مؤجلة (مثل الطلب الاحتياطي في التحوط):
+    - thread مؤقت واحد ينتظر أقرب موعد، فلا يُحجز thread من الـ pool لكل مهمة أثناء الانتظار
+    - عند الموعد تُنفذ المهمة فقط إذا وُجد thread فارغ؛ لا يوجد طابور خلف الـ pool،
+      والمهمة المتخطاة (pool مشغول بالكامل) نتيجتها None
+    - cancel() على الـ Future قبل الموعد يلغي المهمة
+    """
+
+    def __init__(self, max_workers, thread_name_prefix):
+        self.max_workers = max_workers
+        self.thread_name_prefix = thread_name_prefix
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=thread_name_prefix)
+        self._slots = threading.BoundedSemaphore(max_workers)
+        self._cond = threading.Condition()
+        self._heap = []
+        self._seq = itertools.count()
+        self._timer = None
+        self.started = 0
+        self.skipped_busy = 0
+
+    def schedule(self, delay, fn):
+        future = Future()
+        with self._cond:
+            heapq.heappush(self._heap, (time.monotonic() + delay, next(self._seq), future, fn))
+            if self._timer is None:
+                self._timer = threading.Thread(
+                    target=self._run, name=self.thread_name_prefix + "-timer", daemon=True
+                )
+                self._timer.start()
+            self._cond.notify()
+        return future
+
+    def _next_due(self):
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                if self._heap and self._heap[0][0] <= now:
+                    return heapq.heappop(self._heap)
+                self._cond.wait(self._heap[0][0] - now if self._heap else None)
+
+    def _run(self):
+        while True:
+            _, _, future, fn = self._next_due()
+            if not future.set_running_or_notify_cancel():
+                continue
+            if not self._slots.acquire(blocking=False):
+                with self._cond:
+                    self.skipped_busy += 1
+                future.set_result(None)
+                continue
+            with self._cond:
+                self.started += 1
+            self._executor.submit(self._execute, future, fn)
+
+    def _execute(self, future, fn):
+        try:
+            result = fn()
+        except BaseException as e:
+            future.set_exception(e)
+        else:
+            future.set_result(result)
+        finally:
+            self._slots.release()
+
+    def stats(self):
+        with self._cond:
+            return {
+                "max_workers": self.max_workers,
+                "scheduled": len(self._heap),
+                "started": self.started,
+                "skipped_busy": self.skipped_busy,
+            }
+
+
+_llm_hedge_pool = None
+
+
+def get_llm_hedge_pool():
+    """pool الطلبات الاحتياطية للتحوط (الطلب الأصلي يعمل دائماً على thread المستدعي)"""
+    global _llm_hedge_pool
+    if _llm_hedge_pool is None:
+        with _tool_executor_lock:
+            if _llm_hedge_pool is None:
+                _llm_hedge_pool = DelayedTaskPool(
+                    max_workers=getattr(settings, "AI_HEDGE_MAX_WORKERS", 16),
+                    thread_name_prefix="llm-hedge",
+                )
+    return _llm_hedge_pool
+
+
+def call_with_own_db_connection(func, *args, **kwargs):
+    """
+    تنفيذ دالة متزامنة داخل thread عامل مع إدارة اتصال قاعدة البيانات الخاص بهذا الـ thread
+    كما تفعل Django في بداية/نهاية كل request (اتصالات Django مرتبطة بالـ thread، ولا يوجد request هنا):
+    close_old_connections يغلق فقط الاتصال المعطوب أو الذي تجاوز CONN_MAX_AGE، فيُعاد استخدام
+    اتصال الـ thread بين المهام بدل فتح اتصال MySQL جديد لكل أداة
+    """
+    close_old_connections()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        close_old_connections()
+
+
+async def run_in_worker_thread(func, *args, **kwargs):
+    """تشغيل كود متزامن (ORM/serializers) من مسار async بدون حجز الـ event loop"""
+    return await sync_to_async(call_with_own_db_connection, thread_sensitive=False)(func, *args, **kwargs)
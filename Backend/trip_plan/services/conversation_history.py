@@ -0,0 +1,167 @@
+import json
+
+from django.conf import settings
+
+
+# بداية نص رسالة tool المخزنة خارج السجل (ملخص + مرجع، انظر tool_result_store)
+TOOL_RESULT_REF_PREFIX = "[tool_result ref="
+
+
+def estimate_tokens(message):
+    """تقدير تقريبي لعدد الـ tokens لرسالة واحدة (حوالي 3 أحرف لكل token + overhead ثابت)"""
+    content = message.get("content") or ""
+    if not isinstance(content, str):
+        content = json.dumps(content, ensure_ascii=False)
+    chars = len(content)
+    for tc in message.get("tool_calls") or []:
+        fn = tc.get("function") or {}
+        chars += len(fn.get("name") or "") + len(fn.get("arguments") or "")
+    return chars // 3 + 4
+
+
+def split_turns(messages, start=0):
+    """تقسيم السجل إلى أدوار؛ كل دور يبدأ برسالة user. يعيد قائمة (بداية, نهاية)"""
+    bounds = []
+    turn_start = start
+    for i in range(start, len(messages)):
+        if messages[i].get("role") == "user" and i > turn_start:
+            bounds.append((turn_start, i))
+            turn_start = i
+    if turn_start < len(messages):
+        bounds.append((turn_start, len(messages)))
+    return bounds
+
+
+def _shorten(text, limit):
+    text = " ".join((text or "").split())
+    return text if len(text) <= limit else text[:limit - 1] + "…"
+
+
+def compact_tool_content(content):
+    """ملخص صغير لنتيجة أداة قديمة (المعرفات والأسماء والتكاليف فقط) بدل الـ payload الكامل"""
+    try:
+        data = json.loads(content)
+    except (TypeError, ValueError):
+        return _shorten(content, 160)
+
+    rows = data.get("results") if isinstance(data, dict) and "results" in data else data
+    if isinstance(rows, list):
+        items = []
+        for row in rows[:10]:
+            if not isinstance(row, dict):
+                continue
+            parts = []
+            for key in ("destination_id", "hotel_id", "id", "hotel_name", "destination_name", "name", "total_cost"):
+                if row.get(key) is not None:
+                    parts.append(f"{key}={row[key]}")
+            items.append("(" + ", ".join(parts) + ")")
+        return f"[compacted] {len(rows)} result(s): " + "; ".join(items)
+    if isinstance(data, dict):
+        keep = {k: data[k] for k in ("id", "name", "total_cost", "error") if k in data}
+        return "[compacted] " + json.dumps(keep, ensure_ascii=False)
+    return _shorten(content, 160)
+
+
+class ConversationHistory:
+    """
+    إدارة نافذة سجل المحادثة المرسلة للـ LLM حسب ميزانية tokens
+    - الأدوار الأخيرة تُرسل كما هي (الدور الحالي دائماً كامل)
+    - نتائج الأدوات في الأدوار السابقة تُختصر (تم دمج أثرها في collected_requirements)
+    - الأدوار الأقدم تُضغط في ملخص تراكمي يُخزن في session.state['history_summary']
+      فلا يُعاد تلخيص نفس الرسائل في كل دور
+    """
+
+    STATE_KEY = "history_summary"
+
+    def __init__(self, token_budget=None, summary_max_chars=None):
+        self.token_budget = token_budget or getattr(settings, "AI_HISTORY_TOKEN_BUDGET", 3000)
+        self.summary_max_chars = summary_max_chars or getattr(settings, "AI_HISTORY_SUMMARY_MAX_CHARS", 1500)
+
+    def window(self, state, messages, offset=0):
+        """
+        يعيد (نص الملخص أو None, رسائل النافذة)
+        ويحدّث الملخص المخزن في state عند خروج أدوار جديدة من النافذة
+        offset: الرقم التسلسلي لأول رسالة في messages (عند تحميل آخر السجل فقط من ConversationMessage)؛
+        summary["upto"] رقم تسلسلي مطلق داخل الجلسة
+        """
+        summary = state.get(self.STATE_KEY) or {"upto": 0, "text": ""}
+        upto = min(max(summary.get("upto", 0) - offset, 0), len(messages))
+
+        turns = split_turns(messages, start=upto)
+        if not turns:
+            return summary.get("text") or None, []
+
+        # نجمع الأدوار من الأحدث للأقدم ضمن الميزانية (الدور الحالي دائماً)
+        kept = []
+        used = 0
+        for index, (start, end) in enumerate(reversed(turns)):
+            turn = messages[start:end] if index == 0 else self._compact_turn(messages[start:end])
+            cost = sum(estimate_tokens(m) for m in turn)
+            if index > 0 and used + cost > self.token_budget:
+                break
+            kept.insert(0, turn)
+            used += cost
+
+        cut = turns[len(turns) - len(kept)][0]
+        if cut > upto:
+            summary = {
+                "upto": cut + offset,
+                "text": self._extend_summary(summary.get("text", ""), messages[upto:cut]),
+            }
+            state[self.STATE_KEY] = summary
+
+        window = [m for turn in kept for m in turn]
+        return summary.get("text") or None, window
+
+    @staticmethod
+    def _compact_turn(turn):
+        compacted = []
+        for message in turn:
+            content = message.get("content")
+            if message.get("role") == "tool" and not (isinstance(content, str) and content.startswith(TOOL_RESULT_REF_PREFIX)):
+                message = dict(message, content=compact_tool_content(content))
+            compacted.append(message)
+        return compacted
+
+    def _extend_summary(self, text, old_messages):
+        lines = [ln for ln in (text or "").splitlines() if ln.strip()]
+        for start, end in split_turns(old_messages):
+            lines.append(self._summarize_turn(old_messages[start:end]))
+
+        # ملخص متدحرج: نحذف أقدم الأسطر إذا تجاوز الحد
+        while len(lines) > 1 and sum(len(ln) + 1 for ln in lines) > self.summary_max_chars:
+            lines.pop(0)
+        return "\n".join(lines)
+
+    @staticmethod
+    def _summarize_turn(turn):
+        user_text = ""
+        tools = []
+        assistant_text = ""
+        for message in turn:
+            role = message.get("role")
+            if role == "user":
+                user_text = message.get("content") or ""
+            elif role == "tool":
+                tools.append(message.get("name") or "tool")
+            elif role == "assistant" and message.get("content"):
+                assistant_text = message["content"]
+
+        # من رد الـ assistant نأخذ status و message من الـ JSON إن وُجد
+        status = None
+        start, end = assistant_text.find("{"), assistant_text.rfind("}")
+        if start != -1 and end > start:
+            try:
+                data = json.loads(assistant_text[start:end + 1])
+                status = data.get("status")
+                assistant_text = data.get("message") or assistant_text
+            except (ValueError, AttributeError):
+                pass
+
+        line = f"- المستخدم: {_shorten(user_text, 160)}"
+        if tools:
+            line += f" | أدوات: {', '.join(sorted(set(tools)))}"
+        if assistant_text:
+            label = f"المساعد ({status})" if status else "المساعد"
+            line += f" | {label}: {_shorten(assistant_text, 160)}"
+        return line
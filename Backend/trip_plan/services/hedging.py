@@ -0,0 +1,92 @@
+import threading
+
+from django.conf import settings
+
+from .concurrency import get_llm_hedge_pool
+from .model_router import model_router
+from .provider_gateway import ProviderUnavailable, provider_gateway
+
+
+class HedgePolicy:
+    """
+    سياسة الطلبات المتحوطة (hedged requests) لاستدعاءات الـ LLM غير الـ stream:
+    - إذا لم يصل رد الطلب الأصلي خلال عتبة متكيفة (النسبة AI_HEDGE_PERCENTILE من نافذة أزمنة النموذج
+      في model_router، محصورة بين AI_HEDGE_MIN_DELAY_MS و AI_HEDGE_MAX_DELAY_MS) يُرسل طلب ثانٍ
+      لنفس النموذج أو لـ AI_HEDGE_MODEL، وأول رد ناجح يفوز ويُلغى الآخر
+    - الطلبات الإضافية محدودة بنسبة AI_HEDGE_MAX_RATIO من كل الاستدعاءات، ولا تنتظر توكن من ProviderGateway
+      (تحت الضغط أو أثناء 429 لا يوجد تحوط، فلا يتضاعف الحمل على مزود بطيء أصلاً)
+    - في المسار المتزامن الطلب الأصلي على thread المستدعي، والاحتياطي فقط على pool محدود (AI_HEDGE_MAX_WORKERS)
+      بدون طابور: إذا كان الـ pool مشغولاً لا يوجد تحوط
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.hedged = 0
+        self.wins = {"primary": 0, "hedge": 0, "none": 0}
+        self.skipped = {"budget": 0, "gateway": 0}
+        self._thresholds = {}
+
+    @staticmethod
+    def is_enabled():
+        return getattr(settings, "AI_HEDGE_ENABLED", False)
+
+    def delay_for(self, model):
+        """ثواني الانتظار قبل إرسال الطلب الاحتياطي، أو None إذا كان التحوط معطلاً"""
+        if not self.is_enabled():
+            return None
+        min_ms = getattr(settings, "AI_HEDGE_MIN_DELAY_MS", 1500)
+        max_ms = getattr(settings, "AI_HEDGE_MAX_DELAY_MS", 10000)
+
+        window = model_router.latency.get(model)
+        if len(window) < getattr(settings, "AI_ROUTER_MIN_SAMPLES", 5):
+            # لا توجد قياسات كافية: أقصى عتبة فقط (يحمي من التوقف الكامل دون تحوط مبكر)
+            threshold_ms = max_ms
+        else:
+            threshold_ms = min(max_ms, max(min_ms, window.percentile(getattr(settings, "AI_HEDGE_PERCENTILE", 90))))
+
+        with self._lock:
+            self.calls += 1
+            self._thresholds[model] = round(threshold_ms, 1)
+        return threshold_ms / 1000
+
+    @staticmethod
+    def hedge_model(model):
+        return getattr(settings, "AI_HEDGE_MODEL", "") or model
+
+    def try_start(self):
+        """هل يُسمح بإرسال طلب احتياطي الآن (ضمن ميزانية التحوط ومع توكن متاح فوراً)"""
+        with self._lock:
+            if self.hedged + 1 > self.calls * getattr(settings, "AI_HEDGE_MAX_RATIO", 0.1):
+                self.skipped["budget"] += 1
+                return False
+        try:
+            provider_gateway.reserve(max_wait=0)
+        except ProviderUnavailable:
+            with self._lock:
+                self.skipped["gateway"] += 1
+            return False
+        with self._lock:
+            self.hedged += 1
+        return True
+
+    def record(self, winner):
+        """winner: primary أو hedge (أول رد ناجح) أو none (فشل الطلبان)"""
+        with self._lock:
+            self.wins[winner] += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "enabled": self.is_enabled(),
+                "calls": self.calls,
+                "hedged": self.hedged,
+                "hedge_rate": round(self.hedged / self.calls, 4) if self.calls else None,
+                "wins": dict(self.wins),
+                "skipped": dict(self.skipped),
+                "threshold_ms": dict(self._thresholds),
+                "pool": get_llm_hedge_pool().stats(),
+            }
+
+
+hedge_policy = HedgePolicy()
@@ -0,0 +1,296 @@
+import json
+import re
+import threading
+
+
+_NUMBER_RE = re.compile(r"-?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?")
+_BARE_WORD_RE = re.compile(r"[A-Za-z_][A-Za-z0-9_\-]*")
+_LITERALS = {
+    "true": True, "false": False, "null": None,
+    "True": True, "False": False, "None": None,
+}
+_ESCAPES = {'"': '"', "'": "'", "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+_INVISIBLE = str.maketrans("", "", "\ufeff\u200b")
+_MAX_DEPTH = 64
+
+
+class _SyntaxError(Exception):
+    def __init__(self, pos):
+        super().__init__(pos)
+        self.pos = pos
+
+
+class _TolerantParser:
+    """
+    محلل recursive-descent متسامح يقرأ كل محرف مرة واحدة:
+    - مفاتيح بعلامات " أو ' أو بدون علامات، و True/False/None بأسلوب Python
+    - فواصل زائدة أو ناقصة بين العناصر، وتعليقات // و /* */
+    - نص مقطوع في النهاية (max_tokens): تُغلق الأقواس المفتوحة ويُعاد ما تم تحليله
+    """
+
+    def __init__(self, text):
+        self.text = text
+        self.n = len(text)
+        self.truncated = False
+
+    def _skip(self, pos):
+        text, n = self.text, self.n
+        while pos < n:
+            ch = text[pos]
+            if ch.isspace():
+                pos += 1
+            elif ch == "/" and text.startswith("//", pos):
+                end = text.find("\n", pos)
+                pos = n if end == -1 else end + 1
+            elif ch == "/" and text.startswith("/*", pos):
+                end = text.find("*/", pos + 2)
+                pos = n if end == -1 else end + 2
+            else:
+                break
+        return pos
+
+    def parse_object(self, pos, depth=0):
+        """pos عند '{'. يعيد (dict, موضع ما بعد '}')"""
+        if depth > _MAX_DEPTH:
+            raise _SyntaxError(pos)
+        result = {}
+        pos += 1
+        while True:
+            pos = self._skip(pos)
+            if pos >= self.n:
+                self.truncated = True
+                return result, pos
+            ch = self.text[pos]
+            if ch == "}":
+                return result, pos + 1
+            if ch == ",":
+                pos += 1
+                continue
+
+            if ch in "\"'":
+                key, pos, closed = self._parse_string(pos)
+                if not closed:
+                    return result, pos
+            else:
+                match = _BARE_WORD_RE.match(self.text, pos)
+                if not match:
+                    raise _SyntaxError(pos)
+                key, pos = match.group(), match.end()
+
+            pos = self._skip(pos)
+            if pos >= self.n:
+                self.truncated = True
+                return result, pos
+            if self.text[pos] not in ":=":
+                raise _SyntaxError(pos)
+            pos = self._skip(pos + 1)
+            if pos >= self.n:
+                self.truncated = True
+                return result, pos
+
+            value, pos = self._parse_value(pos, depth)
+            result[key] = value
+
+    def _parse_array(self, pos, depth):
+        if depth > _MAX_DEPTH:
+            raise _SyntaxError(pos)
+        result = []
+        pos += 1
+        while True:
+            pos = self._skip(pos)
+            if pos >= self.n:
+                self.truncated = True
+                return result, pos
+            ch = self.text[pos]
+            if ch == "]":
+                return result, pos + 1
+            if ch == ",":
+                pos += 1
+                continue
+            value, pos = self._parse_value(pos, depth)
+            result.append(value)
+
+    def _parse_value(self, pos, depth):
+        ch = self.text[pos]
+        if ch == "{":
+            return self.parse_object(pos, depth + 1)
+        if ch == "[":
+            return self._parse_array(pos, depth + 1)
+        if ch in "\"'":
+            value, pos, _ = self._parse_string(pos)
+            return value, pos
+
+        match = _NUMBER_RE.match(self.text, pos)
+        if match:
+            raw = match.group()
+            try:
+                value = int(raw) if raw.lstrip("-").isdigit() else float(raw)
+            except ValueError:
+                raise _SyntaxError(pos)
+            return value, match.end()
+
+        match = _BARE_WORD_RE.match(self.text, pos)
+        if match:
+            word = match.group()
+            # كلمة بدون علامات (مثل status: gather_info) تُعامل كنص
+            return _LITERALS.get(word, word), match.end()
+        raise _SyntaxError(pos)
+
+    def _parse_string(self, pos):
+        """يعيد (النص, الموضع بعد علامة الإغلاق, هل أُغلق)"""
+        quote = self.text[pos]
+        text, n = self.text, self.n
+        parts = []
+        pos += 1
+        next_quote = -2
+        while pos < n:
+            # القفز مباشرة إلى أقرب محرف خاص (موضع علامة الإغلاق يُحسب مرة واحدة حتى نتجاوزه)
+            if next_quote != -1 and next_quote < pos:
+                next_quote = text.find(quote, pos)
+            next_escape = text.find("\\", pos, next_quote if next_quote != -1 else n)
+            if next_escape == -1:
+                if next_quote == -1:
+                    parts.append(text[pos:])
+                    break
+                parts.append(text[pos:next_quote])
+                return "".join(parts), next_quote + 1, True
+
+            parts.append(text[pos:next_escape])
+            pos = next_escape + 1
+            if pos >= n:
+                break
+            esc = text[pos]
+            if esc == "u" and pos + 4 < n:
+                try:
+                    code = int(text[pos + 1:pos + 5], 16)
+                except ValueError:
+                    parts.append("\\u")
+                    pos += 1
+                    continue
+                pos += 5
+                # زوج surrogate (مثل الرموز التعبيرية)
+                if 0xD800 <= code < 0xDC00 and text.startswith("\\u", pos):
+                    try:
+                        low = int(text[pos + 2:pos + 6], 16)
+                    except ValueError:
+                        low = None
+                    if low is not None and 0xDC00 <= low < 0xE000:
+                        code = 0x10000 + ((code - 0xD800) << 10) + (low - 0xDC00)
+                        pos += 6
+                parts.append(chr(code))
+            else:
+                parts.append(_ESCAPES.get(esc, "\\" + esc))
+                pos += 1
+
+        self.truncated = True
+        return "".join(parts), n, False
+
+
+def _scan_objects(text):
+    """
+    مرور خطي على النص: كل '{' خارج كائن سابق هو بداية مرشح
+    عند فشل التحليل نكمل من موضع الفشل (وليس من المحرف التالي) فيبقى المرور O(n)
+    """
+    parser = _TolerantParser(text)
+    candidates = []
+    pos = text.find("{")
+    while pos != -1:
+        parser.truncated = False
+        try:
+            obj, end = parser.parse_object(pos)
+        except _SyntaxError as e:
+            pos = text.find("{", max(e.pos, pos + 1))
+            continue
+        candidates.append((obj, parser.truncated))
+        pos = text.find("{", end)
+    return candidates
+
+
+def _pick_trailing(candidates):
+    """الكائن الأخير الذي يحمل status هو رد النموذج، وإلا آخر كائن"""
+    for obj, truncated in reversed(candidates):
+        if "status" in obj:
+            return obj, truncated
+    return candidates[-1] if candidates else None
+
+
+class JSONRecoveryStats:
+    """عدادات: كم رداً حُلّل مباشرة، كم احتاج الاسترجاع المتسامح، وكم فشل (→ إصلاح عبر LLM)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.strict = 0
+        self.recovered = 0
+        self.truncated = 0
+        self.failed = 0
+
+    def count(self, attr):
+        with self._lock:
+            setattr(self, attr, getattr(self, attr) + 1)
+
+    def stats(self):
+        with self._lock:
+            total = self.strict + self.recovered + self.failed
+            return {
+                "strict": self.strict,
+                "recovered": self.recovered,
+                "recovered_truncated": self.truncated,
+                "failed": self.failed,
+                "failure_rate": round(self.failed / total, 4) if total else None,
+            }
+
+
+json_recovery_stats = JSONRecoveryStats()
+
+
+def recover_json_with_mode(text, record=True):
+    """
+    استرجاع كائن الـ JSON الأخير (trailing) من رد LLM بمرور خطي واحد
+    يدعم: markdown fences، نص قبل/بعد الـ JSON، فواصل زائدة، تعليقات، dict بأسلوب Python،
+    JSON مقتبس كـ string، fragment بدون أقواس خارجية يبدأ بـ "status"، ونص مقطوع في النهاية
+    يعيد (dict أو None, الطريقة): strict | recovered | truncated | failed
+    """
+    if not text:
+        return None, "failed"
+    clean = text.translate(_INVISIBLE).strip()
+
+    # المسار الشائع: الرد كله JSON صالح
+    if clean.startswith("{"):
+        try:
+            data = json.loads(clean)
+        except ValueError:
+            data = None
+        if isinstance(data, dict):
+            if record:
+                json_recovery_stats.count("strict")
+            return data, "strict"
+
+    # JSON مقتبس كـ string: نفك الاقتباس مرة واحدة
+    if len(clean) > 1 and clean[0] == clean[-1] and clean[0] in "\"'":
+        inner, _, closed = _TolerantParser(clean)._parse_string(0)
+        if closed and ("{" in inner or '"status"' in inner):
+            clean = inner.strip()
+
+    chosen = _pick_trailing(_scan_objects(clean))
+    if (chosen is None or "status" not in chosen[0]) and '"status"' in clean:
+        # fragment بدون أقواس خارجية يبدأ بـ "status": ...
+        start = clean.find('"status"')
+        wrapped = _pick_trailing(_scan_objects("{" + clean[start:].strip().strip(",") + "}"))
+        if wrapped is not None and "status" in wrapped[0]:
+            chosen = wrapped
+
+    if chosen is None:
+        if record:
+            json_recovery_stats.count("failed")
+        return None, "failed"
+
+    if record:
+        json_recovery_stats.count("recovered")
+        if chosen[1]:
+            json_recovery_stats.count("truncated")
+    return chosen[0], "truncated" if chosen[1] else "recovered"
+
+
+def recover_json_object(text, record=True):
+    """مثل recover_json_with_mode لكن يعيد الكائن فقط (dict أو None)"""
+    return recover_json_with_mode(text, record)[0]
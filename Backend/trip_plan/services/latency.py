@@ -0,0 +1,98 @@
+import threading
+import time
+from collections import deque
+
+
+def _pick(sorted_values, q):
+    """النسبة المئوية q (0-100) من قائمة مرتبة (nearest-rank)"""
+    pos = int(round(q / 100.0 * (len(sorted_values) - 1)))
+    return sorted_values[min(len(sorted_values) - 1, max(0, pos))]
+
+
+class LatencyWindow:
+    """نافذة متحركة لآخر N قياس زمني (بالملي ثانية) لحساب النسب المئوية p50/p90/p99"""
+
+    def __init__(self, maxlen=500):
+        self._values = deque(maxlen=maxlen)
+        self._error_flags = deque(maxlen=maxlen)
+        self._lock = threading.Lock()
+        self.count = 0
+        self.errors = 0
+        self.last_observed_at = None
+
+    def observe(self, ms, error=False):
+        with self._lock:
+            self._values.append(ms)
+            self._error_flags.append(bool(error))
+            self.count += 1
+            if error:
+                self.errors += 1
+            self.last_observed_at = time.monotonic()
+
+    def __len__(self):
+        return len(self._values)
+
+    def error_rate(self):
+        """نسبة الأخطاء ضمن النافذة الحالية فقط (وليس منذ بدء العملية)"""
+        with self._lock:
+            flags = list(self._error_flags)
+        return sum(flags) / len(flags) if flags else None
+
+    def percentile(self, q):
+        with self._lock:
+            values = sorted(self._values)
+        if not values:
+            return None
+        return _pick(values, q)
+
+    def snapshot(self):
+        with self._lock:
+            values = sorted(self._values)
+            count, errors = self.count, self.errors
+            window_errors = sum(self._error_flags)
+        if not values:
+            return {"count": count, "errors": errors, "window": 0}
+
+        def pct(q):
+            return round(_pick(values, q), 1)
+
+        return {
+            "count": count,
+            "errors": errors,
+            "window": len(values),
+            "error_rate": round(window_errors / len(values), 4),
+            "mean": round(sum(values) / len(values), 1),
+            "p50": pct(50),
+            "p90": pct(90),
+            "p95": pct(95),
+            "p99": pct(99),
+            "max": round(values[-1], 1),
+        }
+
+
+class LatencyRegistry:
+    """مجموعة نوافذ زمنية حسب الاسم (اسم الأداة، اسم النموذج، ...)"""
+
+    def __init__(self, maxlen=500):
+        self.maxlen = maxlen
+        self._windows = {}
+        self._lock = threading.Lock()
+
+    def get(self, name):
+        window = self._windows.get(name)
+        if window is None:
+            with self._lock:
+                window = self._windows.setdefault(name, LatencyWindow(self.maxlen))
+        return window
+
+    def observe(self, name, ms, error=False):
+        self.get(name).observe(ms, error=error)
+
+    def snapshot(self):
+        with self._lock:
+            items = list(self._windows.items())
+        return {name: window.snapshot() for name, window in items}
+
+
+# أزمنة تنفيذ أدوات الـ Agent (لكل أداة، ولجولة الأدوات كاملة تحت مفتاح "__round__")
+tool_latency = LatencyRegistry()
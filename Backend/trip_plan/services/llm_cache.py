@@ -0,0 +1,177 @@
+import copy
+import hashlib
+import json
+import logging
+import threading
+
+from django.conf import settings
+from django.core.cache import caches
+
+from .cache_utils import MISSING, TTLLRUCache
+
+
+logger = logging.getLogger(__name__)
+
+
+class LocalLLMCacheBackend:
+    """تخزين داخل ذاكرة العملية (LRU + TTL)"""
+
+    name = "local"
+
+    def __init__(self, maxsize=512, ttl=900):
+        self._cache = TTLLRUCache(maxsize=maxsize, ttl=ttl)
+
+    def get(self, key):
+        # نسخة مستقلة حتى لا يعدّل أحد المستدعين الرد المخزن المشترك
+        value = self._cache.get(key)
+        return value if value is MISSING else copy.deepcopy(value)
+
+    def set(self, key, value):
+        self._cache.set(key, value)
+
+    def clear(self):
+        self._cache.clear()
+
+    def stats(self):
+        return self._cache.stats()
+
+
+class DjangoLLMCacheBackend:
+    """تخزين عبر Django cache (مشترك بين العمليات إذا كان الـ backend مثل Redis/Memcached)"""
+
+    name = "django"
+    KEY_PREFIX = "trip_plan:llm:"
+
+    def __init__(self, alias="default", ttl=900):
+        self.alias = alias
+        self.ttl = ttl
+
+    def get(self, key):
+        return caches[self.alias].get(self.KEY_PREFIX + key, MISSING)
+
+    def set(self, key, value):
+        caches[self.alias].set(self.KEY_PREFIX + key, value, timeout=self.ttl)
+
+    def clear(self):
+        # لا نمسح كامل الـ cache المشترك؛ المفاتيح تنتهي بالـ TTL
+        pass
+
+    def stats(self):
+        return {"alias": self.alias, "ttl": self.ttl}
+
+
+def _normalize_message(message):
+    """شكل موحد للرسالة: بدون مسافات زائدة وبدون معرفات tool_call العشوائية"""
+    normalized = {"role": message.get("role")}
+    content = message.get("content")
+    if isinstance(content, str):
+        content = " ".join(content.split())
+    if content:
+        normalized["content"] = content
+    if message.get("name"):
+        normalized["name"] = message["name"]
+    calls = []
+    for tc in message.get("tool_calls") or []:
+        fn = tc.get("function") or {}
+        arguments = fn.get("arguments") or ""
+        try:
+            arguments = json.loads(arguments)
+        except (TypeError, ValueError):
+            pass
+        calls.append({"name": fn.get("name"), "arguments": arguments})
+    if calls:
+        normalized["tool_calls"] = calls
+    return normalized
+
+
+class LLMResponseCache:
+    """
+    كاش لردود الـ LLM على بادئات محادثة متطابقة (نفس النموذج + نفس الرسائل الموحدة + نفس تعريف الأدوات)
+    - يتجاوز نفسه تلقائياً عند وجود نتائج أدوات (role=tool) في السياق، لأنها خاصة بالمستخدم ولحظة التنفيذ
+    - يخزن الردود الناجحة فقط
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.stores = 0
+
+    @staticmethod
+    def is_cacheable(payload):
+        return not any(m.get("role") == "tool" for m in payload.get("messages") or [])
+
+    @staticmethod
+    def make_key(payload):
+        material = {
+            "model": payload.get("model"),
+            "messages": [_normalize_message(m) for m in payload.get("messages") or []],
+            "tools": payload.get("tools"),
+            "params": {
+                k: payload.get(k) for k in ("temperature", "top_p", "max_tokens", "tool_choice", "response_format")
+            },
+        }
+        raw = json.dumps(material, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def lookup(self, payload):
+        """يعيد (المفتاح, الرد المخزن أو MISSING). المفتاح None يعني أن الطلب غير قابل للتخزين"""
+        if not self.is_cacheable(payload):
+            with self._lock:
+                self.bypassed += 1
+            return None, MISSING
+
+        key = self.make_key(payload)
+        try:
+            cached = self.backend.get(key)
+        except Exception:
+            logger.warning("LLM cache lookup failed", exc_info=True)
+            cached = MISSING
+
+        with self._lock:
+            if cached is MISSING:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return key, cached
+
+    def store(self, key, response):
+        if key is None or not isinstance(response, dict) or response.get("error") or not response.get("choices"):
+            return
+        try:
+            self.backend.set(key, response)
+        except Exception:
+            logger.warning("LLM cache store failed", exc_info=True)
+            return
+        with self._lock:
+            self.stores += 1
+
+    def clear(self):
+        self.backend.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            data = {
+                "enabled": getattr(settings, "AI_LLM_CACHE_ENABLED", False),
+                "backend": self.backend.name,
+                "hits": self.hits,
+                "misses": self.misses,
+                "bypassed": self.bypassed,
+                "stores": self.stores,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+            }
+        data["storage"] = self.backend.stats()
+        return data
+
+
+def _build_backend():
+    ttl = getattr(settings, "AI_LLM_CACHE_TTL", 900)
+    if getattr(settings, "AI_LLM_CACHE_BACKEND", "local") == "django":
+        return DjangoLLMCacheBackend(alias=getattr(settings, "AI_LLM_CACHE_ALIAS", "default"), ttl=ttl)
+    return LocalLLMCacheBackend(maxsize=getattr(settings, "AI_LLM_CACHE_SIZE", 512), ttl=ttl)
+
+
+llm_response_cache = LLMResponseCache(_build_backend())
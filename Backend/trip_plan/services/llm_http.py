@@ -0,0 +1,228 @@
+import asyncio
+import logging
+import socket
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+
+import httpx
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+
+logger = logging.getLogger(__name__)
+
+# الطلب القابل للقطع الجاري في هذا الـ thread (انظر abortable_request)
+_active_request = threading.local()
+
+
+class AbortableRequest:
+    """
+    طلب HTTP متزامن يمكن قطعه من thread آخر (الطلب الخاسر في سباق التحوط):
+    قطع الـ socket يوقظ الـ thread المنتظر فوراً بخطأ اتصال بدل انتظار الرد حتى مهلة القراءة،
+    و urllib3 يغلق الاتصال المقطوع ولا يعيده للـ pool
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._conn = None
+        self.started_at = None
+        self.finished = False
+        self.aborted = False
+
+    def _attach(self, conn):
+        with self._lock:
+            self._conn = conn
+            abort_now = self.aborted
+        if abort_now:
+            self._shutdown(conn)
+
+    def _finish(self):
+        with self._lock:
+            self.finished = True
+            self._conn = None
+
+    def abort(self):
+        """قطع الطلب إذا لم ينتهِ بعد (أو منعه من البدء)؛ True إذا تم القطع"""
+        with self._lock:
+            if self.finished or self.aborted:
+                return False
+            self.aborted = True
+            conn = self._conn
+        if conn is not None:
+            self._shutdown(conn)
+        return True
+
+    @staticmethod
+    def _shutdown(conn):
+        sock = getattr(conn, "sock", None)
+        if sock is None:
+            return
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+
+@contextmanager
+def abortable_request(handle):
+    """طلبات العميل المشترك داخل هذا السياق (في نفس الـ thread) يمكن قطعها عبر handle.abort()"""
+    if handle.aborted:
+        raise requests.ConnectionError("Request aborted before it was sent")
+    previous = getattr(_active_request, "handle", None)
+    _active_request.handle = handle
+    handle.started_at = time.perf_counter()
+    try:
+        yield handle
+    finally:
+        handle._finish()
+        _active_request.handle = previous
+
+
+class _AbortableConnectionMixin:
+    def request(self, *args, **kwargs):
+        super().request(*args, **kwargs)
+        # الطلب أُرسل: الانتظار التالي (getresponse) هو ما يمكن قطعه
+        handle = getattr(_active_request, "handle", None)
+        if handle is not None:
+            handle._attach(self)
+
+
+class _AbortableHTTPConnection(_AbortableConnectionMixin, HTTPConnection):
+    pass
+
+
+class _AbortableHTTPSConnection(_AbortableConnectionMixin, HTTPSConnection):
+    pass
+
+
+class _AbortableHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _AbortableHTTPConnection
+
+
+class _AbortableHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _AbortableHTTPSConnection
+
+
+class LLMHttpClient:
+    """
+    عميل HTTP مشترك على مستوى العملية لطلبات مزود الـ LLM (OpenRouter)
+    - requests.Session واحدة مع connection pool و keep-alive، فلا يُدفع TCP+TLS handshake في كل جولة
+    - مهلة الاتصال (connect) منفصلة عن مهلة القراءة (read)
+    - الطلب داخل abortable_request يمكن قطعه من thread آخر (انظر AbortableRequest)
+    """
+
+    def __init__(self, pool_connections=4, pool_size=10, connect_timeout=5, read_timeout=30):
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self._adapter = HTTPAdapter(
+            pool_connections=pool_connections,
+            pool_maxsize=pool_size,
+            max_retries=0,  # إعادة المحاولة تتم في call_llm
+            pool_block=False,
+        )
+        self._adapter.poolmanager.pool_classes_by_scheme = {
+            "http": _AbortableHTTPConnectionPool,
+            "https": _AbortableHTTPSConnectionPool,
+        }
+        self._session = requests.Session()
+        self._session.headers.update({"Connection": "keep-alive"})
+        self._session.mount("https://", self._adapter)
+        self._session.mount("http://", self._adapter)
+
+        self._lock = threading.Lock()
+        self.requests_sent = 0
+        self.errors = 0
+        self.aborted = 0
+
+    @property
+    def timeout(self):
+        return (self.connect_timeout, self.read_timeout)
+
+    def post(self, url, headers=None, json=None, timeout=None, **kwargs):
+        with self._lock:
+            self.requests_sent += 1
+        try:
+            return self._session.post(url, headers=headers, json=json, timeout=timeout or self.timeout, **kwargs)
+        except requests.RequestException:
+            handle = getattr(_active_request, "handle", None)
+            with self._lock:
+                if handle is not None and handle.aborted:
+                    self.aborted += 1
+                else:
+                    self.errors += 1
+            raise
+
+    def stats(self):
+        """إحصائيات الـ pool: عدد الاتصالات المفتوحة فعلياً (handshakes) مقابل عدد الطلبات"""
+        pools = []
+        try:
+            container = self._adapter.poolmanager.pools
+            for key in container.keys():
+                pool = container[key]
+                pools.append({
+                    "host": "%s://%s:%s" % (pool.scheme, pool.host, pool.port),
+                    "connections_opened": pool.num_connections,
+                    "requests": pool.num_requests,
+                    "free_slots": pool.pool.qsize() if pool.pool is not None else 0,
+                })
+        except Exception:
+            logger.debug("Could not read connection pool stats", exc_info=True)
+
+        opened = sum(p["connections_opened"] for p in pools)
+        with self._lock:
+            sent, errors, aborted = self.requests_sent, self.errors, self.aborted
+        return {
+            "requests_sent": sent,
+            "errors": errors,
+            "aborted": aborted,
+            "connections_opened": opened,
+            "connection_reuse_rate": round(1 - opened / sent, 4) if sent else None,
+            "connect_timeout": self.connect_timeout,
+            "read_timeout": self.read_timeout,
+            "pools": pools,
+        }
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_llm_http_client():
+    """العميل المشترك للعملية (يُنشأ عند أول استخدام من الإعدادات)"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = LLMHttpClient(
+                    pool_connections=getattr(settings, "AI_HTTP_POOL_CONNECTIONS", 4),
+                    pool_size=getattr(settings, "AI_HTTP_POOL_SIZE", 10),
+                    connect_timeout=getattr(settings, "AI_HTTP_CONNECT_TIMEOUT", 5),
+                    read_timeout=getattr(settings, "AI_HTTP_READ_TIMEOUT", 30),
+                )
+    return _client
+
+
+# عميل httpx.AsyncClient لكل event loop (العميل لا يمكن مشاركته بين loops مختلفة)
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def get_async_llm_http_client():
+    """عميل async مشترك مع connection pool و keep-alive لمسار ASGI"""
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        pool_size = getattr(settings, "AI_HTTP_POOL_SIZE", 10)
+        client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+            timeout=httpx.Timeout(
+                getattr(settings, "AI_HTTP_READ_TIMEOUT", 30),
+                connect=getattr(settings, "AI_HTTP_CONNECT_TIMEOUT", 5),
+            ),
+        )
+        _async_clients[loop] = client
+    return client
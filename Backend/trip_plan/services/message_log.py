@@ -0,0 +1,121 @@
+import threading
+import time
+
+from django.db import transaction
+
+from ..models.travel_model import ConversationMessage, ConversationSession
+from .concurrency import run_in_worker_thread
+from .conversation_history import ConversationHistory
+from .latency import LatencyWindow
+from .tool_result_store import tool_result_store
+
+
+class ConversationMessageLog:
+    """
+    سجل رسائل المحادثة في جدول ConversationMessage (append-only) بدل قائمة state['messages']:
+    - load: قراءة آخر السجل فقط، من أول رسالة لم تدخل الملخص التراكمي (history_summary.upto)؛
+      الرسائل الأقدم ممثلة بالملخص ولا تُقرأ ولا تُرسل
+    - append: إضافة رسائل الدور الجديدة فقط (bulk_create واحد) بدل إعادة كتابة السجل كله في كل دور
+    - state['message_count'] = عدد الرسائل المحفوظة، ويُحفظ مع الحالة في نفس الـ transaction
+    القائمة المحمّلة تحمل موقعها في الجلسة (session._message_offset / session._persisted_count)
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.loads = 0
+        self.loaded_rows = 0
+        self.appends = 0
+        self.appended_rows = 0
+        self.load_ms = LatencyWindow(maxlen=200)
+
+    @staticmethod
+    def persisted_count(session):
+        count = getattr(session, "_persisted_count", None)
+        if count is None:
+            count = (session.state or {}).get("message_count", 0)
+        return count
+
+    @staticmethod
+    def offset(session):
+        """الرقم التسلسلي لأول رسالة في القائمة المحمّلة بـ load"""
+        return getattr(session, "_message_offset", 0)
+
+    def load(self, session):
+        """آخر السجل غير الملخص (قائمة رسائل بنفس شكل الرسائل المرسلة للـ LLM)"""
+        state = session.state or {}
+        count = self.persisted_count(session)
+        summary = state.get(ConversationHistory.STATE_KEY) or {}
+        offset = min(summary.get("upto", 0), count)
+
+        started = time.monotonic()
+        # فهرس (session, seq) الفريد: قراءة نطاق من آخر السجل مهما طالت المحادثة
+        messages = list(
+            ConversationMessage.objects.filter(session=session, seq__gte=offset)
+            .order_by("seq")
+            .values_list("payload", flat=True)
+        )
+        self.load_ms.observe((time.monotonic() - started) * 1000)
+        session._message_offset = offset
+        session._persisted_count = offset + len(messages)
+        with self._lock:
+            self.loads += 1
+            self.loaded_rows += len(messages)
+        return messages
+
+    async def aload(self, session):
+        return await run_in_worker_thread(self.load, session)
+
+    def append(self, session, messages):
+        """
+        حفظ الرسائل الجديدة فقط من messages (القائمة المحمّلة بـ load مع رسائل هذا الدور)
+        يعيد العدد الكلي للرسائل المحفوظة في الجلسة
+        """
+        persisted = self.persisted_count(session)
+        offset = self.offset(session)
+        new_messages = messages[persisted - offset:]
+        if not new_messages:
+            return persisted
+
+        # نتائج الأدوات الكبيرة تُخزن في ToolResultBlob والسجل يحمل مرجعاً وملخصاً فقط
+        new_messages = tool_result_store.offload(new_messages)
+        with transaction.atomic():
+            # قفل صف الجلسة حتى نهاية الـ transaction (save_session_state يحفظ message_count داخلها):
+            # دور متزامن آخر على نفس الجلسة أضاف رسائل بعد load → نكمل بعدها بدل تكرار نفس seq
+            stored = (
+                ConversationSession.objects.select_for_update()
+                .filter(pk=session.pk).values_list("state", flat=True).first()
+            ) or {}
+            start = max(persisted, stored.get("message_count", 0))
+            ConversationMessage.objects.bulk_create([
+                ConversationMessage(session=session, seq=start + index, role=message.get("role") or "", payload=message)
+                for index, message in enumerate(new_messages)
+            ])
+        # القائمة المحمّلة لا تحتوي رسائل الدور الآخر: نزيح offset حتى يبقى الـ append التالي على نفس القائمة صحيحاً
+        session._message_offset = offset + start - persisted
+        session._persisted_count = start + len(new_messages)
+        with self._lock:
+            self.appends += 1
+            self.appended_rows += len(new_messages)
+        return session._persisted_count
+
+    def pop_last(self, session, messages, role="assistant"):
+        """حذف آخر رسالة محفوظة إذا كانت من الدور role (مثلاً رسالة tool_calls معلقة تم إلغاؤها)"""
+        count = self.persisted_count(session)
+        if not count or not messages or messages[-1].get("role") != role:
+            return messages
+        ConversationMessage.objects.filter(session=session, seq=count - 1).delete()
+        session._persisted_count = count - 1
+        return messages[:-1]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "loads": self.loads,
+                "avg_loaded_rows": round(self.loaded_rows / self.loads, 2) if self.loads else None,
+                "appends": self.appends,
+                "appended_rows": self.appended_rows,
+                "load_ms": self.load_ms.snapshot(),
+            }
+
+
+message_log = ConversationMessageLog()
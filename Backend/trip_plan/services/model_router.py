@@ -0,0 +1,109 @@
+import threading
+import time
+
+from django.conf import settings
+
+from .latency import LatencyRegistry
+from .speculative_search import search_args_from_requirements
+
+
+# مراحل المحادثة التي يمكن توجيهها لنماذج مختلفة
+# gather: جمع المتطلبات (أسئلة قصيرة) | plan: عرض الخيارات وتأكيد الخطة | repair: إعادة صياغة JSON تالف
+PHASES = ("gather", "plan", "repair")
+
+
+def phase_for(requirements, messages):
+    """
+    المرحلة الحالية من المحادثة:
+    - plan إذا اكتملت الميزانية/الأيام/الأشخاص أو وصلت نتائج أدوات (القرار النهائي يحتاج النموذج القوي)
+    - gather غير ذلك
+    """
+    if messages and messages[-1].get("role") == "tool":
+        return "plan"
+    if search_args_from_requirements(requirements or {}) is not None:
+        return "plan"
+    return "gather"
+
+
+class ModelRouter:
+    """
+    اختيار النموذج لكل استدعاء LLM حسب مرحلة المحادثة (AI_MODEL_ROUTES) وحالة كل نموذج:
+    - المرشحون بالترتيب من الإعدادات ثم AI_MODEL كخيار أخير دائماً
+    - يُتجاوز المرشح إذا تجاوزت نسبة أخطائه في النافذة AI_ROUTER_MAX_ERROR_RATE
+      أو تجاوز الـ p50 ميزانية زمن المرحلة (AI_ROUTER_LATENCY_BUDGET_MS)
+    - النموذج المتجاوز يُجرب من جديد بعد AI_ROUTER_RETRY_AFTER ثانية بدون قياسات (وإلا لن تتحسن إحصائياته أبداً)
+    """
+
+    def __init__(self):
+        self.latency = LatencyRegistry(maxlen=200)
+        self._lock = threading.Lock()
+        self._decisions = {}
+        self._skipped = {}
+
+    @staticmethod
+    def default_model():
+        return getattr(settings, "AI_MODEL", "arcee-ai/trinity-large-preview:free")
+
+    def candidates(self, phase):
+        routes = getattr(settings, "AI_MODEL_ROUTES", {}) or {}
+        models = [m for m in routes.get(phase) or [] if m]
+        default = self.default_model()
+        if default not in models:
+            models.append(default)
+        return models
+
+    def _is_healthy(self, model, phase):
+        window = self.latency.get(model)
+        if len(window) < getattr(settings, "AI_ROUTER_MIN_SAMPLES", 5):
+            return True
+
+        retry_after = getattr(settings, "AI_ROUTER_RETRY_AFTER", 60)
+        if window.last_observed_at is not None and time.monotonic() - window.last_observed_at > retry_after:
+            return True
+
+        if window.error_rate() > getattr(settings, "AI_ROUTER_MAX_ERROR_RATE", 0.25):
+            return False
+        budget = (getattr(settings, "AI_ROUTER_LATENCY_BUDGET_MS", {}) or {}).get(phase)
+        if budget and window.percentile(50) > budget:
+            return False
+        return True
+
+    def _score(self, model):
+        """للاختيار عندما لا يوجد مرشح سليم: الأقل أخطاءً ثم الأسرع"""
+        window = self.latency.get(model)
+        return (window.error_rate() or 0, window.percentile(50) or 0)
+
+    def choose(self, phase):
+        candidates = self.candidates(phase)
+        chosen = None
+        for model in candidates:
+            if self._is_healthy(model, phase):
+                chosen = model
+                break
+            self._count(self._skipped, phase, model)
+        if chosen is None:
+            chosen = min(candidates, key=self._score)
+        self._count(self._decisions, phase, chosen)
+        return chosen
+
+    def _count(self, bucket, phase, model):
+        with self._lock:
+            per_phase = bucket.setdefault(phase, {})
+            per_phase[model] = per_phase.get(model, 0) + 1
+
+    def observe(self, model, ms, error=False):
+        self.latency.observe(model, ms, error=error)
+
+    def stats(self):
+        with self._lock:
+            decisions = {phase: dict(models) for phase, models in self._decisions.items()}
+            skipped = {phase: dict(models) for phase, models in self._skipped.items()}
+        return {
+            "routes": {phase: self.candidates(phase) for phase in PHASES},
+            "decisions": decisions,
+            "skipped_unhealthy": skipped,
+            "latency_ms": self.latency.snapshot(),
+        }
+
+
+model_router = ModelRouter()
@@ -0,0 +1,67 @@
+import threading
+
+from django.conf import settings
+
+
+# نماذج تحتاج علامة cache_control صريحة لتفعيل prompt caching (OpenAI/DeepSeek وغيرها تخزن الـ prefix تلقائياً)
+DEFAULT_CACHE_CONTROL_PREFIXES = ("anthropic/", "google/gemini")
+
+
+def supports_cache_control(model):
+    prefixes = getattr(settings, "AI_PROMPT_CACHE_CONTROL_PREFIXES", DEFAULT_CACHE_CONTROL_PREFIXES)
+    return bool(model) and any(model.startswith(prefix) for prefix in prefixes or ())
+
+
+def apply_cache_hints(messages, model):
+    """
+    إضافة cache_control على رسالة الـ system الأولى (الـ system prompt الثابت) للنماذج التي تدعمه
+    يعيد قائمة جديدة بدون تعديل الرسائل الأصلية
+    """
+    if not messages or not supports_cache_control(model):
+        return messages
+    first = messages[0]
+    if first.get("role") != "system" or not isinstance(first.get("content"), str):
+        return messages
+    cached_first = {
+        "role": "system",
+        "content": [{"type": "text", "text": first["content"], "cache_control": {"type": "ephemeral"}}],
+    }
+    return [cached_first] + list(messages[1:])
+
+
+class LLMUsageStats:
+    """استهلاك الـ tokens لكل نموذج من حقل usage في ردود المزود، ومنه نسبة الـ tokens المقروءة من الكاش"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._models = {}
+
+    def record(self, model, usage):
+        if not isinstance(usage, dict):
+            return
+        details = usage.get("prompt_tokens_details") or {}
+        cached = details.get("cached_tokens") or 0
+        with self._lock:
+            stats = self._models.setdefault(model, {
+                "calls": 0, "prompt_tokens": 0, "cached_tokens": 0, "completion_tokens": 0, "cost": 0.0,
+            })
+            stats["calls"] += 1
+            stats["prompt_tokens"] += usage.get("prompt_tokens") or 0
+            stats["cached_tokens"] += cached
+            stats["completion_tokens"] += usage.get("completion_tokens") or 0
+            stats["cost"] += usage.get("cost") or 0
+
+    def stats(self):
+        with self._lock:
+            result = {}
+            for model, stats in self._models.items():
+                data = dict(stats)
+                data["cost"] = round(data["cost"], 6)
+                data["cached_ratio"] = (
+                    round(stats["cached_tokens"] / stats["prompt_tokens"], 4) if stats["prompt_tokens"] else None
+                )
+                result[model] = data
+            return result
+
+
+llm_usage = LLMUsageStats()
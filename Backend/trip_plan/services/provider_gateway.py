@@ -0,0 +1,227 @@
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .latency import LatencyWindow
+
+
+PROVIDER_KEY_PREFIX = "trip_plan:provider"
+
+
+class ProviderUnavailable(Exception):
+    """المزود غير متاح حالياً (الدائرة مفتوحة أو الانتظار المطلوب أطول من المسموح)؛ يُرد فوراً بدل الانتظار"""
+
+    def __init__(self, reason, retry_after):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+def parse_retry_after(value):
+    """قيمة ترويسة Retry-After بالثواني (عدد ثوانٍ أو تاريخ HTTP)، أو None"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError, IndexError, OverflowError):
+        return None
+
+
+class ProviderGateway:
+    """
+    بوابة مشتركة بين كل العمليات لطلبات مزود الـ LLM (الحالة في Django cache):
+    - token bucket: معدل AI_PROVIDER_RATE_PER_SEC مع دفعة AI_PROVIDER_BURST؛ الطلب يحجز توكن ويعرف مسبقاً كم ينتظر
+      (عداد توكنات مستهلكة بـ incr ذري مقابل التوكنات المتاحة منذ بداية الـ bucket)
+    - 429 من المزود: يُحترم Retry-After لكل العمليات (لا يرسل أحد قبل انتهائه) بدل sleep محلي في كل thread
+    - circuit breaker: بعد AI_PROVIDER_BREAKER_FAILURES فشل (5xx/timeout/اتصال) خلال AI_PROVIDER_BREAKER_WINDOW ثانية
+      تُفتح الدائرة AI_PROVIDER_BREAKER_COOLDOWN ثانية وتُرفض الطلبات فوراً، ثم يمر طلب تجريبي واحد (half-open)
+    - أي انتظار أطول من AI_PROVIDER_MAX_WAIT ثانية يتحول لرفض فوري (ProviderUnavailable)
+    """
+
+    BUCKET_START_KEY = PROVIDER_KEY_PREFIX + ":bucket_start"
+    BUCKET_USED_KEY = PROVIDER_KEY_PREFIX + ":bucket_used"
+    THROTTLED_UNTIL_KEY = PROVIDER_KEY_PREFIX + ":throttled_until"
+    FAILURES_KEY = PROVIDER_KEY_PREFIX + ":failures"
+    OPEN_UNTIL_KEY = PROVIDER_KEY_PREFIX + ":open_until"
+    PROBE_KEY = PROVIDER_KEY_PREFIX + ":probe"
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.wait_ms = LatencyWindow(maxlen=200)
+        self.reserved = 0
+        self.waited = 0
+        self.rejected = {"circuit_open": 0, "throttled": 0, "rate_limited": 0}
+        self.throttled_responses = 0
+        self.failures = 0
+        self.opened = 0
+
+    def _count(self, attr):
+        with self._lock:
+            setattr(self, attr, getattr(self, attr) + 1)
+
+    @staticmethod
+    def _max_wait():
+        return getattr(settings, "AI_PROVIDER_MAX_WAIT", 10)
+
+    def _reject(self, reason, retry_after):
+        with self._lock:
+            self.rejected[reason] += 1
+        return ProviderUnavailable(reason, max(1, int(round(retry_after))))
+
+    def _check_circuit(self, now):
+        """يرفع ProviderUnavailable إذا كانت الدائرة مفتوحة؛ يعيد True إذا كان هذا هو الطلب التجريبي"""
+        open_until = cache.get(self.OPEN_UNTIL_KEY)
+        if open_until is None:
+            return False
+        if now < open_until:
+            raise self._reject("circuit_open", open_until - now)
+        # half-open: طلب تجريبي واحد فقط من كل العمليات
+        if not cache.add(self.PROBE_KEY, 1, timeout=getattr(settings, "AI_HTTP_READ_TIMEOUT", 30)):
+            raise self._reject("circuit_open", 1)
+        return True
+
+    def _take_token(self, now, max_wait):
+        """حجز توكن من الـ bucket المشترك؛ يعيد مدة الانتظار حتى يصبح التوكن متاحاً"""
+        rate = getattr(settings, "AI_PROVIDER_RATE_PER_SEC", 10)
+        if not rate or rate <= 0:
+            return 0.0
+        burst = max(1, getattr(settings, "AI_PROVIDER_BURST", 20))
+
+        cache.add(self.BUCKET_START_KEY, now, timeout=None)
+        start = cache.get(self.BUCKET_START_KEY, now)
+        try:
+            used = cache.incr(self.BUCKET_USED_KEY)
+        except ValueError:
+            cache.add(self.BUCKET_USED_KEY, 0, timeout=None)
+            used = cache.incr(self.BUCKET_USED_KEY)
+
+        allowed = burst + rate * (now - start)
+        if allowed - used > burst:
+            # bucket ممتلئ بعد فترة هدوء: التوكنات الزائدة عن الدفعة لا تتراكم
+            cache.incr(self.BUCKET_USED_KEY, int(allowed - used - burst))
+            return 0.0
+        if used <= allowed:
+            return 0.0
+
+        delay = (used - allowed) / rate
+        if delay > max_wait:
+            cache.decr(self.BUCKET_USED_KEY)
+            raise self._reject("rate_limited", delay)
+        return delay
+
+    def reserve(self, max_wait=None):
+        """
+        يُستدعى قبل كل محاولة إرسال: يعيد عدد الثواني التي يجب انتظارها قبل الإرسال (0 = فوراً)
+        أو يرفع ProviderUnavailable إذا كانت الدائرة مفتوحة أو الانتظار أطول من max_wait (افتراضياً AI_PROVIDER_MAX_WAIT)
+        """
+        if max_wait is None:
+            max_wait = self._max_wait()
+        now = time.time()
+        probe = self._check_circuit(now)
+
+        try:
+            delay = 0.0
+            throttled_until = cache.get(self.THROTTLED_UNTIL_KEY)
+            if throttled_until is not None and throttled_until > now:
+                delay = throttled_until - now
+                if delay > max_wait:
+                    raise self._reject("throttled", delay)
+            delay = max(delay, self._take_token(now, max_wait))
+        except ProviderUnavailable:
+            if probe:
+                self._release_probe()
+            raise
+
+        self._count("reserved")
+        if delay > 0:
+            self._count("waited")
+            self.wait_ms.observe(delay * 1000)
+        return delay
+
+    @staticmethod
+    def backoff(attempt):
+        """exponential backoff مع full jitter لإعادة المحاولة بعد timeout/429 بدون Retry-After"""
+        base = getattr(settings, "AI_PROVIDER_BACKOFF_BASE", 0.5)
+        cap = getattr(settings, "AI_PROVIDER_BACKOFF_MAX", 8)
+        return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+    def record_response(self, status_code, retry_after=None, attempt=0):
+        """تسجيل رد المزود: 429 يوقف الإرسال من كل العمليات حتى Retry-After، و 5xx فشل للـ breaker"""
+        if status_code == 429:
+            self._count("throttled_responses")
+            seconds = parse_retry_after(retry_after)
+            if seconds is None:
+                seconds = self.backoff(attempt)
+            until = time.time() + seconds
+            current = cache.get(self.THROTTLED_UNTIL_KEY)
+            if current is None or current < until:
+                cache.set(self.THROTTLED_UNTIL_KEY, until, timeout=int(seconds) + 1)
+            self._release_probe()
+        elif status_code >= 500:
+            self.record_failure()
+        else:
+            self._close_circuit()
+
+    def record_failure(self):
+        """فشل لا يدل على خطأ في الطلب نفسه (5xx، timeout، خطأ اتصال)"""
+        self._count("failures")
+        now = time.time()
+        cooldown = getattr(settings, "AI_PROVIDER_BREAKER_COOLDOWN", 30)
+
+        if cache.get(self.OPEN_UNTIL_KEY) is not None:
+            # فشل الطلب التجريبي (half-open): إعادة فتح الدائرة
+            cache.set(self.OPEN_UNTIL_KEY, now + cooldown, timeout=None)
+            cache.delete(self.PROBE_KEY)
+            return
+
+        window = getattr(settings, "AI_PROVIDER_BREAKER_WINDOW", 30)
+        try:
+            failures = cache.incr(self.FAILURES_KEY)
+        except ValueError:
+            cache.add(self.FAILURES_KEY, 0, timeout=window)
+            failures = cache.incr(self.FAILURES_KEY)
+        if failures >= getattr(settings, "AI_PROVIDER_BREAKER_FAILURES", 5):
+            cache.set(self.OPEN_UNTIL_KEY, now + cooldown, timeout=None)
+            cache.delete(self.FAILURES_KEY)
+            self._count("opened")
+
+    def _close_circuit(self):
+        if cache.get(self.OPEN_UNTIL_KEY) is not None:
+            cache.delete_many([self.OPEN_UNTIL_KEY, self.PROBE_KEY, self.FAILURES_KEY])
+
+    def _release_probe(self):
+        cache.delete(self.PROBE_KEY)
+
+    def state(self):
+        open_until = cache.get(self.OPEN_UNTIL_KEY)
+        if open_until is None:
+            return "closed"
+        return "open" if time.time() < open_until else "half_open"
+
+    def stats(self):
+        with self._lock:
+            data = {
+                "circuit": self.state(),
+                "recent_failures": cache.get(self.FAILURES_KEY, 0),
+                "reserved": self.reserved,
+                "waited": self.waited,
+                "rejected": dict(self.rejected),
+                "throttled_responses": self.throttled_responses,
+                "failures": self.failures,
+                "opened": self.opened,
+            }
+        throttled_until = cache.get(self.THROTTLED_UNTIL_KEY)
+        data["throttled_for_s"] = round(max(0.0, throttled_until - time.time()), 2) if throttled_until else 0
+        data["wait_ms"] = self.wait_ms.snapshot()
+        return data
+
+
+provider_gateway = ProviderGateway()
@@ -0,0 +1,256 @@
+import re
+import threading
+
+
+# الحقول الأساسية بنفس ترتيب الأسئلة في الـ system prompt
+REQUIRED_FIELDS = ("budget", "days", "people", "is_coastal", "min_stars")
+
+# سؤال واحد لكل حقل ناقص + كلمات تدل على أن السؤال طُرح سابقاً في رد للمساعد
+FIELD_QUESTIONS = {
+    "budget": "ما هي ميزانيتك الإجمالية للرحلة بالدولار؟",
+    "days": "كم يوماً تريد أن تستغرق الرحلة؟",
+    "people": "كم شخصاً سيسافر؟",
+    "is_coastal": "هل تفضل وجهة ساحلية أم جبلية أم لا يهم؟",
+    "min_stars": "ما هو الحد الأدنى لعدد نجوم الفندق الذي تفضله (من 1 إلى 5)؟",
+}
+FIELD_HINTS = {
+    "budget": ("ميزاني",),
+    "days": ("يوم", "ايام", "مده"),
+    "people": ("شخص", "اشخاص", "مسافر"),
+    "is_coastal": ("ساحلي", "جبلي"),
+    "min_stars": ("نجوم", "نجمه"),
+}
+
+# حدود منطقية للقيم؛ ما خارجها يُترك للـ LLM (مثل ميزانية صفر)
+VALID_RANGES = {
+    "budget": (50, 10_000_000),
+    "days": (1, 90),
+    "people": (1, 50),
+    "min_stars": (1, 5),
+}
+
+_DIGITS = str.maketrans("٠١٢٣٤٥٦٧٨٩۰۱۲۳۴۵۶۷۸۹", "0123456789" * 2)
+_DIACRITICS = re.compile(r"[ً-ْـ]")  # التشكيل والتطويل
+
+_WORD_NUMBERS = {
+    "واحد": 1, "واحده": 1, "اثنين": 2, "اثنان": 2, "ثلاث": 3, "ثلاثه": 3, "اربع": 4, "اربعه": 4,
+    "خمس": 5, "خمسه": 5, "ست": 6, "سته": 6, "سبع": 7, "سبعه": 7, "ثمان": 8, "ثمانيه": 8,
+    "تسع": 9, "تسعه": 9, "عشر": 10, "عشره": 10,
+}
+_WORD_NUMBER_RE = re.compile(
+    r"(?<!\w)([وبل]?)(%s)(?!\w)" % "|".join(sorted(_WORD_NUMBERS, key=len, reverse=True))
+)
+
+_NUM = r"(\d+(?:\.\d+)?)\s*(k|الف|الاف)?"
+_CURRENCY = r"(?:\$|دولار\w*|usd|dollars?)"
+
+_PATTERNS = {
+    "budget": [
+        re.compile(_NUM + r"\s*" + _CURRENCY),
+        re.compile(r"(?<![\d\s])\s*(?:\$|usd)\s*" + _NUM),
+        re.compile(r"(?:[وبل]?ال)?ميزاني\w*\D{0,15}?" + _NUM),
+    ],
+    "days": [re.compile(_NUM + r"\s*(?:ايام|يوما|يوم|ليال\w*|ليله)(?!\w)")],
+    "people": [re.compile(_NUM + r"\s*(?:اشخاص|شخص|افراد|فرد|مسافر\w*)(?!\w)")],
+    "min_stars": [re.compile(_NUM + r"\s*(?:نجوم|نجمات|نجمه|نجم)(?!\w)")],
+}
+
+# تعابير بدون أرقام: (النمط, الحقل, القيمة)
+_FIXED_PHRASES = [
+    (re.compile(r"(?<!\w)[بل]?(?:يومين|ليلتين)(?!\w)"), "days", 2),
+    (re.compile(r"(?<!\w)[بل]?اسبوعين(?!\w)"), "days", 14),
+    (re.compile(r"(?<!\w)[بل]?اسبوع(?!\w)"), "days", 7),
+    (re.compile(r"(?<!\w)[بل]?(?:شخصين|فردين|زوجين)(?!\w)"), "people", 2),
+    (re.compile(r"(?<!\w)(?:لوحدي|وحدي|بمفردي)(?!\w)"), "people", 1),
+]
+
+# الحقول التي يُقبل فيها "لا يهم" كجواب (None = بدون تفضيل)
+_INDIFFERENT_FIELDS = ("is_coastal", "min_stars")
+_INDIFFERENT = re.compile(r"(?:لا|ما|مش)\s+(?:يهم|فرق|بتفرق|مهم)|اي\s+مكان|اي\s+شي")
+_NEGATED_PLACE = re.compile(r"(?:لا|ليس|ليست|مش|غير|بدون|ما)\s+(?:ساحل|جبل|بحر|شاطئ|شواطئ)")
+_COASTAL = re.compile(r"ساحل\w*|شاطئ\w*|شواطئ|بحر\w*")
+_MOUNTAIN = re.compile(r"جبل\w*|جبال")
+
+# كلمات لا تحمل معلومة إضافية؛ أي كلمة أخرى في الرسالة تعني أن الطلب يحتاج فهم الـ LLM
+_FILLER_WORDS = frozenset("""
+اريد نريد بدي بدنا ابغى ابي حاب حابب اود نود رحله رحلات لمده مده المده حوالي تقريبا تقريبي
+ميزانيه ميزانيتي ميزانيتنا الميزانيه و مع الى في على من عن انا نحن احنا عندي عندنا لدي لدينا
+سفر السفر للسفر نسافر اسافر فندق الفندق وجهه الوجهه مكان منطقه مرحبا اهلا السلام عليكم شكرا
+تمام حسنا طيب ممكن لو سمحت ok okay نعم اي ايوه فقط بس يكون تكون مستوى الحد الادنى ادنى اقل
+عدد سياحيه سياحي الكل المجموع اجمالي الاجماليه كحد اقصى دولار الدولار بالدولار
+""".split())
+# الأرقام تدخل في الفحص: رقم لم يُستخدم (عدد أشخاص بلا وحدة، بداية نطاق "من 2000 الى 3000") معلومة ضائعة
+_TOKEN_RE = re.compile(r"[^\W_]+")
+# حروف العطف/الجر الملتصقة وأداة التعريف: "والميزانيه" و "بالفندق" و "للسفر" حشو مثل أصلها
+_PREFIX_RE = re.compile(r"^[وفبلك]?(?:ال|لل)?")
+
+
+def normalize_text(text):
+    """توحيد النص العربي: الأرقام الهندية، أشكال الألف والياء والتاء المربوطة، حذف التشكيل"""
+    text = (text or "").translate(_DIGITS).lower()
+    text = _DIACRITICS.sub("", text)
+    text = text.replace("٬", "").replace("٫", ".")
+    text = re.sub(r"(?<=\d),(?=\d{3}(?!\d))", "", text)
+    text = re.sub("[أإآ]", "ا", text).replace("ى", "ي").replace("ة", "ه")
+    return _WORD_NUMBER_RE.sub(lambda m: "%s %d" % (m.group(1), _WORD_NUMBERS[m.group(2)]), text)
+
+
+def _is_filler(token):
+    if any(char.isdigit() for char in token):
+        return False
+    if len(token) <= 1 or token in _FILLER_WORDS or token.lstrip("وبلف") in _FILLER_WORDS:
+        return True
+    bare = _PREFIX_RE.sub("", token, count=1)
+    return len(bare) <= 1 or bare in _FILLER_WORDS
+
+
+def _to_number(digits, multiplier):
+    value = float(digits)
+    if multiplier:
+        value *= 1000
+    return int(value) if value.is_integer() else value
+
+
+def extract_requirements(text, awaiting_field=None):
+    """
+    استخراج المتطلبات من رسالة المستخدم بقواعد محلية
+    Returns:
+        (values, unambiguous): القيم المستخرجة، و True إذا كانت الرسالة لا تحتوي شيئاً غير مفهوم أو متعارض
+    """
+    normalized = normalize_text(text)
+    found = {}
+    spans = []
+    conflict = False
+
+    def add(field, value, span):
+        nonlocal conflict
+        if field in found and found[field] != value:
+            conflict = True
+        found[field] = value
+        spans.append(span)
+
+    for field, patterns in _PATTERNS.items():
+        for pattern in patterns:
+            for match in pattern.finditer(normalized):
+                add(field, _to_number(match.group(1), match.group(2)), match.span())
+
+    for pattern, field, value in _FIXED_PHRASES:
+        for match in pattern.finditer(normalized):
+            if not any(s <= match.start() < e for s, e in spans):
+                add(field, value, match.span())
+
+    # تفضيل الوجهة
+    if _NEGATED_PLACE.search(normalized):
+        conflict = True
+    indifferent = _INDIFFERENT.search(normalized)
+    coastal = list(_COASTAL.finditer(normalized))
+    mountain = list(_MOUNTAIN.finditer(normalized))
+    if indifferent:
+        # "لا يهم" جواب على السؤال المعلّق إن وُجد، وإلا فهو عن نوع الوجهة (السؤال الوحيد الذي يعرضه كخيار)
+        target = awaiting_field or "is_coastal"
+        if target in _INDIFFERENT_FIELDS:
+            add(target, None, indifferent.span())
+        else:
+            conflict = True
+    if coastal:
+        add("is_coastal", True, coastal[0].span())
+    if mountain:
+        add("is_coastal", False, mountain[0].span())
+    spans.extend(m.span() for m in coastal[1:] + mountain[1:])
+
+    # رقم وحيد بدون وحدة = جواب على السؤال المعلّق (مثل "5" بعد "كم يوماً؟")
+    bare = re.fullmatch(r"\s*" + _NUM + r"\s*", normalized)
+    if bare and not found and awaiting_field in VALID_RANGES:
+        add(awaiting_field, _to_number(bare.group(1), bare.group(2)), bare.span())
+
+    for field, (low, high) in VALID_RANGES.items():
+        if found.get(field) is not None and not (low <= found[field] <= high):
+            conflict = True
+    if found.get("min_stars") is not None and not float(found["min_stars"]).is_integer():
+        conflict = True
+
+    # ما تبقى من الرسالة بعد حذف المقاطع المفهومة يجب أن يكون كلمات حشو فقط (بدون أرقام)
+    residual = list(normalized)
+    for start, end in spans:
+        residual[start:end] = " " * (end - start)
+    leftovers = [token for token in _TOKEN_RE.findall("".join(residual)) if not _is_filler(token)]
+    unambiguous = bool(found) and not conflict and not leftovers and "?" not in text and "؟" not in text
+    return found, unambiguous
+
+
+class RequirementsFastPath:
+    """
+    مسار سريع قبل استدعاء الـ LLM في مرحلة جمع المتطلبات:
+    إذا كانت رسالة المستخدم مفهومة بالكامل بالقواعد المحلية تُدمج قيمها في requirements،
+    وإذا بقي حقل ناقص لم يُسأل عنه سابقاً يُعاد سؤاله مباشرة بدون رحلة للمزود
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.answered = 0       # ردود gather_info محلية
+        self.merged_only = 0    # قيم مدمجة ثم متابعة للـ LLM (المتطلبات اكتملت)
+        self.fallthrough = 0    # رسالة غير مفهومة بالكامل → الـ LLM
+
+    @staticmethod
+    def missing_fields(requirements):
+        return [field for field in REQUIRED_FIELDS if field not in requirements]
+
+    @staticmethod
+    def _already_asked(field, messages):
+        hints = FIELD_HINTS[field]
+        for message in messages:
+            if message.get("role") == "assistant" and isinstance(message.get("content"), str):
+                content = normalize_text(message["content"])
+                if any(hint in content for hint in hints):
+                    return True
+        return False
+
+    def _count(self, attr):
+        with self._lock:
+            setattr(self, attr, getattr(self, attr) + 1)
+
+    def process(self, requirements, messages, user_input, awaiting_field=None):
+        """
+        يحدّث requirements عند استخراج قيم بشكل مؤكد
+        Returns:
+            (الحقل المسؤول عنه, نص السؤال) إذا أمكن الرد محلياً، وإلا None
+        """
+        if not self.missing_fields(requirements):
+            return None
+
+        values, unambiguous = extract_requirements(user_input, awaiting_field)
+        if not unambiguous:
+            self._count("fallthrough")
+            return None
+
+        # "لا يهم" (None) لا يمسح تفضيلاً ذكره المستخدم سابقاً
+        values = {
+            field: value for field, value in values.items()
+            if value is not None or requirements.get(field) is None
+        }
+        if not values:
+            self._count("fallthrough")
+            return None
+
+        requirements.update(values)
+        missing = self.missing_fields(requirements)
+        # messages[:-1]: بدون رسالة المستخدم الحالية
+        if not missing or self._already_asked(missing[0], messages[:-1]):
+            self._count("merged_only")
+            return None
+
+        self._count("answered")
+        return missing[0], FIELD_QUESTIONS[missing[0]]
+
+    def stats(self):
+        with self._lock:
+            total = self.answered + self.merged_only + self.fallthrough
+            return {
+                "answered_locally": self.answered,
+                "merged_then_llm": self.merged_only,
+                "fallthrough": self.fallthrough,
+                "local_answer_rate": round(self.answered / total, 4) if total else None,
+            }
+
+
+requirements_fast_path = RequirementsFastPath()
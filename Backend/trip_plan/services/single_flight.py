@@ -0,0 +1,134 @@
+import asyncio
+import copy
+import threading
+
+
+class _Call:
+    __slots__ = ("event", "result", "error", "waiters")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    دمج الطلبات المتطابقة الجارية في نفس الوقت داخل العملية (single-flight):
+    أول طلب بمفتاح معين ينفذ العمل، والطلبات المتطابقة التي تصل أثناء تنفيذه تنتظر نفس النتيجة
+    بدل تكرار استدعاء المزود أو الاستعلام. لا يخزن شيئاً بعد انتهاء التنفيذ (هذا دور الكاش)
+    copy_result: نسخة مستقلة من النتيجة لكل منتظر (عندما قد يعدلها المستدعي)
+    """
+
+    def __init__(self, copy_result=True):
+        self.copy_result = copy_result
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.leaders = 0
+        self.shared = 0
+
+    def do(self, key, fn):
+        """يعيد (النتيجة, هل كانت مشتركة من طلب آخر)؛ الاستثناء في التنفيذ يصل لكل المنتظرين"""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.leaders += 1
+            else:
+                call.waiters += 1
+                self.shared += 1
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return (copy.deepcopy(call.result) if self.copy_result else call.result), True
+
+        try:
+            call.result = fn()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.event.set()
+        return call.result, False
+
+    def stats(self):
+        with self._lock:
+            total = self.leaders + self.shared
+            return {
+                "executed": self.leaders,
+                "shared": self.shared,
+                "in_flight": len(self._calls),
+                "shared_rate": round(self.shared / total, 4) if total else None,
+            }
+
+
+class AsyncSingleFlight:
+    """نسخة asyncio من SingleFlight (المفتاح مرتبط بالـ event loop الحالي)"""
+
+    def __init__(self, copy_result=True):
+        self.copy_result = copy_result
+        self._lock = threading.Lock()
+        self._futures = {}
+        self.leaders = 0
+        self.shared = 0
+
+    async def do(self, key, coro_fn):
+        loop = asyncio.get_running_loop()
+        loop_key = (id(loop), key)
+        with self._lock:
+            future = self._futures.get(loop_key)
+            leader = future is None
+            if leader:
+                future = self._futures[loop_key] = loop.create_future()
+                self.leaders += 1
+            else:
+                self.shared += 1
+
+        if not leader:
+            try:
+                result = await asyncio.shield(future)
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    raise
+                # الطلب القائد أُلغي (انقطع اتصال صاحبه): ننفذ العمل بأنفسنا
+                return await coro_fn(), False
+            return (copy.deepcopy(result) if self.copy_result else result), True
+
+        try:
+            result = await coro_fn()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # تجنب تحذير "exception was never retrieved" عندما لا يوجد منتظرون
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result, False
+        finally:
+            with self._lock:
+                self._futures.pop(loop_key, None)
+
+    def stats(self):
+        with self._lock:
+            total = self.leaders + self.shared
+            return {
+                "executed": self.leaders,
+                "shared": self.shared,
+                "in_flight": len(self._futures),
+                "shared_rate": round(self.shared / total, 4) if total else None,
+            }
+
+
+# استدعاءات الـ LLM المتطابقة (المفتاح = مفتاح كاش الردود) ونتائج الأدوات (المفتاح = مفتاح كاش الأدوات)
+llm_flight = SingleFlight()
+async_llm_flight = AsyncSingleFlight()
+tool_flight = SingleFlight(copy_result=False)
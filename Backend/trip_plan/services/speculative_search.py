@@ -0,0 +1,110 @@
+import json
+import threading
+import uuid
+
+from .tool_cache import normalize_tool_arguments
+
+
+SEARCH_TOOL = "search_destinations_and_hotels"
+
+# آخر وسائط بحث استباقي استفاد منها النموذج في الجلسة (لا نعيد نفس البحث في كل دور)
+STATE_KEY = "last_search_args"
+
+REQUIRED_KEYS = ("budget", "days", "people")
+SEARCH_REQUIREMENT_KEYS = ("budget", "days", "people", "is_coastal", "min_stars", "season", "is_sea_view")
+
+# وسائط العرض/الترقيم لا تغير نية البحث عند مقارنة نداء النموذج بالنداء الاستباقي
+_PAGING_KEYS = ("limit", "offset", "fields")
+
+
+def search_args_from_requirements(requirements):
+    """وسائط أداة البحث من collected_requirements، أو None إذا لم تكتمل الميزانية/الأيام/الأشخاص"""
+    if any(requirements.get(key) in (None, "") for key in REQUIRED_KEYS):
+        return None
+    return {key: requirements[key] for key in SEARCH_REQUIREMENT_KEYS if requirements.get(key) is not None}
+
+
+class SpeculativeSearch:
+    """
+    بحث استباقي على الخادم: عندما تكتمل المتطلبات الأساسية نعرف أن النموذج سيستدعي أداة البحث،
+    فننفذها قبل أول استدعاء للـ LLM ونضيف النتيجة كرسالة tool (بدل جولة LLM كاملة لإنتاج النداء فقط)
+    ويُسجل ما فعله النموذج بعدها لمعرفة مدى تطابق التوقع
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.issued = 0
+        self.skipped_same_args = 0
+        self.model_used_results = 0      # النموذج أجاب مباشرة (وفرنا جولة)
+        self.model_same_call = 0         # النموذج طلب نفس البحث مرة أخرى
+        self.model_different_call = 0    # النموذج طلب بحثاً بوسائط مختلفة
+
+    def _count(self, attr):
+        with self._lock:
+            setattr(self, attr, getattr(self, attr) + 1)
+
+    @staticmethod
+    def _normalized(func, arguments):
+        arguments = {k: v for k, v in arguments.items() if k not in _PAGING_KEYS}
+        try:
+            return normalize_tool_arguments(func, arguments)
+        except TypeError:
+            return None
+
+    def plan(self, state, requirements, func):
+        """يعيد tool_call جاهزاً للتنفيذ، أو None إذا لم تكتمل المتطلبات أو تم نفس البحث سابقاً"""
+        arguments = search_args_from_requirements(requirements)
+        if arguments is None:
+            return None
+
+        normalized = self._normalized(func, arguments)
+        if normalized is None:
+            return None
+        if state.get(STATE_KEY) == normalized:
+            self._count("skipped_same_args")
+            return None
+
+        self._count("issued")
+        return {
+            "id": f"spec_{uuid.uuid4().hex[:12]}",
+            "type": "function",
+            "function": {"name": SEARCH_TOOL, "arguments": json.dumps(arguments, ensure_ascii=False)},
+        }
+
+    def record_outcome(self, state, func, speculative_call, tool_calls):
+        """
+        مقارنة tool_calls التي طلبها النموذج بعد رؤية النتائج مع النداء الاستباقي
+        state[STATE_KEY] يُحدّث فقط إذا استفاد النموذج من النتائج (لم يطلب بحثاً بوسائط أخرى)
+        """
+        expected = self._normalized(func, json.loads(speculative_call["function"]["arguments"]))
+        searches = [tc for tc in tool_calls or [] if (tc.get("function") or {}).get("name") == SEARCH_TOOL]
+        if not searches:
+            state[STATE_KEY] = expected
+            self._count("model_used_results")
+            return
+
+        for tc in searches:
+            try:
+                arguments = json.loads(tc["function"].get("arguments") or "{}")
+            except (TypeError, ValueError):
+                arguments = None
+            if isinstance(arguments, dict) and self._normalized(func, arguments) == expected:
+                state[STATE_KEY] = expected
+                self._count("model_same_call")
+                return
+        self._count("model_different_call")
+
+    def stats(self):
+        with self._lock:
+            outcomes = self.model_used_results + self.model_same_call + self.model_different_call
+            return {
+                "issued": self.issued,
+                "skipped_same_args": self.skipped_same_args,
+                "model_used_results": self.model_used_results,
+                "model_same_call": self.model_same_call,
+                "model_different_call": self.model_different_call,
+                "rounds_saved_rate": round(self.model_used_results / outcomes, 4) if outcomes else None,
+            }
+
+
+speculative_search = SpeculativeSearch()
@@ -0,0 +1,146 @@
+class TrailingJSONStreamParser:
+    """
+    محلل تدريجي (state machine خطي) لرد الـ LLM أثناء الـ streaming
+    الرد المتوقع: نص عربي حر ثم كائن JSON في النهاية. المحلل يفصل بينهما أثناء وصول الأجزاء:
+    - النص قبل الـ JSON يُعاد كـ prose (بدون علامات ``` أو مقاطع <tool_call>)
+    - قيمة حقل "message" داخل الـ JSON تُعاد حرفاً بحرف بعد فك الـ escapes
+    التحليل النهائي للـ JSON يتم على النص الكامل بعد انتهاء الـ stream
+    """
+
+    TOOL_CALL_OPEN = "<tool_call>"
+    TOOL_CALL_CLOSE = "</tool_call>"
+    STREAMED_KEY = "message"
+
+    _ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+
+    def __init__(self):
+        self.text_parts = []
+        self.json_complete = False
+        self._mode = "prose"      # prose | fence | tag | tool_call | json
+        self._tag = ""
+        # حالة الـ JSON
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._unicode = None
+        self._expect_key = False
+        self._key_chars = None
+        self._last_key = None
+        self._value_pending = False
+        self._streaming_value = False
+
+    @property
+    def text(self):
+        return "".join(self.text_parts)
+
+    def feed(self, chunk):
+        """يعيد (prose, message_text) الجديدين في هذا الجزء"""
+        self.text_parts.append(chunk)
+        prose = []
+        message = []
+        for ch in chunk:
+            mode = self._mode
+            if mode == "prose":
+                if ch == "{":
+                    self._start_json()
+                elif ch == "`":
+                    self._mode = "fence"
+                elif ch == "<":
+                    self._mode = "tag"
+                    self._tag = ch
+                else:
+                    prose.append(ch)
+            elif mode == "fence":
+                # تجاهل ``` واسم اللغة بعدها (مثل ```json) حتى نهاية السطر
+                if ch == "{":
+                    self._start_json()
+                elif ch == "\n":
+                    self._mode = "prose"
+            elif mode == "tag":
+                self._tag += ch
+                if self._tag == self.TOOL_CALL_OPEN:
+                    self._mode = "tool_call"
+                    self._tag = ""
+                elif not self.TOOL_CALL_OPEN.startswith(self._tag):
+                    prose.append(self._tag)
+                    self._tag = ""
+                    self._mode = "prose"
+            elif mode == "tool_call":
+                self._tag = (self._tag + ch)[-len(self.TOOL_CALL_CLOSE):]
+                if self._tag == self.TOOL_CALL_CLOSE:
+                    self._tag = ""
+                    self._mode = "prose"
+            else:
+                self._feed_json_char(ch, message)
+        return "".join(prose), "".join(message)
+
+    def _start_json(self):
+        self._mode = "json"
+        self._depth = 1
+        self._in_string = False
+        self._escape = False
+        self._unicode = None
+        self._expect_key = True
+        self._key_chars = None
+        self._last_key = None
+        self._value_pending = False
+        self._streaming_value = False
+
+    def _feed_json_char(self, ch, message):
+        if self._in_string:
+            if self._unicode is not None:
+                self._unicode += ch
+                if len(self._unicode) == 4:
+                    try:
+                        decoded = chr(int(self._unicode, 16))
+                    except ValueError:
+                        decoded = ""
+                    self._emit_string_char(decoded, message)
+                    self._unicode = None
+            elif self._escape:
+                self._escape = False
+                if ch == "u":
+                    self._unicode = ""
+                else:
+                    self._emit_string_char(self._ESCAPES.get(ch, ch), message)
+            elif ch == "\\":
+                self._escape = True
+            elif ch == '"':
+                self._in_string = False
+                if self._key_chars is not None:
+                    self._last_key = "".join(self._key_chars)
+                    self._key_chars = None
+                self._streaming_value = False
+            else:
+                self._emit_string_char(ch, message)
+            return
+
+        if ch == '"':
+            self._in_string = True
+            if self._depth == 1 and self._expect_key:
+                self._key_chars = []
+                self._expect_key = False
+            elif self._depth == 1 and self._value_pending:
+                self._streaming_value = self._last_key == self.STREAMED_KEY
+            self._value_pending = False
+        elif ch in "{[":
+            self._depth += 1
+            self._value_pending = False
+        elif ch in "}]":
+            self._depth -= 1
+            if self._depth == 0:
+                self.json_complete = True
+                self._mode = "prose"
+        elif ch == ":" and self._depth == 1:
+            self._value_pending = True
+        elif ch == "," and self._depth == 1:
+            self._expect_key = True
+            self._value_pending = False
+        elif not ch.isspace():
+            self._value_pending = False
+
+    def _emit_string_char(self, ch, message):
+        if self._key_chars is not None:
+            self._key_chars.append(ch)
+        elif self._streaming_value:
+            message.append(ch)
@@ -0,0 +1,205 @@
+import copy
+import json
+import logging
+import threading
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework import serializers
+
+from ..serializers.ai_serializer import AIStructuredResponseSerializer
+
+
+logger = logging.getLogger(__name__)
+
+
+# أوضاع الـ structured output من الأقوى للأضعف؛ عند رفض المزود ننزل للوضع التالي
+MODES = ("json_schema", "json_object", "none")
+
+# الحالات التي يولدها النموذج نفسه (الباقي يضيفه الخادم: error, text_response, searching...)
+MODEL_STATUSES = ("gather_info", "no_options", "options_presented", "plan_confirmed")
+
+# حقول يحقنها الخادم ولا يجب أن يولدها النموذج
+SERVER_FIELDS = ("visual_data",)
+
+COLLECTED_REQUIREMENTS_SCHEMA = {
+    "type": "object",
+    "description": "المتطلبات المعروفة حتى الآن",
+    "properties": {
+        "budget": {"type": ["number", "null"]},
+        "days": {"type": ["integer", "null"]},
+        "people": {"type": ["integer", "null"]},
+        "is_coastal": {"type": ["boolean", "null"]},
+        "min_stars": {"type": ["integer", "null"]},
+        "season": {"type": ["string", "null"]},
+        "is_sea_view": {"type": ["boolean", "null"]},
+    },
+}
+
+CAPABILITY_CACHE_PREFIX = "trip_plan:llm_caps:"
+CAPABILITY_CACHE_TTL = 24 * 3600
+
+
+def field_json_schema(field):
+    """تحويل حقل DRF إلى JSON schema (الأنواع المستخدمة في serializers الـ AI فقط)"""
+    if isinstance(field, serializers.ListSerializer):
+        schema = {"type": "array", "items": field_json_schema(field.child)}
+    elif isinstance(field, serializers.Serializer):
+        properties = {}
+        required = []
+        for name, child in field.fields.items():
+            if child.read_only:
+                continue
+            properties[name] = field_json_schema(child)
+            if child.required:
+                required.append(name)
+        schema = {"type": "object", "properties": properties}
+        if required:
+            schema["required"] = required
+    elif isinstance(field, serializers.ChoiceField):
+        schema = {"type": "string", "enum": list(field.choices)}
+    elif isinstance(field, serializers.BooleanField):
+        schema = {"type": "boolean"}
+    elif isinstance(field, serializers.IntegerField):
+        schema = {"type": "integer"}
+    elif isinstance(field, (serializers.FloatField, serializers.DecimalField)):
+        schema = {"type": "number"}
+    elif isinstance(field, serializers.ListField):
+        schema = {"type": "array", "items": field_json_schema(field.child)}
+    elif isinstance(field, serializers.DictField):
+        schema = {"type": "object"}
+    elif isinstance(field, serializers.CharField):
+        schema = {"type": "string"}
+    else:
+        schema = {}
+
+    if field.help_text:
+        schema["description"] = str(field.help_text)
+    return schema
+
+
+@lru_cache(maxsize=1)
+def response_json_schema():
+    """JSON schema لرد النموذج مشتق من AIStructuredResponseSerializer + collected_requirements"""
+    schema = field_json_schema(AIStructuredResponseSerializer())
+    for name in SERVER_FIELDS:
+        schema["properties"].pop(name, None)
+
+    status = schema["properties"]["status"]
+    status["enum"] = [s for s in status["enum"] if s in MODEL_STATUSES]
+
+    schema["properties"]["collected_requirements"] = COLLECTED_REQUIREMENTS_SCHEMA
+    schema["required"] = ["status", "message", "collected_requirements"]
+    return schema
+
+
+def response_format_for(mode):
+    if mode == "json_schema":
+        return {
+            "type": "json_schema",
+            "json_schema": {
+                "name": "travel_agent_response",
+                # strict يتطلب أن تكون كل الحقول required، وحقولنا اختيارية حسب الحالة
+                "strict": False,
+                "schema": response_json_schema(),
+            },
+        }
+    if mode == "json_object":
+        return {"type": "json_object"}
+    return None
+
+
+# أكواد الحالة التي قد يرفض بها المزود response_format
+REJECTION_STATUSES = (400, 404, 422)
+
+# نصوص تدل على رفض response_format تحديداً (خطأ 400 آخر يذكر "parameter" لا يعني أن النموذج لا يدعمه)
+_REJECTION_HINTS = ("response_format", "json_schema", "json_object", "structured output", "structured_output")
+# OpenRouter مع provider.require_parameters: لا يوجد مزود لهذا النموذج يدعم معاملات الطلب (هنا response_format)
+_NO_ENDPOINT_HINT = "no endpoints found that can handle the requested parameters"
+
+
+def is_structured_output_rejection(status_code, body):
+    """هل رفض المزود الطلب بسبب response_format (وليس لسبب آخر مثل طول السياق)؟"""
+    if status_code not in REJECTION_STATUSES:
+        return False
+    try:
+        error = json.loads(body or "").get("error")
+    except (ValueError, AttributeError):
+        error = None
+    if isinstance(error, dict):
+        # شكل أخطاء OpenAI/OpenRouter: {"error": {"message", "code", "param", "metadata"}}
+        if str(error.get("param") or "").lower().startswith("response_format"):
+            return True
+        text = json.dumps(error, ensure_ascii=False).lower()
+    else:
+        text = (body or "").lower()
+    if status_code == 404:
+        return _NO_ENDPOINT_HINT in text
+    return any(hint in text for hint in _REJECTION_HINTS)
+
+
+class ModelCapabilityRegistry:
+    """
+    قدرات كل نموذج (وضع الـ structured output المدعوم) + إحصائيات تحليل الردود لكل نموذج
+    - الوضع الابتدائي من الإعدادات (AI_STRUCTURED_OUTPUT و AI_STRUCTURED_OUTPUT_MODELS)
+    - عند رفض المزود ننزل وضعاً ونحفظه في Django cache فتستفيد منه بقية العمليات
+    """
+
+    PARSE_OUTCOMES = ("strict", "recovered", "truncated", "repaired", "failed")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._parse_stats = {}
+        self._downgrades = {}
+
+    @staticmethod
+    def _configured_mode(model):
+        per_model = getattr(settings, "AI_STRUCTURED_OUTPUT_MODELS", {}) or {}
+        mode = per_model.get(model) or getattr(settings, "AI_STRUCTURED_OUTPUT", "json_schema")
+        if mode in ("off", False, None):
+            return "none"
+        return mode if mode in MODES else "none"
+
+    def mode_for(self, model):
+        configured = self._configured_mode(model)
+        learned = cache.get(CAPABILITY_CACHE_PREFIX + model)
+        if learned in MODES and MODES.index(learned) > MODES.index(configured):
+            return learned
+        return configured
+
+    def downgrade(self, model, rejected_mode):
+        """تسجيل أن النموذج رفض rejected_mode، ويعيد الوضع التالي الذي يجب تجربته"""
+        next_mode = MODES[min(MODES.index(rejected_mode) + 1, len(MODES) - 1)]
+        cache.set(CAPABILITY_CACHE_PREFIX + model, next_mode, timeout=CAPABILITY_CACHE_TTL)
+        with self._lock:
+            self._downgrades[model] = self._downgrades.get(model, 0) + 1
+        logger.warning("Model %s rejected response_format=%s; falling back to %s", model, rejected_mode, next_mode)
+        return next_mode
+
+    def record_parse(self, model, outcome):
+        with self._lock:
+            stats = self._parse_stats.setdefault(model, dict.fromkeys(self.PARSE_OUTCOMES, 0))
+            stats[outcome] = stats.get(outcome, 0) + 1
+
+    def stats(self):
+        with self._lock:
+            parse_stats = copy.deepcopy(self._parse_stats)
+            downgrades = dict(self._downgrades)
+
+        models = {}
+        for model in set(parse_stats) | set(downgrades) | {getattr(settings, "AI_MODEL", "")}:
+            if not model:
+                continue
+            counts = parse_stats.get(model, dict.fromkeys(self.PARSE_OUTCOMES, 0))
+            total = sum(counts.values())
+            models[model] = {
+                "mode": self.mode_for(model),
+                "downgrades": downgrades.get(model, 0),
+                "parse": counts,
+                "repair_rate": round((counts["repaired"] + counts["failed"]) / total, 4) if total else None,
+            }
+        return models
+
+
+model_capabilities = ModelCapabilityRegistry()
@@ -0,0 +1,108 @@
+import inspect
+import json
+import logging
+
+from django.conf import settings
+
+from .cache_utils import MISSING, TTLLRUCache
+from .catalog_version import get_catalog_version
+from .single_flight import tool_flight
+
+
+logger = logging.getLogger(__name__)
+
+
+# أدوات قراءة فقط تعتمد نتيجتها على بيانات الكتالوج ووسائطها فقط
+CACHEABLE_TOOLS = frozenset({
+    "search_destinations_and_hotels",
+    "search_events",
+    "get_destination_details",
+    "get_hotel_details",
+})
+
+
+def _normalize_value(value):
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    if isinstance(value, str):
+        return value.strip()
+    if isinstance(value, (list, tuple)):
+        return [_normalize_value(v) for v in value]
+    if isinstance(value, dict):
+        return {k: _normalize_value(v) for k, v in value.items()}
+    return value
+
+
+def normalize_tool_arguments(func, arguments):
+    """
+    توحيد وسائط الأداة: ربطها بتوقيع الدالة مع القيم الافتراضية
+    بحيث يعطي {"budget": 3000} و {"budget": 3000.0, "min_stars": 3} نفس المفتاح
+    """
+    bound = inspect.signature(func).bind(**arguments)
+    bound.apply_defaults()
+    return {k: _normalize_value(v) for k, v in bound.arguments.items()}
+
+
+class ToolResultCache:
+    """
+    كاش نتائج أدوات الـ Agent مشترك بين المستخدمين والجلسات داخل العملية
+    المفتاح = اسم الأداة + الوسائط الموحدة + رقم نسخة الكتالوج،
+    لذلك أي تعديل إداري (bump_catalog_version) يُبطل النتائج القديمة تلقائياً
+    """
+
+    def __init__(self, maxsize=1024, ttl=600):
+        self._cache = TTLLRUCache(maxsize=maxsize, ttl=ttl)
+        self.bypassed = 0
+
+    def make_key(self, tool_name, func, arguments):
+        normalized = normalize_tool_arguments(func, arguments)
+        return "%s:%s:%s" % (
+            tool_name,
+            get_catalog_version(),
+            json.dumps(normalized, sort_keys=True, ensure_ascii=False, default=str),
+        )
+
+    def get_or_compute(self, tool_name, func, arguments):
+        """
+        يعيد النتيجة من الكاش أو ينفذ الأداة ويخزن نتيجتها
+        (الاستدعاءات المتطابقة المتزامنة تنتظر تنفيذاً واحداً عبر tool_flight)
+        النتائج المخزنة مشتركة، لذلك يجب معاملتها كقيم للقراءة فقط
+        """
+        if tool_name not in CACHEABLE_TOOLS:
+            self.bypassed += 1
+            return func(**arguments)
+
+        try:
+            key = self.make_key(tool_name, func, arguments)
+        except TypeError:
+            # وسائط غير متوافقة مع توقيع الأداة: ننفذ مباشرة ليظهر نفس الخطأ المعتاد
+            self.bypassed += 1
+            return func(**arguments)
+
+        cached = self._cache.get(key)
+        if cached is not MISSING:
+            return cached
+
+        if getattr(settings, "AI_SINGLE_FLIGHT_ENABLED", True):
+            # نفس البحث من عدة جلسات في نفس اللحظة: استعلام واحد والباقي ينتظر نتيجته
+            result, shared = tool_flight.do(key, lambda: func(**arguments))
+        else:
+            result, shared = func(**arguments), False
+        if result is not None and not shared:
+            self._cache.set(key, result)
+        return result
+
+    def clear(self):
+        self._cache.clear()
+
+    def stats(self):
+        data = self._cache.stats()
+        data["bypassed"] = self.bypassed
+        data["catalog_version"] = get_catalog_version()
+        return data
+
+
+tool_result_cache = ToolResultCache(
+    maxsize=getattr(settings, "AI_TOOL_CACHE_SIZE", 1024),
+    ttl=getattr(settings, "AI_TOOL_CACHE_TTL", 600),
+)
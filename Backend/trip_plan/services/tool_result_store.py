@@ -0,0 +1,112 @@
+import hashlib
+import re
+import threading
+
+from django.conf import settings
+
+from ..models.travel_model import ToolResultBlob
+from .conversation_history import TOOL_RESULT_REF_PREFIX, compact_tool_content
+
+
+# طول المرجع المكتوب في السجل (أول 16 حرف hex من sha256 تكفي للتمييز ووفر الـ tokens)
+HANDLE_LENGTH = 16
+_REFERENCE_RE = re.compile(r"^%s([0-9a-f]{%d})\]" % (re.escape(TOOL_RESULT_REF_PREFIX), HANDLE_LENGTH))
+
+
+def content_digest(content):
+    return hashlib.sha256((content or "").encode("utf-8")).hexdigest()
+
+
+def make_reference(handle, content):
+    """نص رسالة role: tool المخزنة: المرجع + ملخص المعرفات والأسماء والتكاليف"""
+    return f"{TOOL_RESULT_REF_PREFIX}{handle}] {compact_tool_content(content)}"
+
+
+def parse_reference(content):
+    """المرجع من نص رسالة tool مخزنة خارجياً، أو None إذا كانت النتيجة كاملة في السجل"""
+    match = _REFERENCE_RE.match(content or "") if isinstance(content, str) else None
+    return match.group(1) if match else None
+
+
+class ToolResultStore:
+    """
+    تخزين نتائج الأدوات خارج ConversationSession.state (جدول ToolResultBlob):
+    - offload: قبل حفظ الجلسة تُستبدل نتائج الأدوات الكبيرة بمرجع + ملخص (النتيجة نفسها تُخزن مرة واحدة
+      حسب sha256، فنفس نتيجة البحث من عدة جلسات صف واحد)
+    - fetch: استرجاع النتيجة الكاملة بالمرجع (أداة get_tool_result)
+    الدور الحالي يستخدم النتائج الكاملة من الذاكرة، والتحويل يحدث عند الحفظ فقط
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.offloaded = 0
+        self.offloaded_chars = 0
+        self.fetched = 0
+        self.missing = 0
+
+    @staticmethod
+    def is_enabled():
+        return getattr(settings, "AI_TOOL_RESULT_OFFLOAD", True)
+
+    def offload(self, messages):
+        """يعيد قائمة رسائل جديدة (بدون تعديل الأصلية) مع استبدال نتائج الأدوات الكبيرة بمراجع"""
+        if not self.is_enabled():
+            return messages
+        min_chars = getattr(settings, "AI_TOOL_RESULT_OFFLOAD_MIN_CHARS", 300)
+
+        blobs = {}
+        result = []
+        for message in messages:
+            content = message.get("content")
+            if (
+                message.get("role") == "tool" and isinstance(content, str)
+                and len(content) >= min_chars and parse_reference(content) is None
+            ):
+                digest = content_digest(content)
+                blobs[digest] = ToolResultBlob(
+                    digest=digest, tool_name=message.get("name") or "", content=content, size=len(content)
+                )
+                message = dict(message, content=make_reference(digest[:HANDLE_LENGTH], content))
+                with self._lock:
+                    self.offloaded += 1
+                    self.offloaded_chars += len(content) - len(message["content"])
+            result.append(message)
+
+        if blobs:
+            # استعلام واحد لكل حفظ؛ النتائج الموجودة مسبقاً (نفس الـ digest) تُتجاهل
+            ToolResultBlob.objects.bulk_create(blobs.values(), ignore_conflicts=True)
+        return result
+
+    def fetch(self, handle):
+        """النص الكامل لنتيجة أداة مخزنة، أو None"""
+        handle = (handle or "").strip().lower()
+        match = _REFERENCE_RE.match(handle)
+        if match:
+            handle = match.group(1)
+        if not re.fullmatch(r"[0-9a-f]{%d,64}" % HANDLE_LENGTH, handle):
+            content = None
+        else:
+            content = (
+                ToolResultBlob.objects.filter(digest__startswith=handle)
+                .values_list("content", flat=True)
+                .first()
+            )
+        with self._lock:
+            if content is None:
+                self.missing += 1
+            else:
+                self.fetched += 1
+        return content
+
+    def stats(self):
+        with self._lock:
+            return {
+                "enabled": self.is_enabled(),
+                "offloaded": self.offloaded,
+                "offloaded_chars": self.offloaded_chars,
+                "fetched": self.fetched,
+                "missing": self.missing,
+            }
+
+
+tool_result_store = ToolResultStore()
@@ -1,3 +1,280 @@
-from django.test import TestCase
+import random
+from datetime import timedelta
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+
+from .management.commands.benchmark_json_recovery import MUTATIONS, SEED_OUTPUTS, _split
+from .models.travel_model import AgentJob, ConversationSession, Destination, Hotel
+from .services.admin_crud_service import AdminCRUDService
+from .services.agent_jobs import AgentJobQueue
+from .services.ai_agent_service import TravelAgentService
+from .services.catalog_index import CatalogIndex, trip_costs
+from .services.json_recovery import recover_json_object, recover_json_with_mode
+from .services.requirements_extractor import extract_requirements
+from .services.stream_parser import TrailingJSONStreamParser
+
+
+class RecoverJSONWithModeTests(SimpleTestCase):
+    """نفس عينات وتعديلات أمر benchmark_json_recovery: كل رد مشوه يجب أن يُسترجع"""
+
+    def test_seed_outputs_have_status(self):
+        for text in SEED_OUTPUTS:
+            with self.subTest(text=text[:40]):
+                data, mode = recover_json_with_mode(text, record=False)
+                self.assertIn("status", data)
+                self.assertIn(mode, ("strict", "recovered"))
+
+    def test_mutations_are_recovered(self):
+        rng = random.Random(7)
+        for text in SEED_OUTPUTS:
+            expected = recover_json_object(text, record=False)
+            prose, body = _split(text, expected)
+            for name, mutate in MUTATIONS.items():
+                malformed = mutate(prose, body, expected, rng)
+                with self.subTest(mutation=name, text=text[:40]):
+                    data, mode = recover_json_with_mode(malformed, record=False)
+                    if name == "truncated":
+                        # الرد المقطوع: يكفي استرجاع status
+                        self.assertEqual(mode, "truncated")
+                        self.assertEqual(data["status"], expected["status"])
+                    else:
+                        self.assertEqual(data, expected)
+                        self.assertNotEqual(mode, "failed")
+
+    def test_plain_json_is_strict(self):
+        data, mode = recover_json_with_mode('{"status": "gather_info", "message": "كم يوماً؟"}', record=False)
+        self.assertEqual(mode, "strict")
+        self.assertEqual(data["message"], "كم يوماً؟")
+
+    def test_no_json(self):
+        self.assertEqual(recover_json_with_mode("", record=False), (None, "failed"))
+        self.assertEqual(recover_json_with_mode("مرحبا بك", record=False), (None, "failed"))
+
+
+class ExtractRequirementsTests(SimpleTestCase):
+
+    def assertExtracts(self, text, values, unambiguous=True, awaiting_field=None):
+        self.assertEqual(extract_requirements(text, awaiting_field), (values, unambiguous))
+
+    def test_units_and_arabic_digits(self):
+        self.assertExtracts("ميزانيتي ٣٠٠٠ دولار لمدة ٥ أيام", {"budget": 3000, "days": 5})
+        self.assertExtracts("3 آلاف دولار لأسبوع", {"budget": 3000, "days": 7})
+        self.assertExtracts("3,500$ ثلاثة أشخاص", {"budget": 3500, "people": 3})
+        self.assertExtracts("فندق 4 نجوم", {"min_stars": 4})
+
+    def test_article_prefixed_filler(self):
+        self.assertExtracts("والميزانية 3000 دولار", {"budget": 3000})
+
+    def test_bare_number_answers_awaiting_field(self):
+        self.assertExtracts("٥", {"days": 5}, awaiting_field="days")
+        self.assertExtracts("٥", {}, unambiguous=False)
+
+    def test_destination_preference(self):
+        self.assertExtracts("جبلية", {"is_coastal": False})
+        self.assertExtracts("لا يهم", {"is_coastal": None}, awaiting_field="is_coastal")
+        self.assertExtracts("لا يهم", {}, unambiguous=False, awaiting_field="days")
+        self.assertExtracts("ليس ساحلية", {"is_coastal": True}, unambiguous=False)
+
+    def test_unused_numbers_are_ambiguous(self):
+        self.assertExtracts("نحن 4 وميزانيتنا 2000 دولار", {"budget": 2000}, unambiguous=False)
+        self.assertExtracts("من 2000 الى 3000 دولار", {"budget": 3000}, unambiguous=False)
+        self.assertExtracts("1500 دولار للشخص", {"budget": 1500}, unambiguous=False)
+
+    def test_questions_and_unknown_words_are_ambiguous(self):
+        self.assertExtracts("هل يوجد فندق 5 نجوم؟", {"min_stars": 5}, unambiguous=False)
+        self.assertExtracts("أريد الذهاب إلى دبي 3000 دولار", {"budget": 3000}, unambiguous=False)
+        self.assertExtracts("0 دولار", {"budget": 0}, unambiguous=False)
+
+
+class TrailingJSONStreamParserTests(SimpleTestCase):
+    REPLY = (
+        'إليك الخيارات:\n```json\n'
+        '{"status": "options_presented", "message": "وجدت \\"خيارين\\"\\nاختر \\u0031", '
+        '"options": [{"message": "لا يُبث"}]}\n```'
+    )
+
+    def feed(self, chunks):
+        parser = TrailingJSONStreamParser()
+        prose, message = [], []
+        for chunk in chunks:
+            new_prose, new_message = parser.feed(chunk)
+            prose.append(new_prose)
+            message.append(new_message)
+        return parser, "".join(prose), "".join(message)
+
+    def test_split_is_independent_of_chunking(self):
+        for size in (1, 3, 7, len(self.REPLY)):
+            chunks = [self.REPLY[i:i + size] for i in range(0, len(self.REPLY), size)]
+            with self.subTest(chunk_size=size):
+                parser, prose, message = self.feed(chunks)
+                self.assertEqual(prose.strip(), "إليك الخيارات:")
+                # فقط حقل message في المستوى الأعلى، بعد فك الـ escapes
+                self.assertEqual(message, 'وجدت "خيارين"\nاختر 1')
+                self.assertTrue(parser.json_complete)
+                self.assertEqual(parser.text, self.REPLY)
+
+    def test_tool_call_block_is_not_prose(self):
+        _, prose, message = self.feed([
+            "أبحث لك <tool_", 'call>{"name": "search_events"}</tool_call> الآن', ' {"message": "تم"}',
+        ])
+        self.assertEqual(prose, "أبحث لك  الآن ")
+        self.assertEqual(message, "تم")
+
+    def test_other_tags_stay_in_prose(self):
+        _, prose, _ = self.feed(["السعر <100 دولار"])
+        self.assertEqual(prose, "السعر <100 دولار")
+
+
+class CatalogIndexSearchTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        coastal = Destination.objects.create(
+            name="Coast", country="C", flight_cost=300, daily_living_cost=50, is_coastal=True,
+            description="d", best_seasons="صيف,ربيع",
+        )
+        mountain = Destination.objects.create(
+            name="Mountain", country="C", flight_cost=200, daily_living_cost=40, is_coastal=False,
+            description="d", best_seasons="شتاء",
+        )
+        for index, (stars, price) in enumerate([(3, 80), (4, 120), (5, 300), (2, 40), (4, 90), (3, 60)]):
+            Hotel.objects.create(
+                destination=coastal if index % 2 == 0 else mountain, name=f"H{index}",
+                stars=stars, price_per_night=price, is_sea_view=index % 2 == 0,
+            )
+
+    def setUp(self):
+        CatalogIndex.invalidate()
+
+    def search_ids(self, **filters):
+        return [row["id"] for row in CatalogIndex.search(**filters)]
+
+    def test_filters(self):
+        hotels = Hotel.objects.all()
+        self.assertCountEqual(self.search_ids(min_stars=4), [h.id for h in hotels if h.stars >= 4])
+        self.assertCountEqual(
+            self.search_ids(min_stars=1, is_coastal=True),
+            [h.id for h in hotels if h.destination.is_coastal],
+        )
+        self.assertCountEqual(
+            self.search_ids(min_stars=1, is_sea_view=False), [h.id for h in hotels if not h.is_sea_view]
+        )
+        self.assertCountEqual(
+            self.search_ids(min_stars=1, season="winter"),
+            [h.id for h in hotels if h.destination.name == "Mountain"],
+        )
+        self.assertCountEqual(self.search_ids(min_stars=1, season="all"), [h.id for h in hotels])
+
+    def test_budget_filters_and_orders_by_cost(self):
+        expected = sorted(
+            (
+                (trip_costs(float(h.destination.flight_cost), float(h.destination.daily_living_cost),
+                            float(h.price_per_night), 5, 2), h.id)
+                for h in Hotel.objects.select_related("destination")
+            ),
+        )
+        within = [hotel_id for cost, hotel_id in expected if cost <= 2000]
+        self.assertEqual(self.search_ids(budget=2000, days=5, people=2, min_stars=1), within)
+        # top-k يعطي نفس أول k من الترتيب الكامل
+        self.assertEqual(self.search_ids(budget=2000, days=5, people=2, min_stars=1, limit=2), within[:2])
+
+    def test_paging_matches_db_backend(self):
+        def pages(**settings_overrides):
+            with self.settings(**settings_overrides):
+                collected = []
+                offset = 0
+                while True:
+                    page = TravelAgentService.search_destinations_and_hotels(
+                        budget=5000, days=5, people=2, min_stars=1, limit=2, offset=offset,
+                    )
+                    collected.append([result["hotel_id"] for result in page["results"]])
+                    if not page["has_more"]:
+                        return collected
+                    offset += page["limit"]
+
+        index_pages = pages(AI_SEARCH_BACKEND="index")
+        self.assertEqual([len(page) for page in index_pages], [2, 2, 2])
+        self.assertEqual(len({hotel_id for page in index_pages for hotel_id in page}), 6)
+        self.assertEqual(index_pages, pages(AI_SEARCH_BACKEND="db"))
+
+    def test_admin_update_is_seen_by_next_search(self):
+        hotel = Hotel.objects.get(stars=5)
+        self.assertEqual(self.search_ids(min_stars=5), [hotel.id])
+        # رقم نسخة الكتالوج يزيد بعد الـ commit فيُعاد بناء الفهرس في البحث التالي
+        with self.captureOnCommitCallbacks(execute=True):
+            AdminCRUDService.update_hotel(hotel.id, {"stars": 1})
+        self.assertEqual(self.search_ids(min_stars=5), [])
+
+
+@override_settings(AI_JOB_MAX_ATTEMPTS=2, AI_JOB_STALE_AFTER=60)
+class AgentJobQueueClaimTests(TestCase):
+
+    def setUp(self):
+        self.queue = AgentJobQueue()
+        self.user = get_user_model().objects.create_user("traveller", password="p")
+
+    def make_job(self, **fields):
+        session = ConversationSession.objects.create(user=self.user, session_id=f"s{AgentJob.objects.count()}")
+        job = AgentJob.objects.create(session=session, user=self.user)
+        if fields:
+            AgentJob.objects.filter(pk=job.pk).update(**fields)
+            job.refresh_from_db()
+        return job
+
+    def test_claims_oldest_pending_job(self):
+        first = self.make_job()
+        second = self.make_job()
+
+        claimed = self.queue.claim("w1")
+        self.assertEqual(claimed.pk, first.pk)
+        self.assertEqual((claimed.status, claimed.worker, claimed.attempts), (AgentJob.STATUS_RUNNING, "w1", 1))
+        self.assertEqual(self.queue.claim("w2").pk, second.pk)
+        self.assertIsNone(self.queue.claim("w3"))
+
+    def test_enqueue_reuses_active_job(self):
+        job = self.make_job()
+        self.assertEqual(self.queue.enqueue(job.session).pk, job.pk)
+
+    def test_reclaims_stale_running_job(self):
+        stale = self.make_job(
+            status=AgentJob.STATUS_RUNNING, attempts=1, started_at=timezone.now() - timedelta(seconds=120),
+        )
+        self.make_job(status=AgentJob.STATUS_RUNNING, attempts=1, started_at=timezone.now())
+
+        claimed = self.queue.claim("w1")
+        self.assertEqual(claimed.pk, stale.pk)
+        self.assertEqual(claimed.attempts, 2)
+        self.assertIsNone(self.queue.claim("w2"))
+
+    def test_gives_up_after_max_attempts(self):
+        exhausted = self.make_job(
+            status=AgentJob.STATUS_RUNNING, attempts=2, started_at=timezone.now() - timedelta(seconds=120),
+        )
+        self.assertIsNone(self.queue.claim("w1"))
+        exhausted.refresh_from_db()
+        self.assertEqual(exhausted.status, AgentJob.STATUS_FAILED)
+
+    def test_fail_retries_then_fails(self):
+        self.make_job()
+        job = self.queue.claim("w1")
+        self.assertFalse(self.queue.fail(job, "timeout"))
+        job = self.queue.claim("w1")
+        self.assertTrue(self.queue.fail(job, "timeout"))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (AgentJob.STATUS_FAILED, 2))
+
+    def test_dropped_job_is_not_claimed_again(self):
+        self.make_job()
+        job = self.queue.claim("w1")
+        self.queue.drop(job, "No pending tool calls in session")
+        self.assertIsNone(self.queue.claim("w1"))
+        self.assertEqual(self.queue.dropped, 1)
+
+    def test_finishing_a_job_deleted_with_its_session(self):
+        self.make_job()
+        job = self.queue.claim("w1")
+        job.session.delete()
+        self.queue.complete(job, {"status": "options_presented"})
+        self.assertFalse(AgentJob.objects.filter(pk=job.pk).exists())
@@ -2,8 +2,8 @@ from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from rest_framework_simplejwt.views import TokenRefreshView
 from .views.auth_view import RegisterView, LoginView
-from .views.admin_view import AdminDestinationViewSet, AdminHotelViewSet, AdminEventViewSet
-from .views.travel_view import AIChatPlanView
+from .views.admin_view import AdminDestinationViewSet, AdminHotelViewSet, AdminEventViewSet, AdminAIMetricsView
+from .views.travel_view import AIChatPlanView, AIChatStreamView, AIChatPlanAsyncView, AIChatJobView
 
 # إعداد الـ Router لعمليات الـ CRUD (إضافة، تعديل، حذف، عرض)
 router = DefaultRouter()
@@ -19,6 +19,12 @@ urlpatterns = [
 
     # --- روابط الذكاء الاصطناعي (AI Chat) ---
     path('ai/chat/', AIChatPlanView.as_view(), name='ai_chat_plan'),
+    path('ai/chat/stream/', AIChatStreamView.as_view(), name='ai_chat_stream'),
+    path('ai/chat/async/', AIChatPlanAsyncView.as_view(), name='ai_chat_async'),
+    path('ai/chat/jobs/<uuid:job_id>/', AIChatJobView.as_view(), name='ai_chat_job'),
+
+    # --- مؤشرات أداء خدمة الذكاء الاصطناعي (للأدمن) ---
+    path('admin/ai-metrics/', AdminAIMetricsView.as_view(), name='admin_ai_metrics'),
 
     # --- دمج روابط الـ CRUD التابعة للـ Router ---
     path('', include(router.urls)),
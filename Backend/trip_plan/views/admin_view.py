@@ -1,8 +1,10 @@
 from rest_framework import viewsets, permissions, status
 from rest_framework.response import Response
+from rest_framework.views import APIView
 from ..models.travel_model import Destination, Hotel, ImageAsset, Event
 from ..serializers.travel_serializer import DestinationSerializer, HotelSerializer, ImageSerializer, EventSerializer
 from ..services.admin_crud_service import AdminCRUDService
+from ..services.ai_metrics import collect_ai_metrics
 
 # 1. تعريف صلاحية مخصصة للتحقق من أن المستخدم هو Admin نصياً
 class IsAdminUserRole(permissions.BasePermission):
@@ -75,6 +77,19 @@ class AdminHotelViewSet(viewsets.ModelViewSet):
 
         out = self.get_serializer(hotel)
         return Response(out.data, status=status.HTTP_201_CREATED)
+
+    def update(self, request, *args, **kwargs):
+        """التعديل عبر الخدمة (إضافة صور جديدة وتحديث نسخة الكتالوج)"""
+        partial = kwargs.pop('partial', False)
+        instance = self.get_object()
+        serializer = self.get_serializer(instance, data=request.data, partial=partial)
+        serializer.is_valid(raise_exception=True)
+
+        images = request.FILES.getlist('images') if hasattr(request.FILES, 'getlist') else []
+        hotel = AdminCRUDService.update_hotel(instance.id, serializer.validated_data, new_images=images)
+
+        out = self.get_serializer(hotel)
+        return Response(out.data)
     
     def destroy(self, request, *args, **kwargs):
         """تخصيص الحذف لإرجاع رسالة توضيحية"""
@@ -100,6 +115,15 @@ class AdminImageViewSet(viewsets.ModelViewSet):
     permission_classes = [IsAdminUserRole]
     # يتيح هذا المسار حذف صورة واحدة فقط عبر ID الخاص بها (RE-FR-16)
 
+    def perform_create(self, serializer):
+        AdminCRUDService.save_image(serializer)
+
+    def perform_update(self, serializer):
+        AdminCRUDService.save_image(serializer)
+
+    def perform_destroy(self, instance):
+        AdminCRUDService.delete_image(instance.id)
+
 # 5. واجهة التحكم بالفعاليات (CRUD)
 class AdminEventViewSet(viewsets.ModelViewSet):
     queryset = Event.objects.all()
@@ -129,4 +153,11 @@ class AdminEventViewSet(viewsets.ModelViewSet):
         return Response({
             "message": "تم حذف الفعالية بنجاح",
             "deleted_event": {"id": event_id, "name": event_name}
-        }, status=status.HTTP_200_OK)
\ No newline at end of file
+        }, status=status.HTTP_200_OK)
+
+# 6. مؤشرات أداء خدمة الذكاء الاصطناعي (كاش الأدوات وغيرها) للعملية الحالية
+class AdminAIMetricsView(APIView):
+    permission_classes = [IsAdminUserRole]
+
+    def get(self, request):
+        return Response(collect_ai_metrics(), status=status.HTTP_200_OK)
\ No newline at end of file
@@ -1,12 +1,112 @@
 import json
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import JsonResponse, StreamingHttpResponse
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status, permissions
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
 from ..services.ai_agent_service import TravelAgentService
-from ..models.travel_model import Destination, Hotel, Event
+from ..services.concurrency import run_in_worker_thread
+from ..services.admission_control import AdmissionRejected, admission_control
+from ..models.travel_model import Destination, Hotel, Event, AgentJob
 from ..serializers.travel_serializer import DestinationSerializer, HotelSerializer, EventSerializer
 from ..serializers.ai_serializer import AIStructuredResponseSerializer
 
+def build_chat_response(ai_response, request):
+    """
+    معالجة رد خدمة الـ AI قبل إرساله للفرونت (مشتركة بين الـ endpoint العادي والـ streaming)
+
+    Returns:
+        (البيانات, رمز حالة HTTP)
+    """
+    # في حال وجود خطأ من خدمة الـ AI نرجعه مباشرة
+    if ai_response.get("status") == "error":
+        return ai_response, status.HTTP_200_OK
+
+    # التحقق من البنية العامة للرد باستخدام الـ Serializer
+    serializer = AIStructuredResponseSerializer(data=ai_response)
+    if not serializer.is_valid():
+        return (
+            {
+                "status": "error",
+                "message": "الرد القادم من خدمة الذكاء الاصطناعي غير متوافق مع الـ spec.",
+                "details": serializer.errors,
+            },
+            status.HTTP_500_INTERNAL_SERVER_ERROR,
+        )
+
+    ai_json = serializer.validated_data
+
+    # معالجة حالة تأكيد الخطة النهائية: plan_confirmed
+    if ai_json.get('status') == 'plan_confirmed':
+        plan = ai_json.get('selected_plan', {})
+        dest_id = plan.get('destination_id')
+        hotel_id = plan.get('hotel_id')
+
+        destination = Destination.objects.filter(id=dest_id).first()
+        hotel = Hotel.objects.filter(id=hotel_id).first()
+
+        if destination and hotel:
+            ai_json['visual_data'] = {
+                "destination": DestinationSerializer(destination, context={'request': request}).data,
+                "hotel": HotelSerializer(hotel, context={'request': request}).data
+            }
+
+            selected_events = plan.get('events')
+            selected_event_ids = []
+            if isinstance(selected_events, list):
+                for item in selected_events:
+                    if isinstance(item, dict) and item.get('event_id') is not None:
+                        selected_event_ids.append(item.get('event_id'))
+
+            if selected_event_ids:
+                events_qs = Event.objects.filter(id__in=selected_event_ids, destination_id=destination.id)
+            else:
+                events_qs = destination.events.all()
+
+            ai_json['visual_data']['events'] = EventSerializer(
+                events_qs, many=True, context={'request': request}
+            ).data
+        else:
+            ai_json['status'] = 'missing_info'
+            ai_json['message'] = "عذراً، الوجهة أو الفندق المختار غير متوفر حالياً في قاعدة بياناتنا."
+
+    # تأكد من إعادة session_id للفرونت ليستمر بنفس الجلسة
+    if 'session_id' not in ai_json and isinstance(ai_response, dict) and ai_response.get('session_id'):
+        ai_json['session_id'] = ai_response['session_id']
+
+    # وضع searching: معرف المهمة الخلفية التي يُنتظر منها الرد (ai/chat/jobs/<job_id>/)
+    if isinstance(ai_response, dict) and ai_response.get('job_id'):
+        ai_json['job_id'] = ai_response['job_id']
+
+    return ai_json, status.HTTP_200_OK
+
+
+def admission_rejected_response(rejection):
+    """(البيانات, الترويسات) لرد 429 عند رفض الطلب من admission_control"""
+    if rejection.reason == "user_limit":
+        message = "لديك طلب قيد التنفيذ بالفعل، انتظر انتهاءه ثم أعد المحاولة"
+    else:
+        message = "الخدمة مشغولة حالياً، الرجاء إعادة المحاولة بعد قليل"
+    data = {
+        "status": "error",
+        "error": message,
+        "reason": rejection.reason,
+        "retry_after": rejection.retry_after,
+    }
+    return data, {"Retry-After": str(rejection.retry_after)}
+
+
+def _sse_event(event, data):
+    """تنسيق حدث Server-Sent Events واحد"""
+    payload = json.dumps(data, ensure_ascii=False, cls=DjangoJSONEncoder)
+    return f"event: {event}\ndata: {payload}\n\n"
+
+
 class AIChatPlanView(APIView):
     # حماية المسار: فقط المستخدمين المسجلين يمكنهم الدردشة مع الـ AI
     permission_classes = [permissions.IsAuthenticated]
@@ -18,64 +118,175 @@ class AIChatPlanView(APIView):
         if not user_input:
             return Response({"error": "الرجاء إدخال نص للبدء"}, status=status.HTTP_400_BAD_REQUEST)
 
+        # حد الطلبات المتزامنة (لكل مستخدم وللخدمة) قبل حجز الـ worker طوال الدور
+        try:
+            slot = admission_control.acquire(request.user.pk)
+        except AdmissionRejected as rejection:
+            data, headers = admission_rejected_response(rejection)
+            return Response(data, status=status.HTTP_429_TOO_MANY_REQUESTS, headers=headers)
+
         # استدعاء خدمة الـ AI Agent مع ربط المستخدم والجلسة
-        agent_service = TravelAgentService(user=request.user)
-        ai_response = agent_service.run(user_input, session_id=session_id)
-
-        # في حال وجود خطأ من خدمة الـ AI نرجعه مباشرة
-        if ai_response.get("status") == "error":
-            return Response(ai_response, status=status.HTTP_200_OK)
-
-        # التحقق من البنية العامة للرد باستخدام الـ Serializer
-        serializer = AIStructuredResponseSerializer(data=ai_response)
-        if not serializer.is_valid():
-            return Response(
-                {
-                    "status": "error",
-                    "message": "الرد القادم من خدمة الذكاء الاصطناعي غير متوافق مع الـ spec.",
-                    "details": serializer.errors,
-                },
-                status=status.HTTP_500_INTERNAL_SERVER_ERROR,
+        try:
+            agent_service = TravelAgentService(user=request.user)
+            ai_response = agent_service.run(user_input, session_id=session_id)
+        finally:
+            slot.release()
+
+        data, http_status = build_chat_response(ai_response, request)
+        return Response(data, status=http_status)
+
+
+class AdmissionStreamingResponse(StreamingHttpResponse):
+    """
+    StreamingHttpResponse يحرر مقعد admission عند إغلاقه من الخادم،
+    حتى إن لم تُقرأ الـ stream أبداً (خطأ قبل أول chunk أو انقطاع العميل قبل بدء البث)
+    """
+
+    def __init__(self, *args, slot, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.slot = slot
+
+    def close(self):
+        try:
+            super().close()
+        finally:
+            self.slot.release()
+
+
+class AIChatStreamView(APIView):
+    """
+    نسخة streaming من /api/ai/chat/ عبر Server-Sent Events:
+    تقدم جولات الأدوات، النص الجزئي أثناء التوليد، ثم الرد المنظم النهائي في حدث final
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request):
+        user_input = request.data.get('prompt') or request.data.get('message')
+        session_id = request.data.get('session_id')
+
+        if not user_input:
+            return Response({"error": "الرجاء إدخال نص للبدء"}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            slot = admission_control.acquire(request.user.pk)
+        except AdmissionRejected as rejection:
+            data, headers = admission_rejected_response(rejection)
+            return Response(data, status=status.HTTP_429_TOO_MANY_REQUESTS, headers=headers)
+
+        def event_stream():
+            # المقعد محجوز حتى انتهاء الـ stream؛ إغلاق الـ response يحرره أيضاً إن لم تبدأ
+            try:
+                for event, data in agent_service.run_stream(user_input, session_id=session_id):
+                    if event == "final":
+                        data, _ = build_chat_response(data, request)
+                        if data.get("status") == "error":
+                            event = "error"
+                    yield _sse_event(event, data)
+            finally:
+                slot.release()
+
+        try:
+            agent_service = TravelAgentService(user=request.user)
+            response = AdmissionStreamingResponse(event_stream(), slot=slot, content_type='text/event-stream')
+        except BaseException:
+            slot.release()
+            raise
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'  # منع الـ buffering في nginx
+        return response
+
+
+def _authenticate_jwt(request):
+    """نفس مصادقة DRF (JWT) لكن لـ Django view عادي؛ يعيد المستخدم أو None"""
+    try:
+        result = JWTAuthentication().authenticate(request)
+    except AuthenticationFailed:
+        return None
+    return result[0] if result else None
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AIChatPlanAsyncView(View):
+    """
+    نسخة async من AIChatPlanView لمسار ASGI (core/asgi.py):
+    انتظار مزود الـ LLM يتم عبر event loop بدل حجز worker thread طوال المحادثة
+    """
+
+    async def post(self, request):
+        user = await run_in_worker_thread(_authenticate_jwt, request)
+        if user is None or not user.is_active:
+            return JsonResponse(
+                {"detail": "Authentication credentials were not provided or are invalid."},
+                status=status.HTTP_401_UNAUTHORIZED,
             )
 
-        ai_json = serializer.validated_data
-
-        # معالجة حالة تأكيد الخطة النهائية: plan_confirmed
-        if ai_json.get('status') == 'plan_confirmed':
-            plan = ai_json.get('selected_plan', {})
-            dest_id = plan.get('destination_id')
-            hotel_id = plan.get('hotel_id')
-
-            destination = Destination.objects.filter(id=dest_id).first()
-            hotel = Hotel.objects.filter(id=hotel_id).first()
-
-            if destination and hotel:
-                ai_json['visual_data'] = {
-                    "destination": DestinationSerializer(destination, context={'request': request}).data,
-                    "hotel": HotelSerializer(hotel, context={'request': request}).data
-                }
-
-                selected_events = plan.get('events')
-                selected_event_ids = []
-                if isinstance(selected_events, list):
-                    for item in selected_events:
-                        if isinstance(item, dict) and item.get('event_id') is not None:
-                            selected_event_ids.append(item.get('event_id'))
-
-                if selected_event_ids:
-                    events_qs = Event.objects.filter(id__in=selected_event_ids, destination_id=destination.id)
-                else:
-                    events_qs = destination.events.all()
-
-                ai_json['visual_data']['events'] = EventSerializer(
-                    events_qs, many=True, context={'request': request}
-                ).data
-            else:
-                ai_json['status'] = 'missing_info'
-                ai_json['message'] = "عذراً، الوجهة أو الفندق المختار غير متوفر حالياً في قاعدة بياناتنا."
+        try:
+            body = json.loads(request.body or b'{}')
+        except ValueError:
+            body = None
+        if not isinstance(body, dict):
+            return JsonResponse({"error": "صيغة الطلب غير صحيحة"}, status=status.HTTP_400_BAD_REQUEST)
+
+        user_input = body.get('prompt') or body.get('message')
+        session_id = body.get('session_id')
+
+        if not user_input:
+            return JsonResponse(
+                {"error": "الرجاء إدخال نص للبدء"},
+                status=status.HTTP_400_BAD_REQUEST,
+                json_dumps_params={'ensure_ascii': False},
+            )
+
+        try:
+            slot = await admission_control.aacquire(user.pk)
+        except AdmissionRejected as rejection:
+            data, headers = admission_rejected_response(rejection)
+            return JsonResponse(
+                data,
+                status=status.HTTP_429_TOO_MANY_REQUESTS,
+                headers=headers,
+                json_dumps_params={'ensure_ascii': False},
+            )
+
+        try:
+            agent_service = TravelAgentService(user=user)
+            ai_response = await agent_service.arun(user_input, session_id=session_id)
+        finally:
+            await admission_control.arelease(slot)
+
+        data, http_status = await run_in_worker_thread(build_chat_response, ai_response, request)
+        return JsonResponse(
+            data,
+            status=http_status,
+            encoder=DjangoJSONEncoder,
+            json_dumps_params={'ensure_ascii': False},
+        )
+
+
+class AIChatJobView(APIView):
+    """
+    نتيجة دور وضع searching الذي يكمله run_agent_worker في الخلفية (polling):
+    202 مع حالة searching ما دامت المهمة قيد الانتظار/التنفيذ، ثم نفس رد /api/ai/chat/
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request, job_id):
+        job = AgentJob.objects.select_related('session').filter(job_id=job_id, user=request.user).first()
+        if job is None:
+            return Response({"error": "المهمة غير موجودة"}, status=status.HTTP_404_NOT_FOUND)
 
-        # تأكد من إعادة session_id للفرونت ليستمر بنفس الجلسة
-        if 'session_id' not in ai_json and isinstance(ai_response, dict) and ai_response.get('session_id'):
-            ai_json['session_id'] = ai_response['session_id']
+        if job.status in (AgentJob.STATUS_PENDING, AgentJob.STATUS_RUNNING):
+            agent_service = TravelAgentService(user=request.user)
+            data = agent_service.searching_response(job.session, job.session.state.get('requirements') or {}, job)
+            data["job_status"] = job.status
+            return Response(data, status=status.HTTP_202_ACCEPTED)
 
-        return Response(ai_json, status=status.HTTP_200_OK)
\ No newline at end of file
+        ai_response = job.result or {
+            "status": "error",
+            "message": f"تعذر إكمال البحث: {job.error}",
+            "session_id": job.session.session_id,
+        }
+        data, http_status = build_chat_response(ai_response, request)
+        data["job_id"] = str(job.job_id)
+        data["job_status"] = job.status
+        return Response(data, status=http_status)